@@ -0,0 +1,153 @@
+"""
+SQLite接続管理
+スレッドごとに1本の接続を保持して再利用し、WALモードと各種PRAGMAを設定する機能群
+"""
+import os
+import sqlite3
+import threading
+import weakref
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+# PRAGMA設定の既定値（環境変数 SQLITE_* で上書き可能）
+DEFAULT_BUSY_TIMEOUT_MS = 5000
+DEFAULT_CACHE_SIZE_KB = 16384  # ページキャッシュ 16MB
+DEFAULT_MMAP_SIZE = 64 * 1024 * 1024  # メモリマップ 64MB
+DEFAULT_SYNCHRONOUS = 'NORMAL'
+
+# 接続ごとにキャッシュするプリペアドステートメント数
+STATEMENT_CACHE_SIZE = 256
+
+
+class ConnectionManager:
+    """スレッドローカルなSQLite接続を管理するクラス
+
+    Streamlitはセッションごとに別スレッドでスクリプトを実行するため、
+    スレッド単位で接続を保持すれば接続を共有せずに再利用できる。
+    接続はautocommitモードで開き、書き込みは transaction() で明示的に囲む。
+    """
+
+    def __init__(self, db_path: str, busy_timeout_ms: Optional[int] = None,
+                 cache_size_kb: Optional[int] = None, mmap_size: Optional[int] = None,
+                 synchronous: Optional[str] = None):
+        self.db_path = db_path
+        # 引数が省略された場合は環境変数（.env）→既定値の順に参照する
+        self.busy_timeout_ms = busy_timeout_ms if busy_timeout_ms is not None else int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', DEFAULT_BUSY_TIMEOUT_MS))
+        self.cache_size_kb = cache_size_kb if cache_size_kb is not None else int(os.getenv('SQLITE_CACHE_SIZE_KB', DEFAULT_CACHE_SIZE_KB))
+        self.mmap_size = mmap_size if mmap_size is not None else int(os.getenv('SQLITE_MMAP_SIZE', DEFAULT_MMAP_SIZE))
+        self.synchronous = synchronous or os.getenv('SQLITE_SYNCHRONOUS', DEFAULT_SYNCHRONOUS)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # スレッドID -> (スレッドへの弱参照, 接続)。終了したスレッドの接続を閉じるために保持
+        self._connections: Dict[int, Tuple[weakref.ref, sqlite3.Connection]] = {}
+
+    def _connect(self) -> sqlite3.Connection:
+        """新しい接続を開き、PRAGMAを設定します。"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout_ms / 1000,
+            isolation_level=None,  # autocommit（トランザクションは明示的に開始する）
+            check_same_thread=False,  # 終了済みスレッドの接続を別スレッドから閉じるため
+            cached_statements=STATEMENT_CACHE_SIZE
+        )
+        conn.row_factory = sqlite3.Row  # カラム名でアクセスできるようにする
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+        except sqlite3.OperationalError as e:
+            # 他プロセスが排他ロック中などでWALに切り替えられない場合も接続自体は利用する
+            print(f"WALモードの設定に失敗しました: {str(e)}")
+        conn.execute(f'PRAGMA busy_timeout={int(self.busy_timeout_ms)}')
+        conn.execute(f'PRAGMA synchronous={self.synchronous}')
+        conn.execute(f'PRAGMA cache_size={-int(self.cache_size_kb)}')  # 負の値はKiB単位
+        conn.execute(f'PRAGMA mmap_size={int(self.mmap_size)}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        return conn
+
+    def _prune_dead_threads(self):
+        """終了したスレッドが保持していた接続を閉じます（呼び出し元で self._lock を取得済みであること）。"""
+        for ident, (thread_ref, conn) in list(self._connections.items()):
+            thread = thread_ref()
+            if thread is None or not thread.is_alive():
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+                del self._connections[ident]
+
+    def get_connection(self) -> sqlite3.Connection:
+        """現在のスレッド用の接続を取得します（初回のみ接続を確立）。"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            return conn
+
+        conn = self._connect()
+        self._local.conn = conn
+        with self._lock:
+            self._prune_dead_threads()
+            self._connections[threading.get_ident()] = (weakref.ref(threading.current_thread()), conn)
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """書き込みトランザクション（BEGIN IMMEDIATE）を開始し、終了時にコミットします。
+
+        既にトランザクション中の場合は外側のトランザクションに参加します。
+        """
+        conn = self.get_connection()
+        if conn.in_transaction:
+            yield conn
+            return
+
+        # IMMEDIATEで書き込みロックを先に取得し、読み取り→書き込みの昇格時のデッドロックを避ける
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        else:
+            conn.commit()
+
+    def close_current_thread(self):
+        """現在のスレッドの接続のみを閉じます。
+
+        他のスレッド（他のセッション・バックグラウンド処理）の接続は使用中の可能性があるため閉じず、
+        各スレッドの終了時、またはこのインスタンスが破棄された時点で解放されます。
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            return
+        self._local.conn = None
+        with self._lock:
+            self._connections.pop(threading.get_ident(), None)
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+
+_managers: Dict[str, ConnectionManager] = {}
+_managers_lock = threading.Lock()
+
+
+def get_connection_manager(db_path: str) -> ConnectionManager:
+    """データベースファイルごとに共有されるConnectionManagerを取得"""
+    key = os.path.abspath(db_path)
+    with _managers_lock:
+        manager = _managers.get(key)
+        if manager is None:
+            manager = ConnectionManager(key)
+            _managers[key] = manager
+        return manager
+
+
+def close_connection_manager(db_path: str):
+    """指定したデータベースファイルの共有インスタンスを破棄し、呼び出し元スレッドの接続を閉じる
+
+    以降の get_connection_manager は新しいインスタンスを返し、各スレッドは次回の使用時に接続を開き直す。
+    """
+    key = os.path.abspath(db_path)
+    with _managers_lock:
+        manager = _managers.pop(key, None)
+    if manager is not None:
+        manager.close_current_thread()
@@ -0,0 +1,868 @@
+"""
+データベース操作
+週次レポート・日次データの保存と取得（スナップショット＋編集ログ）、時刻を指定した入力内容の復元、
+一覧・全文検索、類似ケース検索を行うDBManager
+"""
+import json
+import os
+import re
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from db_connection import get_connection_manager, close_connection_manager
+from db_migrations import apply_migrations, has_report_search, has_report_search_bigram
+from similar_cases import SimilarCaseIndex, build_case_terms
+from draft_autosave import normalize_daily_reports
+from edit_log import apply_edits, fold_edits, get_edit_log
+
+# データベースファイルの絶対パスを取得（他のデバイスからのアクセス対応）
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.path.join(SCRIPT_DIR, 'apparel_reports.db')
+# レポート一覧の1ページあたりの件数
+REPORT_PAGE_SIZE = 50
+# プロンプトに含める類似ケースの件数
+SIMILAR_CASE_TOP_K = 5
+# 全文検索の最大表示件数
+REPORT_SEARCH_LIMIT = 20
+# 全文検索の対象列と表示名（FTSテーブル report_search / ビュー report_search_source の列）
+REPORT_SEARCH_COLUMNS = {
+    'daily_text': '日次',
+    'topics': 'TOPICS',
+    'impact_day': 'インパクト大',
+    'generated_text': 'AI生成',
+    'modified_text': '修正後'
+}
+
+
+class SearchQuery(NamedTuple):
+    """全文検索の条件（DBManager._build_search_condition の戻り値）"""
+    source: str  # FROM句（検索対象のテーブル。2文字以下の語がある場合はreport_search_bigramとの結合を含む）
+    column_table: str  # 検索対象の列（REPORT_SEARCH_COLUMNS）を持つテーブル
+    id_column: str  # レポートID（weekly_reports.id）の列
+    condition: str  # 条件SQL
+    params: List  # 条件SQLのパラメータ
+    score: str  # 関連度のSQL（値が小さいほど関連度が高い）
+
+
+class DBManager:
+    """データベース接続と操作を管理するクラス"""
+    def __init__(self, db_path: str = DB_PATH):
+        self.db_path = db_path
+        # スレッドごとの接続を再利用する（WALモード・PRAGMA設定済み）
+        self._connections = get_connection_manager(db_path)
+        self._store_id_cache: Dict[str, int] = {}
+        self._store_name_cache: Dict[int, str] = {}
+        # 入力欄の変更の追記先（週次レポートには compact_edit_log でまとめて反映する）
+        self.edit_log = get_edit_log(db_path)
+        # 類似ケース検索の索引（初回検索時に構築し、以降は保存された週のみ差分更新）
+        self._similar_case_index = SimilarCaseIndex()
+        self._similar_case_index_ready = False
+        self._similar_case_dirty = set()  # 再索引が必要な (店舗ID, 月曜日)
+        self._similar_case_lock = threading.Lock()
+        # 楽観的排他制御で検出した保存の競合（他の端末が先に保存していた）件数
+        self.save_conflict_count = 0
+        self._save_conflict_lock = threading.Lock()
+        self._init_db()
+
+    def _get_connection(self):
+        """現在のスレッド用のデータベース接続を取得します（Rowファクトリ設定済み、呼び出し側でcloseしないこと）。"""
+        try:
+            return self._connections.get_connection()
+        except Exception as e:
+            print(f"Database connection error: {str(e)}")
+            raise e
+
+    def _transaction(self):
+        """書き込み用トランザクションのコンテキストマネージャを返します。"""
+        return self._connections.transaction()
+
+    def close(self):
+        """このデータベースファイルの共有接続を破棄します（他のスレッドは次回の使用時に接続を開き直します）。"""
+        close_connection_manager(self.db_path)
+
+    def _init_db(self):
+        """データベースを初期化し、未適用のスキーママイグレーションを適用します。"""
+        if not os.path.exists(self.db_path):
+            print(f"Database file not found: {self.db_path}")
+        apply_migrations(self.db_path)
+        # FTS5が使えない環境では report_search が作成されないため、LIKEによる代替検索を使う
+        self._has_report_search = has_report_search(self._get_connection())
+        self._has_report_search_bigram = has_report_search_bigram(self._get_connection())
+
+    # 実行計画の確認対象とする主要なクエリ（名前, SQL, サンプルパラメータ）
+    _QUERY_PLAN_TARGETS = [
+        ('週次レポート取得', 'SELECT * FROM weekly_reports WHERE store_id = ? AND monday_date = ?', (1, '2025-01-06')),
+        ('日次データ取得', 'SELECT date, trend, factors FROM daily_entries WHERE store_id = ? AND date BETWEEN ? AND ? ORDER BY date', (1, '2025-01-06', '2025-01-12')),
+        ('レポート一覧（1ページ目）',
+         'SELECT w.id, w.store_id, w.monday_date, w.timestamp, s.name FROM weekly_reports w '
+         'LEFT JOIN stores s ON s.id = w.store_id ORDER BY w.monday_date DESC, w.id DESC LIMIT ?', (REPORT_PAGE_SIZE + 1,)),
+        ('レポート一覧（AI生成済み・次ページ）',
+         'SELECT w.id, w.store_id, w.monday_date, w.timestamp, s.name FROM weekly_reports w '
+         'LEFT JOIN stores s ON s.id = w.store_id WHERE w.generated_report_json IS NOT NULL '
+         'AND (w.monday_date < ? OR (w.monday_date = ? AND w.id < ?)) ORDER BY w.monday_date DESC, w.id DESC LIMIT ?',
+         ('2025-01-06', '2025-01-06', 100, REPORT_PAGE_SIZE + 1)),
+        ('類似ケース索引の差分更新',
+         'SELECT w.store_id, w.monday_date, w.topics, s.name FROM weekly_reports w LEFT JOIN stores s ON s.id = w.store_id '
+         'WHERE (w.generated_report_json IS NOT NULL OR w.modified_report_json IS NOT NULL) AND w.store_id = ? AND w.monday_date = ?',
+         (1, '2025-01-06')),
+        ('修正済みレポート数', 'SELECT COUNT(*) FROM weekly_reports WHERE modified_report_json IS NOT NULL', ()),
+        ('編集ログの未反映分取得',
+         'SELECT seq, field_type, field_key, field_value FROM edit_log '
+         'WHERE store_name = ? AND monday_date = ? AND seq > ? ORDER BY seq', ('RAY', '2025-01-06', 0)),
+        ('復元の起点のチェックポイント取得',
+         'SELECT seq, state_json, created_at FROM edit_checkpoints WHERE store_name = ? AND monday_date = ? '
+         'AND (created_at <= ? OR seq = 0) ORDER BY created_at DESC, id DESC LIMIT 1',
+         ('RAY', '2025-01-06', '2025-01-08 12:00:00')),
+        ('復元時の編集ログの再生',
+         'SELECT seq, field_type, field_key, field_value FROM edit_log WHERE store_name = ? AND monday_date = ? '
+         'AND seq > ? AND created_at <= ? ORDER BY seq', ('RAY', '2025-01-06', 0, '2025-01-08 12:00:00')),
+        ('アクティブセッション取得',
+         'SELECT session_id, device_info, last_active FROM active_sessions '
+         'WHERE store_name = ? AND last_active > ? ORDER BY last_active DESC', ('RAY', '2025-01-06 00:00:00')),
+    ]
+
+    def explain_query_plans(self) -> Dict[str, List[str]]:
+        """主要なクエリの実行計画（EXPLAIN QUERY PLAN）を取得します。インデックスの利用状況の確認用。"""
+        conn = self._get_connection()
+        plans = {}
+        for name, query, params in self._QUERY_PLAN_TARGETS:
+            try:
+                rows = conn.execute(f'EXPLAIN QUERY PLAN {query}', params).fetchall()
+                plans[name] = [row['detail'] for row in rows]
+            except Exception as e:
+                plans[name] = [f"取得エラー: {str(e)}"]
+        return plans
+
+    def get_store_id_by_name(self, store_name: str) -> int:
+        """ストア名からIDを取得します（店舗マスタはほぼ変わらないためプロセス内でキャッシュ）。"""
+        store_id = self._store_id_cache.get(store_name)
+        if store_id is None:
+            conn = self._get_connection()
+            store_id = conn.execute('SELECT id FROM stores WHERE name = ?', (store_name,)).fetchone()['id']
+            self._store_id_cache[store_name] = store_id
+        return store_id
+
+    def get_store_name_by_id(self, store_id: int) -> str:
+        """ストアIDから名前を取得します（get_store_id_by_name と同じくプロセス内でキャッシュ）。"""
+        store_name = self._store_name_cache.get(store_id)
+        if store_name is None:
+            conn = self._get_connection()
+            store_name = conn.execute('SELECT name FROM stores WHERE id = ?', (store_id,)).fetchone()['name']
+            self._store_name_cache[store_id] = store_name
+        return store_name
+    
+    def get_all_stores(self) -> List[Tuple[int, str]]:
+        """全ての店舗のIDと名前を取得します。"""
+        conn = self._get_connection()
+        stores = conn.execute('SELECT id, name FROM stores ORDER BY name').fetchall()
+        return [(s['id'], s['name']) for s in stores]
+
+    @staticmethod
+    def _weekly_report_columns(fields: Dict = None) -> Dict:
+        """保存するフィールドを weekly_reports の列と値に変換します（更新日時を含む）。"""
+        columns = {}
+        for field, value in (fields or {}).items():
+            if field in ('topics', 'impact_day', 'quantitative_data'):
+                columns[field] = value
+            elif field in ('generated_report', 'modified_report'):
+                columns[f"{field}_json"] = json.dumps(value, ensure_ascii=False) if value else None
+            else:
+                raise ValueError(f"未対応のフィールドです: {field}")
+        columns['timestamp'] = datetime.now().isoformat()
+        return columns
+
+    def upsert_weekly_report(self, store_id: int, monday_date_str: str, fields: Dict = None) -> Tuple[int, bool]:
+        """週次レポートを1文（INSERT ... ON CONFLICT DO UPDATE）で作成または更新します。
+
+        fields に指定された列のみを更新し、それ以外の列は既存の値を保持します（読み込み→書き戻しは行わない）。
+        fields: topics / impact_day / quantitative_data / generated_report / modified_report のうち更新するもの
+        戻り値: (レポートID, 新規作成した場合はTrue)
+        """
+        report_id, version = self._upsert_weekly_report_row(store_id, monday_date_str, fields)
+        return report_id, version == 1
+
+    def _upsert_weekly_report_row(self, store_id: int, monday_date_str: str, fields: Dict = None) -> Tuple[int, int]:
+        """upsert_weekly_report の本体。戻り値: (レポートID, 更新後のバージョン)"""
+        columns = self._weekly_report_columns(fields)
+        column_names = ", ".join(columns)
+        placeholders = ", ".join("?" for _ in columns)
+        assignments = ", ".join(f"{column} = excluded.{column}" for column in columns)
+        with self._transaction() as conn:
+            row = conn.execute(f'''
+                INSERT INTO weekly_reports (store_id, monday_date, {column_names})
+                VALUES (?, ?, {placeholders})
+                ON CONFLICT(store_id, monday_date) DO UPDATE SET {assignments}, version = weekly_reports.version + 1
+                RETURNING id, version
+            ''', (store_id, monday_date_str, *columns.values())).fetchall()[0]
+        self._mark_similar_case_dirty(store_id, monday_date_str)
+        return row['id'], row['version']
+
+    def _update_weekly_report_if_version(self, store_id: int, monday_date_str: str, fields: Dict,
+                                         expected_version: int) -> Optional[Tuple[int, int]]:
+        """バージョンが expected_version の場合のみ週次レポートを保存します。
+
+        0は明示的な保存がまだないこと（行がないか、編集ログを反映しただけのバージョン0の行）を期待します。
+
+        他の端末が先に保存していた場合はNone。戻り値: (レポートID, 更新後のバージョン)
+        """
+        columns = self._weekly_report_columns(fields)
+        with self._transaction() as conn:
+            if expected_version == 0:
+                column_names = ", ".join(columns)
+                placeholders = ", ".join("?" for _ in columns)
+                assignments = ", ".join(f"{column} = excluded.{column}" for column in columns)
+                rows = conn.execute(f'''
+                    INSERT INTO weekly_reports (store_id, monday_date, {column_names})
+                    VALUES (?, ?, {placeholders})
+                    ON CONFLICT(store_id, monday_date) DO UPDATE SET {assignments}, version = weekly_reports.version + 1
+                    WHERE weekly_reports.version = 0
+                    RETURNING id, version
+                ''', (store_id, monday_date_str, *columns.values())).fetchall()
+            else:
+                assignments = ", ".join(f"{column} = ?" for column in columns)
+                rows = conn.execute(f'''
+                    UPDATE weekly_reports SET {assignments}, version = version + 1
+                    WHERE store_id = ? AND monday_date = ? AND version = ?
+                    RETURNING id, version
+                ''', (*columns.values(), store_id, monday_date_str, expected_version)).fetchall()
+        if not rows:
+            return None
+        self._mark_similar_case_dirty(store_id, monday_date_str)
+        return rows[0]['id'], rows[0]['version']
+
+    def save_week_changes(self, store_id: int, monday_date_str: str, fields: Dict = None, daily_updates: Dict = None,
+                          expected_version: Optional[int] = None, rebase_on_conflict: bool = True) -> Dict:
+        """変更された項目のみを、編集の元にしたバージョンを条件に保存します（楽観的排他制御）。
+
+        fields: topics / impact_day / quantitative_data / generated_report / modified_report のうち変更されたもの
+        daily_updates: {日付: {'trend': str, 'factors': list}}（変更された日・項目のみ）
+        expected_version: 編集の元にしたバージョン（0は新規、Noneはバージョンを確認せずに保存）
+
+        他の端末が先に保存していた（バージョンが古い）場合は競合として数え、rebase_on_conflict=True なら
+        変更された項目のみを最新の行に適用します（変更していない項目は他の端末の保存内容のまま）。
+        週次レポートの行は日次のみの変更でも更新日時とバージョンを更新します（週単位で競合を検出するため）。
+        保存の前に未反映の編集ログを反映し、以前の編集が保存内容を後から上書きしないようにします。
+        入力内容を保存した場合は、保存後の状態をチェックポイントとして記録します（時刻を指定した復元用）。
+        戻り値: {'id', 'version', 'created', 'conflict', 'report'（競合時のみ、保存後の最新のレポート）}
+        """
+        saves_inputs = bool(daily_updates) or any(
+            field in (fields or {}) for field in ('topics', 'impact_day', 'quantitative_data')
+        )
+        with self._transaction():
+            self._compact_week(store_id, monday_date_str)
+            store_name = self.get_store_name_by_id(store_id)
+            if saves_inputs and not self.edit_log.has_checkpoint(store_name, monday_date_str):
+                # 編集履歴の開始時点（保存前）の状態
+                self._record_checkpoint(store_id, monday_date_str, store_name)
+            saved = None
+            if expected_version is not None:
+                saved = self._update_weekly_report_if_version(store_id, monday_date_str, fields, expected_version)
+            conflict = expected_version is not None and saved is None
+            if conflict:
+                with self._save_conflict_lock:
+                    self.save_conflict_count += 1
+                if not rebase_on_conflict:
+                    report = self.get_weekly_report(store_id, monday_date_str)
+                    return {'id': report.get('id'), 'version': report.get('version', 0), 'created': False,
+                            'conflict': True, 'report': report}
+            if saved is None:
+                saved = self._upsert_weekly_report_row(store_id, monday_date_str, fields)
+            # 変更された日のみを1日1行で書き込む
+            for date_str, day in (daily_updates or {}).items():
+                self.upsert_daily_entry(store_id, date_str, trend=day.get('trend'), factors=day.get('factors'))
+            if saves_inputs:
+                # 編集ログを介さない変更のため、保存後の状態を復元の起点として記録する
+                self._record_checkpoint(store_id, monday_date_str, store_name)
+            report_id, version = saved
+            return {
+                'id': report_id,
+                'version': version,
+                'created': version == 1,
+                'conflict': conflict,
+                'report': self.get_weekly_report(store_id, monday_date_str) if conflict else None
+            }
+
+    def save_weekly_data(self, store_id: int, monday_date_str: str, data: Dict, original_report: Dict,
+                         modified_report: Dict = None, expected_version: Optional[int] = None) -> Dict:
+        """週次データをDBに保存または更新します。
+
+        expected_version を指定した場合、他の端末が先に保存していれば入力内容（日次・TOPICS等）は
+        他の端末の保存内容を残し、生成・修正レポートのみを反映します。
+        戻り値: save_week_changes と同じ（既存のデータを更新した場合は created が False）
+        """
+        daily_reports = normalize_daily_reports(data.get('daily_reports', {}))
+        report_fields = {'generated_report': original_report, 'modified_report': modified_report}
+        input_fields = {
+            'topics': data.get('topics', ''),
+            'impact_day': data.get('impact_day', ''),
+            'quantitative_data': data.get('quantitative_data', '')
+        }
+
+        with self._transaction():
+            result = self.save_week_changes(
+                store_id, monday_date_str, {**input_fields, **report_fields}, daily_reports,
+                expected_version=expected_version, rebase_on_conflict=False
+            )
+            if result['conflict']:
+                result = self.save_week_changes(store_id, monday_date_str, report_fields)
+                result['conflict'] = True
+                result['report'] = self.get_weekly_report(store_id, monday_date_str)
+        return result
+
+    def upsert_daily_entry(self, store_id: int, date_str: str, trend: str = None, factors: List[str] = None):
+        """1日分の動向・要因を保存します（指定された項目のみ更新）。"""
+        columns = {}
+        if trend is not None:
+            columns['trend'] = trend
+        if factors is not None:
+            columns['factors'] = json.dumps(list(factors), ensure_ascii=False)
+        if not columns:
+            return
+        columns['updated_at'] = datetime.now().isoformat()
+
+        column_names = ", ".join(columns)
+        placeholders = ", ".join("?" for _ in columns)
+        assignments = ", ".join(f"{column} = excluded.{column}" for column in columns)
+        with self._transaction() as conn:
+            conn.execute(f'''
+                INSERT INTO daily_entries (store_id, date, {column_names})
+                VALUES (?, ?, {placeholders})
+                ON CONFLICT(store_id, date) DO UPDATE SET {assignments}
+            ''', (store_id, date_str, *columns.values()))
+        entry_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+        self._mark_similar_case_dirty(store_id, (entry_date - timedelta(days=entry_date.weekday())).strftime('%Y-%m-%d'))
+
+    def get_daily_entries(self, store_id: int, date_from: str, date_to: str) -> Dict:
+        """指定期間（両端を含む）の日次の動向・要因を {日付: {'trend': ..., 'factors': [...]}} で取得します。"""
+        conn = self._get_connection()
+        rows = conn.execute('''
+            SELECT date, trend, factors FROM daily_entries
+            WHERE store_id = ? AND date BETWEEN ? AND ?
+            ORDER BY date
+        ''', (store_id, date_from, date_to)).fetchall()
+
+        daily_reports = {}
+        for row in rows:
+            try:
+                factors = json.loads(row['factors']) if row['factors'] else []
+            except (json.JSONDecodeError, TypeError):
+                factors = []
+            daily_reports[row['date']] = {'trend': row['trend'] or '', 'factors': factors}
+        return daily_reports
+
+    def compact_edit_log(self, store_name: str = None, monday_date_str: str = None) -> Dict[str, int]:
+        """編集ログの未反映分を週次レポート（スナップショット）に反映し、反映済みで保持期間を過ぎたログを削除します。
+
+        店舗・週を省略した場合は未反映のログがある全ての週が対象です（週ごとに1トランザクション）。
+        戻り値: {'weeks': 反映した週の数, 'edits': 反映したログの件数, 'truncated': 削除したログの件数}
+        """
+        weeks = [(store_name, monday_date_str)] if store_name else self.edit_log.get_pending_weeks()
+        compacted_weeks = 0
+        compacted_edits = 0
+        for week_store_name, week_monday in weeks:
+            try:
+                count = self._compact_week(self.get_store_id_by_name(week_store_name), week_monday, week_store_name)
+            except Exception as e:
+                print(f"編集ログの反映に失敗しました（{week_store_name} {week_monday}）: {str(e)}")
+                continue
+            if count:
+                compacted_weeks += 1
+                compacted_edits += count
+        return {'weeks': compacted_weeks, 'edits': compacted_edits, 'truncated': self.edit_log.truncate()}
+
+    def _compact_week(self, store_id: int, monday_date_str: str, store_name: str = None) -> int:
+        """1週分の未反映の編集ログを週次レポートに反映し、反映した件数を返します。
+
+        反映はスナップショットの更新のみでバージョンは変更しません（読み込み結果は反映の前後で同じため）。
+        行がない週は、明示的な保存がまだないことを表すバージョン0で作成します。
+        前回のチェックポイントから一定時間が経過している場合は、反映前の状態をチェックポイントとして記録します。
+        """
+        store_name = store_name or self.get_store_name_by_id(store_id)
+        with self._transaction() as conn:
+            row = conn.execute(
+                'SELECT snapshot_seq FROM weekly_reports WHERE store_id = ? AND monday_date = ?',
+                (store_id, monday_date_str)
+            ).fetchone()
+            edits = self.edit_log.get_tail(store_name, monday_date_str, row['snapshot_seq'] if row else 0)
+            if not edits:
+                return 0
+            if self.edit_log.is_checkpoint_due(store_name, monday_date_str):
+                self._record_checkpoint(store_id, monday_date_str, store_name)
+            fields, daily_updates = fold_edits(edits)
+            columns = self._weekly_report_columns(fields)
+            columns['snapshot_seq'] = edits[-1]['seq']
+            column_names = ", ".join(columns)
+            placeholders = ", ".join("?" for _ in columns)
+            assignments = ", ".join(f"{column} = excluded.{column}" for column in columns)
+            conn.execute(f'''
+                INSERT INTO weekly_reports (store_id, monday_date, {column_names}, version)
+                VALUES (?, ?, {placeholders}, 0)
+                ON CONFLICT(store_id, monday_date) DO UPDATE SET {assignments}
+            ''', (store_id, monday_date_str, *columns.values()))
+            for date_str, day in daily_updates.items():
+                self.upsert_daily_entry(store_id, date_str, trend=day.get('trend'), factors=day.get('factors'))
+        self._mark_similar_case_dirty(store_id, monday_date_str)
+        return len(edits)
+
+    @staticmethod
+    def _week_input_state(report: Dict) -> Dict:
+        """週次レポートから入力内容（チェックポイント・復元の対象）を取り出します。"""
+        return {
+            'daily_reports': report.get('daily_reports', {}),
+            'topics': report.get('topics') or '',
+            'impact_day': report.get('impact_day') or '',
+            'quantitative_data': report.get('quantitative_data') or ''
+        }
+
+    def _record_checkpoint(self, store_id: int, monday_date_str: str, store_name: str):
+        """週次レポート（スナップショット）の現在の入力内容をチェックポイントとして記録します。"""
+        snapshot = self.get_weekly_report(store_id, monday_date_str, include_edit_log=False)
+        self.edit_log.add_checkpoint(
+            store_name, monday_date_str, snapshot.get('snapshot_seq', 0), self._week_input_state(snapshot)
+        )
+
+    def get_week_inputs_as_of(self, store_id: int, monday_date_str: str, as_of: str) -> Optional[Dict]:
+        """指定した時刻（UTC 'YYYY-MM-DD HH:MM:SS'）の時点の週の入力内容を復元します。
+
+        その時刻以前の最新のチェックポイントを1件読み、以降の入力欄の編集ログを連番の範囲で再生します。
+        保持期間より前の時刻など、復元の起点がない場合はNoneを返します。
+        戻り値: {'daily_reports', 'topics', 'impact_day', 'quantitative_data'}
+        """
+        store_name = self.get_store_name_by_id(store_id)
+        checkpoint = self.edit_log.get_checkpoint_as_of(store_name, monday_date_str, as_of)
+        if checkpoint is not None:
+            state, after_seq = checkpoint['state'], checkpoint['seq']
+        elif self.edit_log.has_checkpoint(store_name, monday_date_str):
+            return None
+        else:
+            # チェックポイントのない週は、編集ログ以外による変更がまだない
+            snapshot = self.get_weekly_report(store_id, monday_date_str, include_edit_log=False)
+            state, after_seq = self._week_input_state(snapshot), snapshot.get('snapshot_seq', 0)
+        return apply_edits(state, self.edit_log.get_edits_until(store_name, monday_date_str, after_seq, as_of))
+
+    def get_weekly_report(self, store_id: int, monday_date_str: str, include_edit_log: bool = True) -> Dict:
+        """指定された週のレポートデータを取得します。
+
+        週次レポート（スナップショット）に、まだ反映されていない編集ログを適用した内容を返します
+        （include_edit_log=False の場合はスナップショットのみ）。
+        """
+        conn = self._get_connection()
+        report_row = conn.execute(
+            'SELECT * FROM weekly_reports WHERE store_id = ? AND monday_date = ?',
+            (store_id, monday_date_str)
+        ).fetchone()
+
+        if report_row:
+            report_data = dict(report_row) # Rowオブジェクトを辞書に変換
+            week_start, week_end = get_week_date_range(monday_date_str)
+            report_data['daily_reports'] = self.get_daily_entries(store_id, week_start, week_end)
+            
+            # 未移行の旧形式データが残っている場合は、daily_entriesにない日付のみ補完
+            if report_data['daily_reports_json']:
+                try:
+                    legacy_daily_reports = normalize_daily_reports(json.loads(report_data['daily_reports_json']))
+                    for date_str, day in legacy_daily_reports.items():
+                        report_data['daily_reports'].setdefault(date_str, day)
+                except (json.JSONDecodeError, TypeError) as e:
+                    print(f"日次レポートデータの解析に失敗しました: {str(e)}")
+                
+            try:
+                report_data['generated_report'] = json.loads(report_data['generated_report_json']) if report_data['generated_report_json'] else {}
+            except (json.JSONDecodeError, TypeError) as e:
+                print(f"生成レポートデータの解析に失敗しました: {str(e)}")
+                report_data['generated_report'] = {}
+                
+            try:
+                report_data['modified_report'] = json.loads(report_data['modified_report_json']) if report_data['modified_report_json'] else None
+            except (json.JSONDecodeError, TypeError) as e:
+                print(f"修正レポートデータの解析に失敗しました: {str(e)}")
+                report_data['modified_report'] = None
+            
+            del report_data['daily_reports_json']
+            del report_data['generated_report_json']
+            if 'modified_report_json' in report_data:
+                del report_data['modified_report_json']
+
+        if not include_edit_log:
+            return report_data if report_row else {}
+        edits = self.edit_log.get_tail(
+            self.get_store_name_by_id(store_id), monday_date_str, report_row['snapshot_seq'] if report_row else 0
+        )
+        if not edits:
+            return report_data if report_row else {}
+        if not report_row:
+            # 編集ログのみの週（まだ反映されていない）
+            report_data = {
+                'id': None, 'store_id': store_id, 'monday_date': monday_date_str, 'version': 0, 'snapshot_seq': 0,
+                'topics': '', 'impact_day': '', 'quantitative_data': '',
+                'daily_reports': {}, 'generated_report': {}, 'modified_report': None
+            }
+        return apply_edits(report_data, edits)
+    
+    def get_all_weekly_reports(self, store_id: int = None) -> List[Dict]:
+        """全ての週次レポート、または指定した店舗の週次レポートの一覧を取得します。
+
+        店舗名はJOINで、生成・修正レポートの有無はSQL側で判定するため、JSON本体は読み込みません。
+        """
+        try:
+            conn = self._get_connection()
+            query = '''
+                SELECT w.id, w.store_id, w.monday_date, w.timestamp,
+                       COALESCE(s.name, '店舗ID:' || w.store_id) AS store_name,
+                       w.generated_report_json IS NOT NULL AS has_generated,
+                       w.modified_report_json IS NOT NULL AS has_modified
+                FROM weekly_reports w
+                LEFT JOIN stores s ON s.id = w.store_id
+            '''
+            params = ()
+            if store_id:
+                query += ' WHERE w.store_id = ?'
+                params = (store_id,)
+            query += ' ORDER BY w.monday_date DESC'
+
+            reports = []
+            for row in conn.execute(query, params):
+                report_data = dict(row)
+                report_data['has_generated'] = bool(report_data['has_generated'])
+                report_data['has_modified'] = bool(report_data['has_modified'])
+                reports.append(report_data)
+            return reports
+        except Exception as e:
+            print(f"Database error in get_all_weekly_reports: {str(e)}")
+            return []
+
+    def list_weekly_reports(self, store_id: int = None, date_from: str = None, date_to: str = None,
+                            has_generated: bool = None, has_modified: bool = None, text: str = None,
+                            cursor: Tuple[str, int] = None, limit: int = REPORT_PAGE_SIZE) -> Tuple[List[Dict], Optional[Tuple[str, int]]]:
+        """週次レポートの一覧を1ページ分取得します（新しい週から順）。
+
+        (monday_date, id) のキーセットでページングするため、ページを進めても先頭から読み飛ばす必要がありません。
+        cursor には前ページの戻り値（次ページのカーソル）を渡します。
+        戻り値: (レポート一覧, 次ページのカーソル。最終ページの場合はNone)
+        """
+        conditions = []
+        params = []
+        if store_id:
+            conditions.append('w.store_id = ?')
+            params.append(store_id)
+        if date_from:
+            conditions.append('w.monday_date >= ?')
+            params.append(date_from)
+        if date_to:
+            conditions.append('w.monday_date <= ?')
+            params.append(date_to)
+        if has_generated is not None:
+            conditions.append('w.generated_report_json IS NOT NULL' if has_generated else 'w.generated_report_json IS NULL')
+        if has_modified is not None:
+            conditions.append('w.modified_report_json IS NOT NULL' if has_modified else 'w.modified_report_json IS NULL')
+        if text:
+            search = self._build_search_condition(text)
+            conditions.append(f'w.id IN (SELECT {search.id_column} FROM {search.source} WHERE {search.condition})')
+            params.extend(search.params)
+        if cursor:
+            conditions.append('(w.monday_date < ? OR (w.monday_date = ? AND w.id < ?))')
+            params.extend([cursor[0], cursor[0], cursor[1]])
+
+        query = '''
+            SELECT w.id, w.store_id, w.monday_date, w.timestamp,
+                   COALESCE(s.name, '店舗ID:' || w.store_id) AS store_name,
+                   w.generated_report_json IS NOT NULL AS has_generated,
+                   w.modified_report_json IS NOT NULL AS has_modified
+            FROM weekly_reports w
+            LEFT JOIN stores s ON s.id = w.store_id
+        '''
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY w.monday_date DESC, w.id DESC LIMIT ?'
+        params.append(limit + 1)  # 1件多く取得して次ページの有無を判定する
+
+        try:
+            rows = self._get_connection().execute(query, params).fetchall()
+        except Exception as e:
+            print(f"Database error in list_weekly_reports: {str(e)}")
+            return [], None
+
+        reports = []
+        for row in rows[:limit]:
+            report_data = dict(row)
+            report_data['has_generated'] = bool(report_data['has_generated'])
+            report_data['has_modified'] = bool(report_data['has_modified'])
+            reports.append(report_data)
+
+        next_cursor = None
+        if len(rows) > limit and reports:
+            next_cursor = (reports[-1]['monday_date'], reports[-1]['id'])
+        return reports, next_cursor
+
+    def _build_search_condition(self, text: str) -> SearchQuery:
+        """キーワード（空白区切り、すべて含むものを検索）から全文検索の条件を作ります。
+
+        trigramトークナイザは3文字以上の語しかMATCHで検索できないため、2文字以下の語（「羽織」など）は
+        2文字ずつ区切って索引したreport_search_bigramで検索し、関連度（bm25）は両方の合計とする。
+        記号を含む2文字以下の語（「5%」など）は区切りでは一致を判定できないため、LIKEで絞り込む。
+        """
+        terms = text.split()
+        conditions = []
+        params = []
+        scores = []
+        if self._has_report_search:
+            # FTS5のMATCH・bm25は別名では参照できないため、テーブル名のまま使う
+            source = column_table = 'report_search'
+            id_column = 'report_search.rowid'
+            long_terms = [term for term in terms if len(term) >= 3]
+            if long_terms:
+                # 各語をフレーズとして扱う（FTS5の演算子として解釈させない）
+                conditions.append('report_search MATCH ?')
+                params.append(' AND '.join('"' + term.replace('"', '""') + '"' for term in long_terms))
+                # bm25は値が小さいほど関連度が高い。TOPICSと修正後の内容を重視する
+                scores.append('bm25(report_search, 1.0, 2.0, 1.5, 1.0, 2.0)')
+            short_terms = [term for term in terms if len(term) < 3]
+            bigram_terms = [term for term in short_terms if term.isalnum()] if self._has_report_search_bigram else []
+            like_terms = [term for term in short_terms if term not in bigram_terms]
+            if bigram_terms:
+                source += ' JOIN report_search_bigram ON report_search_bigram.rowid = report_search.rowid'
+                # 2文字の語は区切りと完全一致、1文字の語はその文字で始まる区切りと前方一致で検索する
+                conditions.append('report_search_bigram MATCH ?')
+                params.append(' AND '.join('"' + term + '"' + ('*' if len(term) == 1 else '') for term in bigram_terms))
+                scores.append('bm25(report_search_bigram, 1.0, 2.0, 1.5, 1.0, 2.0)')
+        else:
+            source = column_table = 'report_search_source'
+            id_column = 'report_search_source.report_id'
+            like_terms = terms
+
+        for term in like_terms:
+            pattern = '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            conditions.append('(' + ' OR '.join(f"{column_table}.{column} LIKE ? ESCAPE '\\'" for column in REPORT_SEARCH_COLUMNS) + ')')
+            params.extend([pattern] * len(REPORT_SEARCH_COLUMNS))
+        return SearchQuery(source, column_table, id_column, ' AND '.join(conditions) or '1', params, ' + '.join(scores) or '0')
+
+    def search_reports(self, text: str, store_id: int = None, limit: int = REPORT_SEARCH_LIMIT) -> List[Dict]:
+        """週次レポート（日次の動向・要因、TOPICS、インパクト大、AI生成・修正後の動向と要因）を全文検索します。
+
+        関連度（bm25）順、同程度の場合は新しい週から順に返します。各結果には一致箇所の抜粋（snippet）を含みます。
+        """
+        terms = text.split()
+        if not terms:
+            return []
+
+        search = self._build_search_condition(text)
+        columns = ", ".join(f"{search.column_table}.{column}" for column in REPORT_SEARCH_COLUMNS)
+        query = f'''
+            SELECT w.id, w.store_id, w.monday_date,
+                   COALESCE(s.name, '店舗ID:' || w.store_id) AS store_name,
+                   {search.score} AS score, {columns}
+            FROM {search.source}
+            JOIN weekly_reports w ON w.id = {search.id_column}
+            LEFT JOIN stores s ON s.id = w.store_id
+            WHERE {search.condition}
+        '''
+        params = search.params
+        if store_id:
+            query += ' AND w.store_id = ?'
+            params = params + [store_id]
+        query += ' ORDER BY score, w.monday_date DESC, w.id DESC LIMIT ?'
+        params = params + [limit]
+
+        try:
+            rows = self._get_connection().execute(query, params).fetchall()
+        except Exception as e:
+            print(f"Database error in search_reports: {str(e)}")
+            return []
+
+        results = []
+        for row in rows:
+            results.append({
+                'id': row['id'],
+                'store_id': row['store_id'],
+                'store_name': row['store_name'],
+                'monday_date': row['monday_date'],
+                'score': -row['score'],  # 大きいほど関連度が高い値に変換
+                'snippet': build_search_snippet({column: row[column] for column in REPORT_SEARCH_COLUMNS}, terms)
+            })
+        return results
+
+    def _mark_similar_case_dirty(self, store_id: int, monday_date_str: str):
+        """保存された週を類似ケース索引の再索引対象として記録します（索引の更新は次回検索時）。"""
+        with self._similar_case_lock:
+            self._similar_case_dirty.add((store_id, monday_date_str))
+
+    def _load_similar_case_documents(self, store_id: int = None, monday_date_str: str = None) -> List[Tuple]:
+        """類似ケース索引に登録する (キー, トークン列, メタ情報) を取得します。
+
+        AI生成済みまたは修正済みのレポートのみが対象。店舗ID・月曜日を指定した場合はその週のみ。
+        """
+        conn = self._get_connection()
+        query = '''
+            SELECT w.store_id, w.monday_date, w.topics, w.impact_day, w.quantitative_data,
+                   w.generated_report_json, w.modified_report_json, s.name AS store_name
+            FROM weekly_reports w LEFT JOIN stores s ON s.id = w.store_id
+            WHERE (w.generated_report_json IS NOT NULL OR w.modified_report_json IS NOT NULL)
+        '''
+        params = ()
+        if store_id is not None:
+            query += ' AND w.store_id = ? AND w.monday_date = ?'
+            params = (store_id, monday_date_str)
+        rows = conn.execute(query, params).fetchall()
+        if not rows:
+            return []
+
+        # 日次データは1回のクエリでまとめて取得し、(店舗ID, 月曜日) ごとに振り分ける
+        if store_id is not None:
+            week_start, week_end = get_week_date_range(monday_date_str)
+            daily_by_week = {(store_id, monday_date_str): self.get_daily_entries(store_id, week_start, week_end)}
+        else:
+            daily_by_week = {}
+            for entry in conn.execute('SELECT store_id, date, trend, factors FROM daily_entries'):
+                entry_date = datetime.strptime(entry['date'], '%Y-%m-%d').date()
+                week_key = (entry['store_id'], (entry_date - timedelta(days=entry_date.weekday())).strftime('%Y-%m-%d'))
+                try:
+                    factors = json.loads(entry['factors']) if entry['factors'] else []
+                except (json.JSONDecodeError, TypeError):
+                    factors = []
+                daily_by_week.setdefault(week_key, {})[entry['date']] = {'trend': entry['trend'] or '', 'factors': factors}
+
+        documents = []
+        for row in rows:
+            try:
+                report_json = row['modified_report_json'] or row['generated_report_json']
+                report = json.loads(report_json) if report_json else {}
+            except (json.JSONDecodeError, TypeError):
+                continue
+            if not isinstance(report, dict):
+                continue
+
+            key = (row['store_id'], row['monday_date'])
+            tokens = build_case_terms(daily_by_week.get(key, {}), row['topics'] or '', row['impact_day'] or '', row['quantitative_data'] or '')
+            meta = {
+                'store_name': row['store_name'],
+                'monday_date': row['monday_date'],
+                'month': int(row['monday_date'][5:7]),
+                'is_modified': row['modified_report_json'] is not None,
+                'trend': report.get('trend', '') or '',
+                'factors': report.get('factors', []) or [],
+                'edit_reason': report.get('edit_reason', '') or ''
+            }
+            documents.append((key, tokens, meta))
+        return documents
+
+    def _refresh_similar_case_index(self):
+        """類似ケース索引を最新の状態にします（初回は全件構築、以降は保存された週のみ更新）。"""
+        with self._similar_case_lock:
+            ready = self._similar_case_index_ready
+            dirty, self._similar_case_dirty = self._similar_case_dirty, set()
+
+        if not ready:
+            self._similar_case_index.rebuild(self._load_similar_case_documents())
+            with self._similar_case_lock:
+                self._similar_case_index_ready = True
+            return
+
+        for store_id, monday_date_str in dirty:
+            documents = self._load_similar_case_documents(store_id, monday_date_str)
+            if documents:
+                key, tokens, meta = documents[0]
+                self._similar_case_index.upsert(key, tokens, meta)
+            else:
+                self._similar_case_index.remove((store_id, monday_date_str))
+
+    def find_similar_cases(self, current_data: Dict, top_k: int = SIMILAR_CASE_TOP_K) -> str:
+        """類似ケースを検索し、LLMに渡すためのコンテキストを生成します。
+
+        今週の日次の動向・要因、TOPICS、インパクト大、定量データとのTF-IDFコサイン類似度で
+        過去のレポートを順位付けし、同一店舗・近い季節のケースを優先します。
+        """
+        store_name = current_data.get('store_name')
+        monday_date_str = current_data.get('monday_date')
+        daily_reports = normalize_daily_reports(current_data.get('daily_reports', {}), store_name)
+        tokens = build_case_terms(
+            daily_reports,
+            current_data.get('topics', ''),
+            current_data.get('impact_day', ''),
+            current_data.get('quantitative_data', '')
+        )
+        if not tokens:
+            return ""
+
+        try:
+            self._refresh_similar_case_index()
+            exclude_key = None
+            if store_name and monday_date_str:
+                # 今週のレポート自体は類似ケースから除外する
+                exclude_key = (self.get_store_id_by_name(store_name), monday_date_str)
+            results = self._similar_case_index.search(
+                tokens,
+                top_k=top_k,
+                store_name=store_name,
+                month=int(monday_date_str[5:7]) if monday_date_str else None,
+                exclude_key=exclude_key
+            )
+        except Exception as e:
+            print(f"類似ケース検索エラー: {str(e)}")
+            return ""
+
+        similar_cases_context = []
+        for score, case in results:
+            label = "修正後" if case['is_modified'] else "AI生成"
+            context_item = (
+                f"- 過去の類似ケース ({case['store_name']}店 {case['monday_date']}週・{label}・類似度{score:.2f}): {case['trend'][:100]}...\n"
+                f"  要因: {', '.join(case['factors'])}\n"
+            )
+            if case['edit_reason']:
+                context_item += f"  (修正理由: {case['edit_reason'][:50]}...)\n"
+            similar_cases_context.append(context_item)
+
+        if similar_cases_context:
+            return "\n【過去の類似レポート例】\n" + "\n".join(similar_cases_context)
+        return ""
+    
+    def get_learning_stats(self):
+        """学習に関する統計情報を取得します。"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            
+            total_reports = cursor.execute("SELECT COUNT(*) FROM weekly_reports").fetchone()[0]
+            corrections = cursor.execute("SELECT COUNT(*) FROM weekly_reports WHERE modified_report_json IS NOT NULL").fetchone()[0]
+            
+            # learning_patternsテーブルの存在確認
+            try:
+                total_patterns = cursor.execute("SELECT COUNT(*) FROM learning_patterns").fetchone()[0]
+            except Exception as e:
+                print(f"learning_patternsテーブルエラー: {e}")
+                total_patterns = 0
+            
+            return {
+                'total_reports': total_reports,
+                'corrections': corrections,
+                'patterns': total_patterns
+            }
+        except Exception as e:
+            print(f"get_learning_stats エラー: {e}")
+            return {
+                'total_reports': 0,
+                'corrections': 0,
+                'patterns': 0
+            }
+
+def build_search_snippet(columns: Dict[str, str], terms: List[str], width: int = 40) -> str:
+    """検索結果の抜粋を作成（最初に一致した列の一致箇所の前後を切り出し、検索語を太字にする）"""
+    # 長い（より具体的な）検索語の一致箇所を優先する
+    lowered_terms = sorted({term.lower() for term in terms if term}, key=len, reverse=True)
+    for column, label in REPORT_SEARCH_COLUMNS.items():
+        text = columns.get(column) or ''
+        lowered = text.lower()
+        position = next((lowered.find(term) for term in lowered_terms if term in lowered), -1)
+        if position < 0:
+            continue
+        start = max(0, position - width)
+        end = min(len(text), position + width)
+        excerpt = text[start:end]
+        for term in sorted(set(terms), key=len, reverse=True):
+            excerpt = re.sub(re.escape(term), lambda m: f"**{m.group(0)}**", excerpt, flags=re.IGNORECASE)
+        return f"[{label}] {'…' if start > 0 else ''}{excerpt}{'…' if end < len(text) else ''}"
+    return ''
+
+def get_week_date_range(monday_date_str: str) -> Tuple[str, str]:
+    """月曜日の日付文字列から、その週の初日と最終日（日曜日）を返す"""
+    monday = datetime.strptime(monday_date_str, '%Y-%m-%d').date()
+    return monday_date_str, (monday + timedelta(days=6)).strftime('%Y-%m-%d')
@@ -0,0 +1,480 @@
+"""
+データベーススキーマのマイグレーション
+schema_versionテーブルで適用済みのバージョンを管理し、未適用のマイグレーションを順番に1回だけ適用する機能群
+"""
+import json
+import sqlite3
+from datetime import datetime
+from typing import Callable, List, Tuple
+
+from db_connection import get_connection_manager
+from draft_autosave import normalize_daily_reports
+
+# 初期登録する店舗
+DEFAULT_STORE_NAMES = ['RAY', 'RSJ', 'ROS', 'RNG']
+
+
+def _migration_001_baseline(conn):
+    """レポート関連の基本テーブル（既存DBではCREATE IF NOT EXISTSにより変更なし）"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stores (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE
+        );
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS weekly_reports (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            store_id INTEGER NOT NULL,
+            monday_date TEXT NOT NULL, --YYYY-MM-DD形式
+
+            daily_reports_json TEXT,    -- 旧形式（各曜日の動向と要因のJSON）。現在はdaily_entriesに移行済み
+            topics TEXT,
+            impact_day TEXT,
+            quantitative_data TEXT,
+
+            generated_report_json TEXT, -- AI生成レポート（動向、要因、質問）をJSONで保存
+            modified_report_json TEXT,  -- 修正後のレポート（動向、要因、修正理由など）をJSONで保存
+
+            timestamp TEXT,             -- 作成/最終更新日時
+            FOREIGN KEY (store_id) REFERENCES stores(id),
+            UNIQUE(store_id, monday_date)
+        );
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS learning_patterns (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            input_context_hash TEXT NOT NULL UNIQUE, -- 入力コンテキストのハッシュ値
+            original_output_json TEXT,
+            modified_output_json TEXT,
+            edit_reason TEXT,
+            usage_count INTEGER DEFAULT 1,
+            last_used TEXT
+        )
+    ''')
+    # 指定された店舗名のみを挿入 (既に存在する場合はスキップ)
+    for store_name in DEFAULT_STORE_NAMES:
+        conn.execute("INSERT OR IGNORE INTO stores (name) VALUES (?)", (store_name,))
+
+
+def _migration_002_sync_tables(conn):
+    """マルチデバイス同期用のテーブル"""
+    # デバイス・セッション管理テーブル
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS active_sessions (
+            session_id TEXT PRIMARY KEY,
+            device_info TEXT,
+            store_name TEXT,
+            last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            editing_data TEXT
+        )
+    ''')
+    # リアルタイム同期用データテーブル
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS realtime_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            store_name TEXT NOT NULL,
+            monday_date TEXT NOT NULL,
+            field_type TEXT NOT NULL,  -- daily_trend, daily_factors, topics, impact_day, quantitative
+            field_key TEXT,  -- 日付やフィールド名
+            field_value TEXT,
+            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            session_id TEXT,
+            UNIQUE(store_name, monday_date, field_type, field_key)
+        )
+    ''')
+    # 編集ロック管理テーブル
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS edit_locks (
+            store_name TEXT NOT NULL,
+            monday_date TEXT NOT NULL,
+            field_type TEXT NOT NULL,
+            field_key TEXT,
+            session_id TEXT NOT NULL,
+            locked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (store_name, monday_date, field_type, field_key)
+        )
+    ''')
+
+
+def _migration_003_daily_entries(conn):
+    """日次の動向・要因を1日1行で保持するテーブルと、daily_reports_jsonからのデータ移行"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS daily_entries (
+            store_id INTEGER NOT NULL,
+            date TEXT NOT NULL,                 -- YYYY-MM-DD形式
+            trend TEXT NOT NULL DEFAULT '',
+            factors TEXT NOT NULL DEFAULT '[]', -- 要因のリストをJSON配列で保存
+            updated_at TEXT,
+            PRIMARY KEY (store_id, date),
+            FOREIGN KEY (store_id) REFERENCES stores(id)
+        )
+    ''')
+
+    rows = conn.execute('''
+        SELECT w.id, w.store_id, w.daily_reports_json, w.timestamp, s.name AS store_name
+        FROM weekly_reports w LEFT JOIN stores s ON s.id = w.store_id
+        WHERE w.daily_reports_json IS NOT NULL
+    ''').fetchall()
+    for row in rows:
+        try:
+            daily_reports = normalize_daily_reports(json.loads(row['daily_reports_json']), row['store_name'])
+        except (json.JSONDecodeError, TypeError) as e:
+            # 解析できないデータはそのまま残し、読み込み時の補完処理に任せる
+            print(f"日次レポートデータの移行に失敗しました (ID: {row['id']}): {str(e)}")
+            continue
+
+        # 既にdaily_entriesにある行（新しい書き込み）は上書きしない
+        conn.executemany('''
+            INSERT OR IGNORE INTO daily_entries (store_id, date, trend, factors, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [
+            (row['store_id'], date_str, day['trend'], json.dumps(day['factors'], ensure_ascii=False), row['timestamp'])
+            for date_str, day in daily_reports.items()
+        ])
+        conn.execute('UPDATE weekly_reports SET daily_reports_json = NULL WHERE id = ?', (row['id'],))
+
+
+def _migration_004_indexes(conn):
+    """主要な検索で使用するインデックス"""
+    # レポート一覧（キーセットページング）: ORDER BY monday_date DESC, id DESC
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_weekly_reports_monday_id ON weekly_reports(monday_date DESC, id DESC)')
+    # 最終更新順の取得
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_weekly_reports_timestamp ON weekly_reports(timestamp)')
+    # 修正済みレポートのみを対象とする検索（類似ケース・学習統計）
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_weekly_reports_modified_timestamp
+        ON weekly_reports(timestamp DESC) WHERE modified_report_json IS NOT NULL
+    ''')
+    # AI生成済みレポートの絞り込み
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_weekly_reports_generated_monday
+        ON weekly_reports(monday_date DESC, id DESC) WHERE generated_report_json IS NOT NULL
+    ''')
+    # 同期データの取得: WHERE store_name = ? AND monday_date = ? ORDER BY last_updated DESC
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_realtime_data_store_week_updated ON realtime_data(store_name, monday_date, last_updated)')
+    # 古い同期データの削除
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_realtime_data_last_updated ON realtime_data(last_updated)')
+    # アクティブセッションの取得・削除
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_active_sessions_store_active ON active_sessions(store_name, last_active)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_active_sessions_last_active ON active_sessions(last_active)')
+
+
+def _migration_005_report_search(conn):
+    """全文検索用のFTS5テーブルと、weekly_reports・daily_entriesの変更に追従するトリガー
+
+    FTS5（trigramトークナイザ）が使えないSQLiteの場合は作成せず、検索はLIKEによる代替検索になる。
+    """
+    # 検索対象テキストを週次レポート単位で組み立てるビュー（FTSの再作成・代替検索でも使用）
+    conn.execute('''
+        CREATE VIEW IF NOT EXISTS report_search_source AS
+        SELECT
+            w.id AS report_id,
+            COALESCE((
+                SELECT group_concat(
+                    substr(d.date, 6) || ' ' || d.trend || ' ' ||
+                    CASE WHEN json_valid(d.factors)
+                        THEN COALESCE((SELECT group_concat(value, '、') FROM json_each(d.factors)), '')
+                        ELSE d.factors END,
+                    ' / ')
+                FROM daily_entries d
+                WHERE d.store_id = w.store_id
+                  AND d.date BETWEEN w.monday_date AND date(w.monday_date, '+6 days')
+                  AND (d.trend != '' OR d.factors != '[]')
+            ), '') AS daily_text,
+            COALESCE(w.topics, '') AS topics,
+            COALESCE(w.impact_day, '') AS impact_day,
+            CASE WHEN json_valid(w.generated_report_json) THEN
+                COALESCE(json_extract(w.generated_report_json, '$.trend'), '') || ' ' ||
+                COALESCE((SELECT group_concat(value, ' ') FROM json_each(w.generated_report_json, '$.factors')), '')
+            ELSE '' END AS generated_text,
+            CASE WHEN json_valid(w.modified_report_json) THEN
+                COALESCE(json_extract(w.modified_report_json, '$.trend'), '') || ' ' ||
+                COALESCE((SELECT group_concat(value, ' ') FROM json_each(w.modified_report_json, '$.factors')), '')
+            ELSE '' END AS modified_text
+        FROM weekly_reports w
+    ''')
+
+    try:
+        conn.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS report_search USING fts5(
+                daily_text, topics, impact_day, generated_text, modified_text,
+                tokenize = 'trigram'
+            )
+        ''')
+    except sqlite3.OperationalError as e:
+        print(f"全文検索（FTS5 trigram）を利用できないため、LIKEによる検索を使用します: {str(e)}")
+        return
+
+    # rowid = weekly_reports.id。再計算は「削除して挿入」で行う
+    refresh_row = '''
+        DELETE FROM report_search WHERE rowid = {id};
+        INSERT INTO report_search (rowid, daily_text, topics, impact_day, generated_text, modified_text)
+        SELECT report_id, daily_text, topics, impact_day, generated_text, modified_text
+        FROM report_search_source WHERE report_id = {id};
+    '''
+    # 日付が属する週の月曜日: date(日付, '-6 days', 'weekday 1')
+    week_report_id = '''(SELECT id FROM weekly_reports WHERE store_id = {row}.store_id
+                       AND monday_date = date({row}.date, '-6 days', 'weekday 1'))'''
+    triggers = [
+        ('report_search_weekly_insert', 'AFTER INSERT ON weekly_reports', refresh_row.format(id='NEW.id')),
+        ('report_search_weekly_update',
+         'AFTER UPDATE OF store_id, monday_date, topics, impact_day, generated_report_json, modified_report_json ON weekly_reports',
+         refresh_row.format(id='NEW.id')),
+        ('report_search_weekly_delete', 'AFTER DELETE ON weekly_reports', 'DELETE FROM report_search WHERE rowid = OLD.id;'),
+        ('report_search_daily_insert', 'AFTER INSERT ON daily_entries', refresh_row.format(id=week_report_id.format(row='NEW'))),
+        ('report_search_daily_update', 'AFTER UPDATE OF trend, factors ON daily_entries', refresh_row.format(id=week_report_id.format(row='NEW'))),
+        ('report_search_daily_delete', 'AFTER DELETE ON daily_entries', refresh_row.format(id=week_report_id.format(row='OLD'))),
+    ]
+    # executescriptは実行前に暗黙のCOMMITを行うため、1文ずつ実行する
+    for name, timing, body in triggers:
+        conn.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {timing} BEGIN {body} END')
+
+    # 既存データの索引を作成
+    conn.execute('DELETE FROM report_search')
+    conn.execute('''
+        INSERT INTO report_search (rowid, daily_text, topics, impact_day, generated_text, modified_text)
+        SELECT report_id, daily_text, topics, impact_day, generated_text, modified_text FROM report_search_source
+    ''')
+
+
+def _migration_006_weekly_report_version(conn):
+    """週次レポートの更新回数（version）。upsertで新規作成か更新かを判定するために使用"""
+    columns = [row['name'] for row in conn.execute('PRAGMA table_info(weekly_reports)')]
+    if 'version' not in columns:
+        conn.execute('ALTER TABLE weekly_reports ADD COLUMN version INTEGER NOT NULL DEFAULT 1')
+
+
+def _migration_007_realtime_change_seq(conn):
+    """（適用不要）同期データの変更連番。同期は編集ログ（マイグレーション10）の連番で行うため何もしない
+
+    バージョン番号は適用済みのDBとの整合のため残す。適用済みのDBの列・テーブルはマイグレーション10で削除される。
+    """
+
+
+def _migration_008_edit_lock_lease(conn):
+    """編集ロックの有効期限（expires_at: UNIX時刻）。期限切れのロックは無効として扱う"""
+    columns = [row['name'] for row in conn.execute('PRAGMA table_info(edit_locks)')]
+    if 'expires_at' not in columns:
+        conn.execute('ALTER TABLE edit_locks ADD COLUMN expires_at REAL NOT NULL DEFAULT 0')
+    # 期限切れロックの削除、セッション単位の更新・解放
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_edit_locks_expires_at ON edit_locks(expires_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_edit_locks_session ON edit_locks(session_id)')
+
+
+def _migration_009_realtime_base_seq(conn):
+    """（適用不要）同期データの元バージョン。編集ログ（マイグレーション10）のbase_seqで置き換えたため何もしない"""
+
+
+def _migration_010_edit_log(conn):
+    """追記専用の編集ログ（edit_log）と、週次レポートに反映済みのログの連番（snapshot_seq）
+
+    入力欄の変更はedit_logへの追記のみで保存し、一定件数・一定時間ごとに週次レポートへまとめて反映する。
+    同期もedit_logから行うため、realtime_data・sync_sequenceは削除する（内容は自動保存で週次レポートに保存済み）。
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS edit_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,  -- 変更連番（削除後も再利用しない）
+            store_name TEXT NOT NULL,
+            monday_date TEXT NOT NULL,
+            field_type TEXT NOT NULL,  -- daily_trend, daily_factors, topics, impact_day, quantitative_data, generated_report
+            field_key TEXT NOT NULL,  -- 日付やフィールド名
+            field_value TEXT,
+            session_id TEXT,
+            base_seq INTEGER,  -- 編集の元にした変更の連番（テキストの3方向マージ用）
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # 差分取得・未反映分の取得: WHERE store_name = ? AND monday_date = ? AND seq > ?
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_edit_log_store_week_seq ON edit_log(store_name, monday_date, seq)')
+
+    columns = [row['name'] for row in conn.execute('PRAGMA table_info(weekly_reports)')]
+    if 'snapshot_seq' not in columns:
+        conn.execute('ALTER TABLE weekly_reports ADD COLUMN snapshot_seq INTEGER NOT NULL DEFAULT 0')
+
+    # 旧マイグレーション7を適用済みのDBでは、各セッションが保持している同期の連番より後から採番する
+    has_sync_sequence = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sync_sequence'"
+    ).fetchone()
+    if has_sync_sequence:
+        conn.execute('''
+            INSERT INTO sqlite_sequence (name, seq)
+            SELECT 'edit_log', value FROM sync_sequence WHERE name = 'realtime_data'
+              AND NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'edit_log')
+        ''')
+    conn.execute('DROP TABLE IF EXISTS realtime_data')
+    conn.execute('DROP TABLE IF EXISTS sync_sequence')
+
+
+def _migration_011_edit_checkpoints(conn):
+    """週の入力内容のチェックポイント（edit_checkpoints）。時刻を指定した復元の起点に使用
+
+    復元はその時刻以前の最新のチェックポイントを1件読み、以降の編集ログを連番の範囲で再生して行う。
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS edit_checkpoints (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            store_name TEXT NOT NULL,
+            monday_date TEXT NOT NULL,
+            seq INTEGER NOT NULL,  -- この連番までの編集ログを含む（0は編集ログの記録開始前の状態）
+            state_json TEXT NOT NULL,  -- 日次の動向・要因、TOPICS、インパクト大、定量データ
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # 復元の起点の取得: WHERE store_name = ? AND monday_date = ? AND created_at <= ? ORDER BY created_at DESC
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_edit_checkpoints_store_week_created
+        ON edit_checkpoints(store_name, monday_date, created_at)
+    ''')
+
+
+def _migration_012_llm_response_cache(conn):
+    """AIの応答キャッシュ（llm_response_cache）。入力が同じ再生成ではAPIを呼び出さずに保存済みの応答を使う"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS llm_response_cache (
+            cache_key TEXT PRIMARY KEY,  -- (モデル, システムプロンプト, ユーザープロンプト, temperature) のSHA-256
+            model TEXT NOT NULL,
+            response_text TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            last_used_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            hit_count INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    # 件数超過時の削除: ORDER BY last_used_at
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_llm_response_cache_last_used ON llm_response_cache(last_used_at)')
+
+
+def _migration_013_report_search_bigram(conn):
+    """2文字以下の語の全文検索用のFTS5テーブル（report_search_bigram）と、report_searchと同じ変更に追従するトリガー
+
+    trigramトークナイザは3文字以上の語しか検索できないため、各列を2文字ずつ（1文字ずらし）区切った文字列を
+    unicode61トークナイザで索引する。2文字の語（「羽織」）は区切りと完全一致、1文字の語は前方一致で検索できる。
+    report_search（マイグレーション5）を作成できなかったSQLiteの場合は作成しない。
+    """
+    if not has_report_search(conn):
+        return
+
+    # 検索対象テキストを2文字ずつ空白で区切ったビュー（「羽織の欠品」→「羽織 織の の欠 欠品 品」）
+    bigram_columns = ',\n'.join(
+        f"""            (WITH RECURSIVE pos(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM pos WHERE i < length(src.{column}))
+             SELECT group_concat(substr(src.{column}, i, 2), ' ') FROM pos) AS {column}"""
+        for column in ('daily_text', 'topics', 'impact_day', 'generated_text', 'modified_text')
+    )
+    conn.execute(f'''
+        CREATE VIEW IF NOT EXISTS report_search_bigram_source AS
+        SELECT
+            src.report_id,
+{bigram_columns}
+        FROM report_search_source src
+    ''')
+
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS report_search_bigram USING fts5(
+            daily_text, topics, impact_day, generated_text, modified_text,
+            tokenize = 'unicode61'
+        )
+    ''')
+
+    # rowid = weekly_reports.id。再計算は「削除して挿入」で行う（トリガーの条件はマイグレーション5と同じ）
+    refresh_row = '''
+        DELETE FROM report_search_bigram WHERE rowid = {id};
+        INSERT INTO report_search_bigram (rowid, daily_text, topics, impact_day, generated_text, modified_text)
+        SELECT report_id, daily_text, topics, impact_day, generated_text, modified_text
+        FROM report_search_bigram_source WHERE report_id = {id};
+    '''
+    week_report_id = '''(SELECT id FROM weekly_reports WHERE store_id = {row}.store_id
+                       AND monday_date = date({row}.date, '-6 days', 'weekday 1'))'''
+    triggers = [
+        ('report_search_bigram_weekly_insert', 'AFTER INSERT ON weekly_reports', refresh_row.format(id='NEW.id')),
+        ('report_search_bigram_weekly_update',
+         'AFTER UPDATE OF store_id, monday_date, topics, impact_day, generated_report_json, modified_report_json ON weekly_reports',
+         refresh_row.format(id='NEW.id')),
+        ('report_search_bigram_weekly_delete', 'AFTER DELETE ON weekly_reports', 'DELETE FROM report_search_bigram WHERE rowid = OLD.id;'),
+        ('report_search_bigram_daily_insert', 'AFTER INSERT ON daily_entries', refresh_row.format(id=week_report_id.format(row='NEW'))),
+        ('report_search_bigram_daily_update', 'AFTER UPDATE OF trend, factors ON daily_entries', refresh_row.format(id=week_report_id.format(row='NEW'))),
+        ('report_search_bigram_daily_delete', 'AFTER DELETE ON daily_entries', refresh_row.format(id=week_report_id.format(row='OLD'))),
+    ]
+    for name, timing, body in triggers:
+        conn.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {timing} BEGIN {body} END')
+
+    # 既存データの索引を作成
+    conn.execute('DELETE FROM report_search_bigram')
+    conn.execute('''
+        INSERT INTO report_search_bigram (rowid, daily_text, topics, impact_day, generated_text, modified_text)
+        SELECT report_id, daily_text, topics, impact_day, generated_text, modified_text FROM report_search_bigram_source
+    ''')
+
+
+def has_report_search(conn) -> bool:
+    """全文検索テーブル（FTS5）が作成済みかどうか"""
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'report_search'").fetchone()
+    return row is not None
+
+
+def has_report_search_bigram(conn) -> bool:
+    """2文字以下の語の全文検索テーブル（FTS5）が作成済みかどうか"""
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'report_search_bigram'").fetchone()
+    return row is not None
+
+
+# (バージョン, 名前, 適用関数) の一覧。既存のマイグレーションは変更せず、末尾に追加すること
+MIGRATIONS: List[Tuple[int, str, Callable]] = [
+    (1, 'baseline', _migration_001_baseline),
+    (2, 'sync_tables', _migration_002_sync_tables),
+    (3, 'daily_entries', _migration_003_daily_entries),
+    (4, 'indexes', _migration_004_indexes),
+    (5, 'report_search', _migration_005_report_search),
+    (6, 'weekly_report_version', _migration_006_weekly_report_version),
+    (7, 'realtime_change_seq', _migration_007_realtime_change_seq),
+    (8, 'edit_lock_lease', _migration_008_edit_lock_lease),
+    (9, 'realtime_base_seq', _migration_009_realtime_base_seq),
+    (10, 'edit_log', _migration_010_edit_log),
+    (11, 'edit_checkpoints', _migration_011_edit_checkpoints),
+    (12, 'llm_response_cache', _migration_012_llm_response_cache),
+    (13, 'report_search_bigram', _migration_013_report_search_bigram),
+]
+
+
+def get_schema_version(conn) -> int:
+    """適用済みの最新バージョンを取得（未管理のDBの場合は0）"""
+    row = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'").fetchone()
+    if row is None:
+        return 0
+    return conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+
+
+def apply_migrations(db_path: str) -> List[int]:
+    """未適用のマイグレーションを順番に適用し、適用したバージョンの一覧を返します。
+
+    各マイグレーションは個別のトランザクション（BEGIN IMMEDIATE）で適用し、トランザクション内で
+    バージョンを再確認するため、複数のプロセス・スレッドから同時に呼び出されても1回だけ適用される。
+    """
+    connections = get_connection_manager(db_path)
+    conn = connections.get_connection()
+    if get_schema_version(conn) >= MIGRATIONS[-1][0]:
+        return []
+
+    applied = []
+    for version, name, migrate in MIGRATIONS:
+        with connections.transaction() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    applied_at TEXT NOT NULL
+                )
+            ''')
+            if get_schema_version(conn) >= version:
+                continue
+            migrate(conn)
+            conn.execute(
+                'INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)',
+                (version, name, datetime.now().isoformat())
+            )
+        applied.append(version)
+        print(f"マイグレーションを適用しました: {version} ({name})")
+
+    if applied:
+        # インデックス選択に使う統計情報を更新
+        conn.execute('ANALYZE')
+    return applied
@@ -0,0 +1,49 @@
+"""
+入力途中データの整形
+日次レポートデータを日付をキーとする形式に揃える機能群（入力内容の自動保存は edit_log で行う）
+"""
+from datetime import datetime
+from typing import Dict
+
+
+def _is_date_key(key) -> bool:
+    """YYYY-MM-DD形式の日付キーかどうか"""
+    if not (isinstance(key, str) and len(key) == 10 and key.count('-') == 2):
+        return False
+    try:
+        datetime.strptime(key, '%Y-%m-%d')  # 日付形式を検証
+        return True
+    except ValueError:
+        return False
+
+def normalize_daily_reports(daily_reports_data: Dict, store_name: str = None) -> Dict:
+    """日次レポートデータを {日付: {'trend': ..., 'factors': [...]}} の形式に揃える
+
+    店舗名をキーとする旧形式（{店舗名: {日付: ...}}）が渡された場合は該当店舗のデータを取り出す。
+    """
+    if not isinstance(daily_reports_data, dict):
+        return {}
+    
+    # daily_reports_dataが既に正しい構造（日付をキーとする辞書）の場合はそのまま使用
+    if daily_reports_data and all(_is_date_key(k) for k in daily_reports_data.keys()):
+        store_daily_reports = daily_reports_data
+    elif store_name is not None:
+        # daily_reports_dataから該当店舗のデータを抽出
+        store_daily_reports = daily_reports_data.get(store_name, {})
+    else:
+        # 店舗名が不明な場合は、日付キーを持つ入れ子の辞書をまとめる
+        store_daily_reports = {}
+        for value in daily_reports_data.values():
+            if isinstance(value, dict):
+                store_daily_reports.update({k: v for k, v in value.items() if _is_date_key(k)})
+    
+    # データ構造の検証と修正（複数店舗データが混在している場合の対処）
+    clean_daily_reports = {}
+    for key, value in store_daily_reports.items():
+        # 日付形式のキーのみを保持（YYYY-MM-DD形式）
+        if _is_date_key(key) and isinstance(value, dict):
+            clean_daily_reports[key] = {
+                'trend': value.get('trend', '') or '',
+                'factors': list(value.get('factors', []) or [])
+            }
+    return clean_daily_reports
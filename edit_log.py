@@ -0,0 +1,341 @@
+"""
+編集ログ
+入力欄の変更を1件ずつ追記する追記専用のログ（edit_log）と、ログを週次レポート（スナップショット）に
+まとめて反映し、反映済みのログを削除する圧縮処理、チェックポイントからの時刻を指定した復元の機能群
+"""
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from db_connection import get_connection_manager
+
+# 未反映のログがこの件数たまるか、前回の圧縮からこの秒数が経つと週次レポートに反映する
+EDIT_LOG_COMPACT_EVERY_EDITS = int(os.getenv('EDIT_LOG_COMPACT_EVERY_EDITS', '50'))
+EDIT_LOG_COMPACT_INTERVAL_SECONDS = float(os.getenv('EDIT_LOG_COMPACT_INTERVAL_SECONDS', '30'))
+# 編集履歴の保持期間（秒）。この期間内の任意の時刻に週の入力内容を復元できる
+# （他のサーバープロセスの端末の同期にも使うため、同期の確認間隔の最大値 SYNC_POLL_MAX_INTERVAL_SECONDS より長くすること）
+EDIT_LOG_RETENTION_SECONDS = float(os.getenv('EDIT_LOG_RETENTION_SECONDS', '86400'))
+# 圧縮時にチェックポイントを記録する間隔（秒）。復元時に再生するログの件数はこの間隔分までに収まる
+EDIT_CHECKPOINT_INTERVAL_SECONDS = float(os.getenv('EDIT_CHECKPOINT_INTERVAL_SECONDS', '600'))
+
+# 週単位のフィールド（field_keyはフィールド名と同じ）と、日次のフィールド（field_keyは日付）
+WEEKLY_FIELD_TYPES = ('topics', 'impact_day', 'quantitative_data', 'generated_report')
+DAILY_FIELD_TYPES = {'daily_trend': 'trend', 'daily_factors': 'factors'}
+# 入力欄のフィールド（チェックポイント・元に戻す・復元の対象。生成レポートは含まない）
+INPUT_FIELD_TYPES = ('daily_trend', 'daily_factors', 'topics', 'impact_day', 'quantitative_data')
+
+
+def decode_edit_value(field_type: str, field_value: Optional[str]) -> Any:
+    """ログの値（文字列）を週次レポートの値に変換（要因はリスト、生成レポートは辞書）"""
+    if field_type in ('daily_factors', 'generated_report'):
+        empty = [] if field_type == 'daily_factors' else {}
+        try:
+            value = json.loads(field_value) if field_value else empty
+        except (json.JSONDecodeError, TypeError):
+            return empty
+        return value if isinstance(value, type(empty)) else empty
+    return field_value or ''
+
+
+def fold_edits(edits: List[Dict]) -> Tuple[Dict, Dict]:
+    """連番順のログをフィールドごとの最終値にまとめる
+
+    戻り値: (週単位のフィールド {フィールド名: 値}, 日次 {日付: {'trend': str, 'factors': list}})
+    """
+    fields = {}
+    daily_updates = {}
+    for edit in edits:
+        field_type = edit['field_type']
+        value = decode_edit_value(field_type, edit['field_value'])
+        if field_type in DAILY_FIELD_TYPES:
+            daily_updates.setdefault(edit['field_key'], {})[DAILY_FIELD_TYPES[field_type]] = value
+        elif field_type in WEEKLY_FIELD_TYPES:
+            fields[field_type] = value
+    return fields, daily_updates
+
+
+def apply_edits(report: Dict, edits: List[Dict]) -> Dict:
+    """週次レポート（get_weekly_report の形式）に未反映のログを適用する"""
+    fields, daily_updates = fold_edits(edits)
+    report.update(fields)
+    daily_reports = report.setdefault('daily_reports', {})
+    for date_str, day in daily_updates.items():
+        daily_reports.setdefault(date_str, {'trend': '', 'factors': []}).update(day)
+    return report
+
+
+class EditLog:
+    """店舗・週ごとの編集ログへの追記と読み取りを行うクラス
+
+    変更連番はAUTOINCREMENTで採番するため、ログを削除しても全デバイスで単調増加する。
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._connections = get_connection_manager(db_path)
+        self._lock = threading.Lock()
+        self._edits_since_compaction = 0
+        self.append_count = 0
+        # 未反映のログが一定件数たまったことを圧縮処理に知らせる
+        self.compact_requested = threading.Event()
+
+    def append(self, session_id: str, store_name: str, monday_date: str, field_type: str, field_key: str,
+               field_value: str, base_seq: Optional[int] = None) -> Tuple[int, str]:
+        """変更を1行追記し、(変更連番, 記録日時) を返す"""
+        with self._connections.transaction() as conn:
+            row = conn.execute('''
+                INSERT INTO edit_log (store_name, monday_date, field_type, field_key, field_value, session_id, base_seq)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                RETURNING seq, created_at
+            ''', (store_name, monday_date, field_type, field_key, field_value, session_id, base_seq)).fetchall()[0]
+        with self._lock:
+            self.append_count += 1
+            self._edits_since_compaction += 1
+            if self._edits_since_compaction >= EDIT_LOG_COMPACT_EVERY_EDITS:
+                self._edits_since_compaction = 0
+                self.compact_requested.set()
+        return row['seq'], row['created_at']
+
+    def get_current_seq(self, store_name: str, monday_date: str) -> int:
+        """指定した店舗・週の最新の変更連番を取得（ログがない場合は0）"""
+        conn = self._connections.get_connection()
+        row = conn.execute('''
+            SELECT MAX(seq) AS seq FROM edit_log WHERE store_name = ? AND monday_date = ?
+        ''', (store_name, monday_date)).fetchone()
+        return row['seq'] or 0
+
+    def get_changes_since(self, store_name: str, monday_date: str, last_seq: int,
+                          exclude_session: str = None) -> Tuple[Dict, int]:
+        """前回取得した連番より後の変更を、フィールドごとに最新の1件ずつ取得
+
+        戻り値: ({field_type: {field_key: {'value', 'updated', 'session', 'seq', 'base_seq'}}}, 次回に渡す連番)
+        自分のセッションの変更も連番は進める（次回の取得で再び読み込まないため）。
+        """
+        conn = self._connections.get_connection()
+        # MAX()と同時に選択した列は、SQLiteでは最大の連番を持つ行の値になる
+        rows = conn.execute('''
+            SELECT field_type, field_key, field_value, created_at, session_id, MAX(seq) AS seq, base_seq
+            FROM edit_log
+            WHERE store_name = ? AND monday_date = ? AND seq > ?
+            GROUP BY field_type, field_key
+        ''', (store_name, monday_date, last_seq)).fetchall()
+
+        result = {}
+        for row in rows:
+            last_seq = max(last_seq, row['seq'])
+            if exclude_session and row['session_id'] == exclude_session:
+                continue
+            result.setdefault(row['field_type'], {})[row['field_key']] = {
+                'value': row['field_value'],
+                'updated': row['created_at'],
+                'session': row['session_id'],
+                'seq': row['seq'],
+                'base_seq': row['base_seq']
+            }
+        return result, last_seq
+
+    def get_tail(self, store_name: str, monday_date: str, after_seq: int) -> List[Dict]:
+        """週次レポートに未反映（after_seqより後）のログを連番順に取得"""
+        conn = self._connections.get_connection()
+        rows = conn.execute('''
+            SELECT seq, field_type, field_key, field_value FROM edit_log
+            WHERE store_name = ? AND monday_date = ? AND seq > ?
+            ORDER BY seq
+        ''', (store_name, monday_date, after_seq)).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_pending_weeks(self) -> List[Tuple[str, str]]:
+        """週次レポートに未反映のログがある (店舗名, 月曜日) の一覧"""
+        conn = self._connections.get_connection()
+        rows = conn.execute('''
+            SELECT DISTINCT e.store_name, e.monday_date
+            FROM edit_log e
+            LEFT JOIN stores s ON s.name = e.store_name
+            LEFT JOIN weekly_reports w ON w.store_id = s.id AND w.monday_date = e.monday_date
+            WHERE e.seq > COALESCE(w.snapshot_seq, 0)
+        ''').fetchall()
+        return [(row['store_name'], row['monday_date']) for row in rows]
+
+    def get_edits_until(self, store_name: str, monday_date: str, after_seq: int, as_of: str) -> List[Dict]:
+        """after_seqより後で、指定時刻（UTC 'YYYY-MM-DD HH:MM:SS'）までの入力欄のログを連番順に取得（復元の再生用）"""
+        conn = self._connections.get_connection()
+        placeholders = ", ".join("?" for _ in INPUT_FIELD_TYPES)
+        rows = conn.execute(f'''
+            SELECT seq, field_type, field_key, field_value FROM edit_log
+            WHERE store_name = ? AND monday_date = ? AND seq > ?
+              AND created_at <= ? AND field_type IN ({placeholders})
+            ORDER BY seq
+        ''', (store_name, monday_date, after_seq, as_of, *INPUT_FIELD_TYPES)).fetchall()
+        return [dict(row) for row in rows]
+
+    def add_checkpoint(self, store_name: str, monday_date: str, seq: int, state: Dict):
+        """週の入力内容（seqまでのログを含む状態）をチェックポイントとして記録"""
+        with self._connections.transaction() as conn:
+            conn.execute('''
+                INSERT INTO edit_checkpoints (store_name, monday_date, seq, state_json) VALUES (?, ?, ?, ?)
+            ''', (store_name, monday_date, seq, json.dumps(state, ensure_ascii=False)))
+
+    def has_checkpoint(self, store_name: str, monday_date: str) -> bool:
+        """指定した店舗・週のチェックポイントがあるかどうか"""
+        conn = self._connections.get_connection()
+        row = conn.execute('''
+            SELECT 1 FROM edit_checkpoints WHERE store_name = ? AND monday_date = ? LIMIT 1
+        ''', (store_name, monday_date)).fetchone()
+        return row is not None
+
+    def is_checkpoint_due(self, store_name: str, monday_date: str,
+                          interval_seconds: float = EDIT_CHECKPOINT_INTERVAL_SECONDS) -> bool:
+        """最新のチェックポイントから一定時間が経過したかどうか（チェックポイントがない場合もTrue）"""
+        conn = self._connections.get_connection()
+        row = conn.execute('''
+            SELECT MAX(created_at) >= datetime('now', ?) AS recent
+            FROM edit_checkpoints WHERE store_name = ? AND monday_date = ?
+        ''', (f'-{interval_seconds} seconds', store_name, monday_date)).fetchone()
+        return not row['recent']
+
+    def get_checkpoint_as_of(self, store_name: str, monday_date: str, as_of: str) -> Optional[Dict]:
+        """指定時刻（UTC）以前の最新のチェックポイントを {'seq', 'state', 'created_at'} で取得（ない場合はNone）
+
+        記録開始前の状態（seqが0）のチェックポイントは、それより前の時刻の復元の起点にも使う。
+        """
+        conn = self._connections.get_connection()
+        row = conn.execute('''
+            SELECT seq, state_json, created_at FROM edit_checkpoints
+            WHERE store_name = ? AND monday_date = ? AND (created_at <= ? OR seq = 0)
+            ORDER BY created_at DESC, id DESC
+            LIMIT 1
+        ''', (store_name, monday_date, as_of)).fetchone()
+        if row is None:
+            return None
+        try:
+            state = json.loads(row['state_json'])
+        except (json.JSONDecodeError, TypeError) as e:
+            print(f"チェックポイントの解析に失敗しました: {str(e)}")
+            return None
+        return {'seq': row['seq'], 'state': state, 'created_at': row['created_at']}
+
+    def truncate(self, retention_seconds: float = EDIT_LOG_RETENTION_SECONDS) -> int:
+        """保持期間より前の復元に不要になったログとチェックポイントを削除し、削除したログの件数を返す
+
+        週ごとに保持期間より前の最新のチェックポイントを復元の起点として残し、
+        その連番以前のログ（チェックポイントに含まれ、週次レポートにも反映済み）と、それより古いチェックポイントを削除する。
+        """
+        # created_atはCURRENT_TIMESTAMP（UTC）のため、比較もSQLite側の時刻で行う
+        cutoff = f'-{retention_seconds} seconds'
+        with self._connections.transaction() as conn:
+            deleted = conn.execute('''
+                DELETE FROM edit_log
+                WHERE seq <= COALESCE((
+                    SELECT c.seq FROM edit_checkpoints c
+                    WHERE c.store_name = edit_log.store_name AND c.monday_date = edit_log.monday_date
+                      AND c.created_at < datetime('now', ?)
+                    ORDER BY c.created_at DESC, c.id DESC
+                    LIMIT 1
+                ), 0)
+            ''', (cutoff,)).rowcount
+            conn.execute('''
+                DELETE FROM edit_checkpoints
+                WHERE created_at < datetime('now', ?)
+                  AND id < (
+                      SELECT MAX(c.id) FROM edit_checkpoints c
+                      WHERE c.store_name = edit_checkpoints.store_name AND c.monday_date = edit_checkpoints.monday_date
+                        AND c.created_at < datetime('now', ?)
+                  )
+            ''', (cutoff, cutoff))
+        return deleted
+
+
+_edit_logs: Dict[str, EditLog] = {}
+_edit_logs_lock = threading.Lock()
+
+
+def get_edit_log(db_path: str) -> EditLog:
+    """データベースファイルごとに共有されるEditLogを取得"""
+    key = os.path.abspath(db_path)
+    with _edit_logs_lock:
+        edit_log = _edit_logs.get(key)
+        if edit_log is None:
+            edit_log = EditLog(key)
+            _edit_logs[key] = edit_log
+        return edit_log
+
+
+class EditLogCompactor(threading.Thread):
+    """一定件数・一定時間ごとに編集ログを週次レポートに反映し、反映済みのログを削除するバックグラウンドスレッド"""
+
+    def __init__(self, db_manager, interval_seconds: float = EDIT_LOG_COMPACT_INTERVAL_SECONDS):
+        super().__init__(name='edit-log-compactor', daemon=True)
+        self.db_manager = db_manager
+        self.interval_seconds = interval_seconds
+        self._stop_event = threading.Event()
+        self.runs = 0
+        self.last_run: Optional[datetime] = None
+        self.last_result: Dict[str, int] = {}
+        self.total: Dict[str, int] = {}
+        self.last_error: Optional[str] = None
+
+    def run_once(self) -> Dict[str, int]:
+        """圧縮を1回実行し、{'weeks', 'edits', 'truncated'} の件数を返す"""
+        result = self.db_manager.compact_edit_log()
+        self.runs += 1
+        self.last_run = datetime.now()
+        self.last_result = result
+        for name, count in result.items():
+            self.total[name] = self.total.get(name, 0) + count
+        return result
+
+    def run(self):
+        edit_log = get_edit_log(self.db_manager.db_path)
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"編集ログの圧縮エラー: {str(e)}")
+            # 一定時間経過するか、未反映のログが一定件数たまるまで待つ
+            edit_log.compact_requested.wait(self.interval_seconds)
+            edit_log.compact_requested.clear()
+
+    def stop(self):
+        self._stop_event.set()
+        get_edit_log(self.db_manager.db_path).compact_requested.set()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'interval_seconds': self.interval_seconds,
+            'every_edits': EDIT_LOG_COMPACT_EVERY_EDITS,
+            'runs': self.runs,
+            'last_run': self.last_run,
+            'last_result': dict(self.last_result),
+            'total': dict(self.total),
+            'last_error': self.last_error
+        }
+
+
+_compactor: Optional[EditLogCompactor] = None
+_compactor_lock = threading.Lock()
+
+
+def start_edit_log_compactor(db_manager) -> EditLogCompactor:
+    """プロセスで1つだけ圧縮処理を起動（起動済みの場合は対象のDBManagerのみ差し替える）"""
+    global _compactor
+    with _compactor_lock:
+        if _compactor is not None and _compactor.is_alive():
+            _compactor.db_manager = db_manager
+            return _compactor
+        _compactor = EditLogCompactor(db_manager)
+        _compactor.start()
+        return _compactor
+
+
+def get_edit_log_compactor_stats() -> Optional[Dict[str, Any]]:
+    """圧縮処理の実行状況（起動していない場合はNone）"""
+    compactor = _compactor
+    if compactor is None:
+        return None
+    stats = compactor.get_stats()
+    stats['alive'] = compactor.is_alive()
+    return stats
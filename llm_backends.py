@@ -0,0 +1,435 @@
+"""
+LLMバックエンド
+レポート生成が使うAIの呼び出し（応答全体の取得・ストリーミング・使用トークン数の集計）を共通の形で提供する機能群
+
+LLM_BACKEND で使用するバックエンドを切り替える:
+    openai: OpenAI API（LLM_BASE_URL を指定するとOpenAI互換のサーバー。下記のスタブサーバーも可）
+    stub:   プロセス内のスタブ（ネットワーク・APIキー不要。入力が同じなら常に同じ応答を返す）
+
+スタブサーバー（OpenAIと同じ形式のHTTPサーバー）の起動:
+    python llm_backends.py --port 8765 --latency 2.0 --error-rate 0.1
+    # アプリ側は LLM_BACKEND=openai、LLM_BASE_URL=http://127.0.0.1:8765/v1、OPENAI_API_KEY=sk-stub で接続する
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from openai_clients import get_openai_client_pool
+
+# 使用するバックエンド（openai / stub）とモデル
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'openai')
+LLM_MODEL = os.getenv('LLM_MODEL', 'gpt-4o-mini')
+# OpenAI互換のサーバーを使う場合の接続先（例: http://127.0.0.1:8765/v1）
+LLM_BASE_URL = os.getenv('LLM_BASE_URL') or None
+
+# スタブの設定（応答全体にかかる秒数・最初の断片までの秒数・エラーを返す割合とHTTPステータス・乱数の種）
+LLM_STUB_MODEL = os.getenv('LLM_STUB_MODEL', 'stub')
+LLM_STUB_LATENCY_SECONDS = float(os.getenv('LLM_STUB_LATENCY_SECONDS', '0.5'))
+LLM_STUB_FIRST_TOKEN_SECONDS = float(os.getenv('LLM_STUB_FIRST_TOKEN_SECONDS', '0.1'))
+LLM_STUB_ERROR_RATE = float(os.getenv('LLM_STUB_ERROR_RATE', '0'))
+LLM_STUB_ERROR_STATUS = int(os.getenv('LLM_STUB_ERROR_STATUS', '500'))
+LLM_STUB_SEED = int(os.getenv('LLM_STUB_SEED', '0'))
+# スタブが返す応答のJSONファイル（オブジェクト1件、またはオブジェクトのリスト。省略時は入力から組み立てる）
+LLM_STUB_RESPONSE_FILE = os.getenv('LLM_STUB_RESPONSE_FILE') or None
+# スタブのストリーミングで1回に送る文字数
+LLM_STUB_CHUNK_CHARS = 4
+
+Messages = List[Dict[str, str]]
+
+
+class LLMBackendError(Exception):
+    """バックエンドがエラーを返した場合の例外（OpenAIバックエンドはOpenAIの例外をそのまま送出する）"""
+
+    def __init__(self, message: str, status_code: int = 500):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def estimate_tokens(text: str) -> int:
+    """トークン数の概算（日本語は1文字あたり約1トークン・英数字は約4文字で1トークン）"""
+    ascii_chars = sum(1 for char in text if ord(char) < 128)
+    return (len(text) - ascii_chars) + (ascii_chars + 3) // 4
+
+
+class LLMBackend(ABC):
+    """AIの呼び出しの共通インターフェース
+
+    complete は応答全体を、stream は応答の断片を順に返す。どちらも使用トークン数を集計する（get_stats）。
+    """
+
+    name = ''
+
+    def __init__(self, model: str):
+        self.model = model
+        self._lock = threading.Lock()
+        self._counters = {'requests': 0, 'streams': 0, 'errors': 0,
+                          'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}
+
+    @abstractmethod
+    def complete(self, messages: Messages, temperature: float, max_tokens: int, timeout: float) -> str:
+        """応答全体を返す"""
+
+    @abstractmethod
+    def stream(self, messages: Messages, temperature: float, max_tokens: int, timeout: float) -> Iterator[str]:
+        """応答の断片を受信した順に返す"""
+
+    @property
+    def cache_namespace(self) -> str:
+        """応答キャッシュのキーに含める接続先の識別子（バックエンドの種類が異なる応答を混同しないため）"""
+        return self.name
+
+    def invalidate(self):
+        """認証エラー等で使えなくなった接続の検証結果を破棄（次回の呼び出し前に検証し直す）"""
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def _record_usage(self, prompt_tokens: int, completion_tokens: int):
+        with self._lock:
+            self._counters['prompt_tokens'] += prompt_tokens
+            self._counters['completion_tokens'] += completion_tokens
+            self._counters['total_tokens'] += prompt_tokens + completion_tokens
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._counters)
+        stats['backend'] = self.name
+        stats['model'] = self.model
+        return stats
+
+
+class OpenAIBackend(LLMBackend):
+    """OpenAI API（またはOpenAI互換のサーバー）のバックエンド。クライアントはOpenAIClientPoolで共有する"""
+
+    name = 'openai'
+
+    def __init__(self, api_key: str, model: str = LLM_MODEL, base_url: Optional[str] = LLM_BASE_URL):
+        super().__init__(model)
+        self.api_key = api_key
+        self.base_url = base_url
+
+    @property
+    def cache_namespace(self) -> str:
+        # OpenAI互換のサーバー（スタブサーバー等）の応答は本物のOpenAIの応答と区別する
+        return f"{self.name}|{self.base_url or ''}"
+
+    def validate(self):
+        """キーを検証（有効期限内の検証結果がある場合は省略）。失敗した場合はOpenAIの例外を送出する"""
+        get_openai_client_pool().validate(self.api_key, self.base_url, self.model)
+
+    def invalidate(self):
+        get_openai_client_pool().invalidate(self.api_key, self.base_url)
+
+    def complete(self, messages: Messages, temperature: float, max_tokens: int, timeout: float) -> str:
+        client = get_openai_client_pool().get_client(self.api_key, self.base_url)
+        self._count('requests')
+        try:
+            response = client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                timeout=timeout
+            )
+        except Exception:
+            self._count('errors')
+            raise
+        if response.usage is not None:
+            self._record_usage(response.usage.prompt_tokens, response.usage.completion_tokens)
+        return response.choices[0].message.content or ''
+
+    def stream(self, messages: Messages, temperature: float, max_tokens: int, timeout: float) -> Iterator[str]:
+        client = get_openai_client_pool().get_client(self.api_key, self.base_url)
+        self._count('requests')
+        self._count('streams')
+        try:
+            # 使用トークン数は最後の断片（choicesが空）で受け取る
+            chunks = client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                timeout=timeout,
+                stream=True,
+                stream_options={'include_usage': True}
+            )
+            for chunk in chunks:
+                if getattr(chunk, 'usage', None) is not None:
+                    self._record_usage(chunk.usage.prompt_tokens, chunk.usage.completion_tokens)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except Exception:
+            self._count('errors')
+            raise
+
+
+class StubBackend(LLMBackend):
+    """ネットワークを使わないスタブのバックエンド
+
+    応答は入力（メッセージ）のハッシュから決まるため、同じ入力には常に同じ応答を返す。
+    エラーは乱数の種を固定した割合で発生させる（呼び出し順が同じなら同じ呼び出しで発生する）。
+    """
+
+    name = 'stub'
+
+    def __init__(self, model: str = LLM_STUB_MODEL, latency_seconds: float = LLM_STUB_LATENCY_SECONDS,
+                 first_token_seconds: float = LLM_STUB_FIRST_TOKEN_SECONDS, error_rate: float = LLM_STUB_ERROR_RATE,
+                 error_status: int = LLM_STUB_ERROR_STATUS, responses: Optional[List[Dict]] = None,
+                 seed: int = LLM_STUB_SEED):
+        super().__init__(model)
+        self.latency_seconds = latency_seconds
+        self.first_token_seconds = min(first_token_seconds, latency_seconds)
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.responses = responses or []
+        self._random = random.Random(seed)
+
+    def _respond(self, messages: Messages) -> str:
+        """入力に対する応答（JSON文字列）を決め、エラーを発生させる場合は例外を送出"""
+        with self._lock:
+            self._counters['requests'] += 1
+            fail = self.error_rate > 0 and self._random.random() < self.error_rate
+            if fail:
+                self._counters['errors'] += 1
+        if fail:
+            raise LLMBackendError(f"スタブのエラー応答（HTTP {self.error_status}）", self.error_status)
+
+        prompt = '\n'.join(message.get('content', '') for message in messages)
+        digest = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        if self.responses:
+            response = self.responses[int(digest, 16) % len(self.responses)]
+        else:
+            response = {
+                'trend': f"（スタブ応答 {digest[:8]}）入力{len(prompt)}文字をもとにした週全体の動向です。"
+                         f"売上は前週並みで推移し、週末に客数が増加しました。",
+                'factors': [f"要因{i + 1}（{digest[8 + i * 4:12 + i * 4]}）" for i in range(3)],
+                'questions': ["来週の入荷予定に変更はありますか？"]
+            }
+        response_text = json.dumps(response, ensure_ascii=False)
+        self._record_usage(estimate_tokens(prompt), estimate_tokens(response_text))
+        return response_text
+
+    def complete(self, messages: Messages, temperature: float, max_tokens: int, timeout: float) -> str:
+        response_text = self._respond(messages)
+        time.sleep(self.latency_seconds)
+        return response_text
+
+    def stream(self, messages: Messages, temperature: float, max_tokens: int, timeout: float) -> Iterator[str]:
+        self._count('streams')
+        time.sleep(self.first_token_seconds)
+        response_text = self._respond(messages)
+        chunks = [response_text[i:i + LLM_STUB_CHUNK_CHARS] for i in range(0, len(response_text), LLM_STUB_CHUNK_CHARS)]
+        # 残りの時間を断片に均等に割り振る
+        interval = (self.latency_seconds - self.first_token_seconds) / max(1, len(chunks) - 1)
+        for i, chunk in enumerate(chunks):
+            if i > 0:
+                time.sleep(interval)
+            yield chunk
+
+
+def load_stub_responses(path: Optional[str]) -> List[Dict]:
+    """スタブの応答のJSONファイルを読み込む（オブジェクト1件の場合は1件のリストにする）"""
+    if not path:
+        return []
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    return data if isinstance(data, list) else [data]
+
+
+_backends: Dict[Tuple[str, ...], LLMBackend] = {}
+_backends_lock = threading.Lock()
+
+
+def get_llm_backend_name() -> str:
+    """使用するバックエンドの名前（.envの再読み込みを反映するため呼び出しごとに環境変数を参照する）"""
+    return os.getenv('LLM_BACKEND', LLM_BACKEND).strip().lower()
+
+
+def get_llm_backend(api_key: Optional[str] = None) -> LLMBackend:
+    """プロセス全体で共有するバックエンドを取得（openai の場合は api_key が必要）
+
+    OpenAIバックエンドのキーの検証は行わないため、必要に応じて validate() を呼び出すこと。
+    """
+    name = get_llm_backend_name()
+    model = os.getenv('LLM_MODEL', LLM_MODEL)
+    if name == 'stub':
+        key = ('stub',)
+    elif name == 'openai':
+        if not api_key:
+            raise ValueError('OpenAIバックエンドにはAPIキーが必要です')
+        base_url = os.getenv('LLM_BASE_URL') or None
+        key = ('openai', hashlib.sha256(api_key.encode('utf-8')).hexdigest(), base_url or '', model)
+    else:
+        raise ValueError(f"不明なLLMバックエンドです: {name}（openai / stub のいずれかを指定してください）")
+
+    with _backends_lock:
+        backend = _backends.get(key)
+        if backend is None:
+            if name == 'stub':
+                backend = StubBackend(responses=load_stub_responses(LLM_STUB_RESPONSE_FILE))
+            else:
+                backend = OpenAIBackend(api_key, model=model, base_url=base_url)
+            _backends[key] = backend
+        return backend
+
+
+def get_llm_backend_stats() -> List[Dict[str, Any]]:
+    """作成済みのバックエンドごとの呼び出し回数・使用トークン数"""
+    with _backends_lock:
+        backends = list(_backends.values())
+    return [backend.get_stats() for backend in backends]
+
+
+class _StubRequestHandler(BaseHTTPRequestHandler):
+    """OpenAIのAPIと同じ形式で応答するスタブサーバーのリクエスト処理"""
+
+    backend: StubBackend = None
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        # リクエストごとのログは出力しない
+        pass
+
+    def _send_json(self, status: int, body: Dict):
+        payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_error(self, status: int, message: str):
+        self._send_json(status, {'error': {'message': message, 'type': 'stub_error', 'code': status}})
+
+    def do_GET(self):
+        # キーの検証（models.retrieve）。OpenAI互換のサーバーと同じく、提供していないモデルは404を返す
+        if self.path.startswith('/v1/models/'):
+            model = self.path[len('/v1/models/'):]
+            if model != self.backend.model:
+                self._send_error(404, f"The model '{model}' does not exist")
+                return
+            self._send_json(200, {'id': model, 'object': 'model', 'created': 0, 'owned_by': 'stub'})
+        else:
+            self._send_error(404, f"Not found: {self.path}")
+
+    def do_POST(self):
+        if self.path != '/v1/chat/completions':
+            self._send_error(404, f"Not found: {self.path}")
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', '0'))) or b'{}')
+        except json.JSONDecodeError:
+            self._send_error(400, 'Invalid JSON body')
+            return
+
+        messages = request.get('messages', [])
+        completion_id = f"chatcmpl-stub-{uuid.uuid4().hex[:12]}"
+        model = request.get('model', self.backend.model)
+        try:
+            if request.get('stream'):
+                chunks = self.backend.stream(messages, request.get('temperature', 1.0), request.get('max_tokens', 0), 0)
+                first_chunk = next(chunks, '')
+            else:
+                response_text = self.backend.complete(messages, request.get('temperature', 1.0),
+                                                      request.get('max_tokens', 0), 0)
+        except LLMBackendError as e:
+            self._send_error(e.status_code, str(e))
+            return
+
+        def build_usage(response_text: str) -> Dict[str, int]:
+            prompt_tokens = estimate_tokens('\n'.join(message.get('content', '') for message in messages))
+            completion_tokens = estimate_tokens(response_text)
+            return {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                    'total_tokens': prompt_tokens + completion_tokens}
+
+        if not request.get('stream'):
+            self._send_json(200, {
+                'id': completion_id, 'object': 'chat.completion', 'created': int(time.time()), 'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': response_text},
+                             'finish_reason': 'stop'}],
+                'usage': build_usage(response_text)
+            })
+            return
+
+        # Server-Sent Events で断片を送信（Content-Lengthを使わないため送信後に接続を閉じる）
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        def send_chunk(choices: List[Dict], chunk_usage: Optional[Dict] = None):
+            chunk = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                     'model': model, 'choices': choices}
+            if chunk_usage is not None:
+                chunk['usage'] = chunk_usage
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+        sent = [first_chunk]
+        send_chunk([{'index': 0, 'delta': {'role': 'assistant', 'content': first_chunk}, 'finish_reason': None}])
+        for text in chunks:
+            sent.append(text)
+            send_chunk([{'index': 0, 'delta': {'content': text}, 'finish_reason': None}])
+        send_chunk([{'index': 0, 'delta': {}, 'finish_reason': 'stop'}])
+        if (request.get('stream_options') or {}).get('include_usage'):
+            send_chunk([], build_usage(''.join(sent)))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def start_stub_server(backend: Optional[StubBackend] = None, host: str = '127.0.0.1',
+                      port: int = 0) -> Tuple[ThreadingHTTPServer, str]:
+    """スタブサーバーをバックグラウンドのスレッドで起動し、(サーバー, base_url) を返す（port=0 は空いているポート）
+
+    停止する場合は server.shutdown() を呼び出すこと。
+    """
+    handler = type('StubRequestHandler', (_StubRequestHandler,), {'backend': backend or StubBackend()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='llm-stub-server', daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='OpenAIのAPIと同じ形式で応答するスタブサーバー')
+    parser.add_argument('--host', default='127.0.0.1', help='待ち受けるアドレス')
+    parser.add_argument('--port', type=int, default=8765, help='待ち受けるポート')
+    parser.add_argument('--model', default=LLM_STUB_MODEL, help='提供するモデル名（アプリの LLM_MODEL と合わせる）')
+    parser.add_argument('--latency', type=float, default=LLM_STUB_LATENCY_SECONDS, help='応答全体にかかる秒数')
+    parser.add_argument('--first-token', type=float, default=LLM_STUB_FIRST_TOKEN_SECONDS, help='ストリーミングで最初の断片を送るまでの秒数')
+    parser.add_argument('--error-rate', type=float, default=LLM_STUB_ERROR_RATE, help='エラーを返す割合（0〜1）')
+    parser.add_argument('--error-status', type=int, default=LLM_STUB_ERROR_STATUS, help='エラー時のHTTPステータス')
+    parser.add_argument('--responses', default=LLM_STUB_RESPONSE_FILE, help='返す応答のJSONファイル（省略時は入力から組み立てる）')
+    parser.add_argument('--seed', type=int, default=LLM_STUB_SEED, help='エラーを発生させる乱数の種')
+    args = parser.parse_args()
+
+    backend = StubBackend(model=args.model, latency_seconds=args.latency, first_token_seconds=args.first_token,
+                          error_rate=args.error_rate, error_status=args.error_status,
+                          responses=load_stub_responses(args.responses), seed=args.seed)
+    server, base_url = start_stub_server(backend, args.host, args.port)
+    print(f"スタブサーバーを起動しました: {base_url}（Ctrl+Cで停止）")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        stats = backend.get_stats()
+        print(f"リクエスト: {stats['requests']}件（エラー {stats['errors']}件）・トークン: {stats['total_tokens']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""
+LLM応答キャッシュ
+(接続先, モデル, システムプロンプト, ユーザープロンプト, temperature) のハッシュをキーに、AIの応答を再利用する機能群
+（プロセス内のLRUと、データベースの llm_response_cache の2段構成）
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from db_connection import get_connection_manager
+
+# 応答の有効期限（秒）。期限切れの応答は使わず、保存時に削除する
+LLM_CACHE_TTL_SECONDS = float(os.getenv('LLM_CACHE_TTL_SECONDS', str(7 * 24 * 3600)))
+# データベースに保持する応答の最大件数（超えた分は最終利用日時の古い順に削除）
+LLM_CACHE_MAX_ENTRIES = int(os.getenv('LLM_CACHE_MAX_ENTRIES', '1000'))
+# プロセス内に保持する応答の最大件数
+LLM_CACHE_MEMORY_ENTRIES = int(os.getenv('LLM_CACHE_MEMORY_ENTRIES', '128'))
+
+
+def build_cache_key(namespace: str, model: str, system_prompt: str, user_prompt: str, temperature: float) -> str:
+    """接続先とプロンプトの内容から応答キャッシュのキー（SHA-256）を生成
+
+    namespace はバックエンドの種類と接続先（LLMBackend.cache_namespace）。同じモデル名・プロンプトでも
+    接続先が異なる応答（スタブサーバー等）は別のキーになる。
+    """
+    payload = json.dumps([namespace, model, system_prompt, user_prompt, temperature], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class LLMResponseCache:
+    """AIの応答を内容のハッシュで保存・取得するクラス
+
+    取得はプロセス内のLRU → データベースの順に行い、データベースで見つかった応答はLRUにも載せる。
+    """
+
+    def __init__(self, db_path: str, ttl_seconds: float = LLM_CACHE_TTL_SECONDS,
+                 max_entries: int = LLM_CACHE_MAX_ENTRIES, memory_entries: int = LLM_CACHE_MEMORY_ENTRIES):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._connections = get_connection_manager(db_path)
+        self._lock = threading.Lock()
+        # キー -> (応答, 有効期限（time.monotonic()基準）)
+        self._memory: 'OrderedDict[str, Tuple[str, float]]' = OrderedDict()
+        self._counters = {'memory_hits': 0, 'db_hits': 0, 'misses': 0, 'bypasses': 0, 'stores': 0, 'evictions': 0}
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def _remember(self, key: str, response_text: str, expires_at: float):
+        """プロセス内のLRUに載せる（呼び出し元で self._lock を取得済みであること）"""
+        self._memory[key] = (response_text, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[str]:
+        """保存済みの応答を取得（ない場合・期限切れの場合はNone）"""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached is not None:
+                if cached[1] > now:
+                    self._memory.move_to_end(key)
+                    self._counters['memory_hits'] += 1
+                    return cached[0]
+                del self._memory[key]
+
+        conn = self._connections.get_connection()
+        row = conn.execute('''
+            SELECT response_text, (julianday('now') - julianday(created_at)) * 86400 AS age_seconds
+            FROM llm_response_cache
+            WHERE cache_key = ? AND created_at >= datetime('now', ?)
+        ''', (key, f'-{self.ttl_seconds} seconds')).fetchone()
+        if row is None:
+            self._count('misses')
+            return None
+
+        with self._connections.transaction() as conn:
+            conn.execute('''
+                UPDATE llm_response_cache SET last_used_at = CURRENT_TIMESTAMP, hit_count = hit_count + 1
+                WHERE cache_key = ?
+            ''', (key,))
+        with self._lock:
+            self._counters['db_hits'] += 1
+            self._remember(key, row['response_text'], now + self.ttl_seconds - row['age_seconds'])
+        return row['response_text']
+
+    def put(self, key: str, model: str, response_text: str):
+        """応答を保存し、期限切れの応答と最大件数を超えた古い応答を削除"""
+        with self._connections.transaction() as conn:
+            conn.execute('''
+                INSERT INTO llm_response_cache (cache_key, model, response_text) VALUES (?, ?, ?)
+                ON CONFLICT(cache_key) DO UPDATE SET
+                    model = excluded.model, response_text = excluded.response_text,
+                    created_at = CURRENT_TIMESTAMP, last_used_at = CURRENT_TIMESTAMP
+            ''', (key, model, response_text))
+            evicted = conn.execute('''
+                DELETE FROM llm_response_cache WHERE created_at < datetime('now', ?)
+            ''', (f'-{self.ttl_seconds} seconds',)).rowcount
+            evicted += conn.execute('''
+                DELETE FROM llm_response_cache WHERE cache_key IN (
+                    SELECT cache_key FROM llm_response_cache ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+                )
+            ''', (self.max_entries,)).rowcount
+        with self._lock:
+            self._counters['stores'] += 1
+            self._counters['evictions'] += evicted
+            self._remember(key, response_text, time.monotonic() + self.ttl_seconds)
+
+    def record_bypass(self):
+        """「再生成」でキャッシュを使わなかったことを記録"""
+        self._count('bypasses')
+
+    def clear(self) -> int:
+        """保存済みの応答を全て削除し、削除した件数を返す"""
+        with self._lock:
+            self._memory.clear()
+        with self._connections.transaction() as conn:
+            return conn.execute('DELETE FROM llm_response_cache').rowcount
+
+    def get_stats(self) -> Dict[str, Any]:
+        conn = self._connections.get_connection()
+        row = conn.execute('SELECT COUNT(*) AS entries FROM llm_response_cache').fetchone()
+        with self._lock:
+            stats = dict(self._counters)
+            stats['memory_entries'] = len(self._memory)
+        stats['db_entries'] = row['entries']
+        stats['ttl_seconds'] = self.ttl_seconds
+        stats['max_entries'] = self.max_entries
+        return stats
+
+
+_caches: Dict[str, LLMResponseCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_llm_response_cache(db_path: str) -> LLMResponseCache:
+    """データベースファイルごとに共有されるLLMResponseCacheを取得"""
+    key = os.path.abspath(db_path)
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = LLMResponseCache(key)
+            _caches[key] = cache
+        return cache
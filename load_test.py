@@ -0,0 +1,407 @@
+"""
+マルチデバイス同時編集の負荷試験
+複数の端末（スレッド・プロセス）から画面なしで MultiDeviceManager と DBManager.save_weekly_data を操作し、
+編集が他の端末に見えるまでの時間・SQLiteのビジー/ロックエラー・失われた更新・毎秒の書き込み件数を計測する
+
+使い方:
+    python load_test.py --devices 16 --processes 4 --stores 4 --duration 30
+    python load_test.py --devices 8 --no-occ    # バージョン確認なしで保存した場合の失われた更新を確認
+
+既定では一時ディレクトリに新しいデータベースを作成する（--db で既存DBのコピーを指定可能）。
+アプリが使用中のデータベース（apparel_reports.db）は指定しないこと。
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from db_connection import get_connection_manager
+from db_manager import DBManager, get_week_date_range
+from edit_log import start_edit_log_compactor
+from multi_device_support import MultiDeviceManager
+from sync_bus import get_sync_bus
+
+# 既定の店舗（DEFAULT_STORE_NAMES）で足りない場合に追加する店舗名の接頭辞
+EXTRA_STORE_PREFIX = 'LT'
+# 保存がバージョン競合した場合に最新の内容で再保存する回数の上限
+SAVE_RETRY_LIMIT = 5
+# 編集ロックの有効期限（秒）。別のフィールドの編集に移るまで保持する
+EDIT_LOCK_TTL_SECONDS = 5
+
+# プロセスごとに共有するマネージャー（アプリの st.cache_resource と同じく、同一プロセスの端末は共有する）
+_managers: Dict[str, Tuple[DBManager, MultiDeviceManager]] = {}
+_managers_lock = threading.Lock()
+
+
+def _get_managers(db_path: str) -> Tuple[DBManager, MultiDeviceManager]:
+    with _managers_lock:
+        managers = _managers.get(db_path)
+        if managers is None:
+            managers = (DBManager(db_path), MultiDeviceManager(db_path))
+            # 編集ログの週次レポートへの反映もアプリと同じくプロセスごとに1つ起動する
+            start_edit_log_compactor(managers[0])
+            _managers[db_path] = managers
+        return managers
+
+
+def _is_busy_error(error: sqlite3.OperationalError) -> bool:
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+
+def _percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    """p50 / p95 / p99 / 最大値（最近傍順位法）"""
+    if not values:
+        return {'count': 0, 'p50': None, 'p95': None, 'p99': None, 'max': None}
+    ordered = sorted(values)
+    result = {'count': len(ordered)}
+    for label, p in (('p50', 50), ('p95', 95), ('p99', 99)):
+        index = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+        result[label] = round(ordered[index], 2)
+    result['max'] = round(ordered[-1], 2)
+    return result
+
+
+def _parse_marker(value: str) -> Optional[Tuple[str, float]]:
+    """編集値に埋め込んだ (編集ID, 編集時刻) を取り出す"""
+    try:
+        marker = json.loads(value)
+        return marker['edit'], float(marker['at'])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def _split_tokens(topics: str) -> List[str]:
+    return [token for token in (topics or '').split('\n') if token]
+
+
+def run_device(config: Dict[str, Any], barrier) -> Dict[str, Any]:
+    """1台の端末として、設定された時間だけ編集・同期・保存を繰り返し、計測結果を返す
+
+    編集: 編集ロックを取得し、append_edit でフィールドの変更を編集ログに追記する
+    同期: 同期バス（同一プロセスの端末の変更）と get_changes_since（他プロセスの変更）から変更を取得する
+    保存: 最後に読み込んだ週次レポートのTOPICSに自分の編集IDを追記し、save_weekly_data で保存する
+    """
+    rng = random.Random(config['seed'])
+    store_name = config['store_name']
+    monday = config['monday']
+    device = f"d{config['device_index']:03d}"
+    db, sync = _get_managers(config['db_path'])
+    bus = get_sync_bus()
+
+    week_start, _ = get_week_date_range(monday)
+    start_date = datetime.strptime(week_start, '%Y-%m-%d')
+    fields = [('daily_trend', (start_date + timedelta(days=i)).strftime('%Y-%m-%d')) for i in range(7)]
+    # TOPICSは保存（失われた更新の確認）に使うため、編集ログへの編集の対象にしない
+    fields += [('impact_day', 'impact_day'), ('quantitative_data', 'quantitative_data')]
+
+    stats = {
+        'device': device,
+        'store_name': store_name,
+        'edits': 0,
+        'lock_denied': 0,
+        'saves': 0,
+        'save_conflicts': 0,
+        'save_gave_up': 0,
+        'busy_errors': {'edit': 0, 'poll': 0, 'save': 0},
+        'visibility_ms': [],
+        'write_ms': [],
+        'save_ms': [],
+        'saved_tokens': []
+    }
+
+    session_id = sync.register_session(store_name, f"load-test {device}")
+    store_id = db.get_store_id_by_name(store_name)
+    bus.subscribe(session_id, store_name, monday)
+    last_seq = sync.get_current_seq(store_name, monday)
+    report = db.get_weekly_report(store_id, monday)
+    # 同じ編集を同期バスとDBの両方から受け取った場合に2回数えないよう、最後に見た連番をフィールドごとに保持
+    seen_seq: Dict[Tuple[str, str], int] = {}
+
+    barrier.wait()
+    started_at = time.time()
+    end_at = started_at + config['duration']
+    next_poll = started_at
+    edit_count = 0
+    # 現在編集中（ロックを保持中）のフィールド。別のフィールドに移るときに解放する
+    held_lock: Optional[Tuple[str, str, str, str]] = None
+
+    def observe(changes: Dict, observed_at: float):
+        for field_type, field_changes in changes.items():
+            for field_key, change in field_changes.items():
+                if change['seq'] <= seen_seq.get((field_type, field_key), 0):
+                    continue
+                seen_seq[(field_type, field_key)] = change['seq']
+                marker = _parse_marker(change['value'])
+                if marker is not None:
+                    stats['visibility_ms'].append((observed_at - marker[1]) * 1000)
+
+    def save(token: str):
+        nonlocal report
+        for _ in range(SAVE_RETRY_LIMIT):
+            topics = "\n".join(_split_tokens(report.get('topics', '')) + [token])
+            data = {'daily_reports': {}, 'topics': topics, 'impact_day': '', 'quantitative_data': ''}
+            expected_version = report.get('version', 0) if config['use_occ'] else None
+            began = time.time()
+            result = db.save_weekly_data(store_id, monday, data, {'load_test': token}, expected_version=expected_version)
+            stats['save_ms'].append((time.time() - began) * 1000)
+            if not result['conflict']:
+                stats['saves'] += 1
+                stats['saved_tokens'].append(token)
+                report = {'topics': topics, 'version': result['version']}
+                return
+            stats['save_conflicts'] += 1
+            report = result['report']
+        stats['save_gave_up'] += 1
+
+    while True:
+        now = time.time()
+        if now >= end_at:
+            break
+        time.sleep(min(rng.expovariate(1 / config['think_time']), max(0.0, end_at - now)))
+
+        if time.time() >= next_poll:
+            try:
+                observe(bus.drain(session_id, store_name, monday), time.time())
+                changes, last_seq = sync.get_changes_since(store_name, monday, last_seq, exclude_session=session_id)
+                observe(changes, time.time())
+                # 画面の再読み込みに相当（保存はこの時点の内容を元にする）
+                report = db.get_weekly_report(store_id, monday) or {'topics': '', 'version': 0}
+            except sqlite3.OperationalError as e:
+                if not _is_busy_error(e):
+                    raise
+                stats['busy_errors']['poll'] += 1
+            next_poll = time.time() + config['poll_interval']
+
+        if time.time() >= end_at:
+            break
+        field_type, field_key = rng.choice(fields)
+        edit_count += 1
+        edit_id = f"{device}-{edit_count}"
+        try:
+            began = time.time()
+            lock_key = (store_name, monday, field_type, field_key)
+            if held_lock is not None and held_lock != lock_key:
+                sync.release_locks(session_id, [held_lock])
+                held_lock = None
+            if not sync.acquire_lock(session_id, store_name, monday, field_type, field_key, EDIT_LOCK_TTL_SECONDS):
+                stats['lock_denied'] += 1
+                continue
+            held_lock = lock_key
+            value = json.dumps({'edit': edit_id, 'at': began})
+            sync.append_edit(session_id, store_name, monday, field_type, field_key, value)
+            stats['write_ms'].append((time.time() - began) * 1000)
+            stats['edits'] += 1
+        except sqlite3.OperationalError as e:
+            if not _is_busy_error(e):
+                raise
+            stats['busy_errors']['edit'] += 1
+            continue
+
+        if rng.random() < config['save_ratio']:
+            try:
+                save(edit_id)
+            except sqlite3.OperationalError as e:
+                if not _is_busy_error(e):
+                    raise
+                stats['busy_errors']['save'] += 1
+
+    stats['elapsed'] = time.time() - started_at
+    try:
+        sync.release_locks(session_id)
+    except sqlite3.OperationalError as e:
+        print(f"ロックの解放に失敗しました: {str(e)}")
+    bus.unsubscribe(session_id)
+    return stats
+
+
+def _run_device_guarded(config: Dict[str, Any], barrier, results: List[Dict[str, Any]]):
+    try:
+        results.append(run_device(config, barrier))
+    except Exception as e:
+        print(f"端末 {config['device_index']} でエラーが発生しました: {str(e)}")
+        results.append({'device_index': config['device_index'], 'failed': True})
+        barrier.abort()
+
+
+def run_devices(configs: List[Dict[str, Any]], barrier) -> List[Dict[str, Any]]:
+    """同一プロセス内で端末ごとにスレッドを起動し、全端末の計測結果を返す"""
+    results: List[Dict[str, Any]] = []
+    threads = [threading.Thread(target=_run_device_guarded, args=(config, barrier, results)) for config in configs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def _process_main(configs: List[Dict[str, Any]], barrier, queue):
+    queue.put(run_devices(configs, barrier))
+
+
+def prepare_database(db_path: str, store_count: int) -> List[str]:
+    """スキーマを作成し、試験に使う店舗名の一覧を返す（既定の店舗で足りない分は追加）"""
+    db = DBManager(db_path)
+    store_names = [name for _, name in db.get_all_stores()]
+    with get_connection_manager(db_path).transaction() as conn:
+        for i in range(len(store_names), store_count):
+            name = f"{EXTRA_STORE_PREFIX}{i + 1:02d}"
+            conn.execute("INSERT OR IGNORE INTO stores (name) VALUES (?)", (name,))
+            store_names.append(name)
+    return store_names[:store_count]
+
+
+def count_lost_updates(db_path: str, monday: str, results: List[Dict[str, Any]]) -> Dict[str, int]:
+    """保存が成功した（競合が報告されなかった）編集IDのうち、最終的なTOPICSに残っていないものを店舗ごとに数える"""
+    db = DBManager(db_path)
+    saved: Dict[str, List[str]] = {}
+    for result in results:
+        saved.setdefault(result['store_name'], []).extend(result['saved_tokens'])
+
+    lost = {}
+    for store_name, tokens in saved.items():
+        final_tokens = set(_split_tokens(db.get_weekly_report(db.get_store_id_by_name(store_name), monday).get('topics', '')))
+        lost[store_name] = sum(1 for token in tokens if token not in final_tokens)
+    return lost
+
+
+def summarize(results: List[Dict[str, Any]], lost: Dict[str, int]) -> Dict[str, Any]:
+    elapsed = max(result['elapsed'] for result in results)
+    edits = sum(result['edits'] for result in results)
+    saves = sum(result['saves'] for result in results)
+    busy_errors = {
+        operation: sum(result['busy_errors'][operation] for result in results)
+        for operation in ('edit', 'poll', 'save')
+    }
+    return {
+        'devices': len(results),
+        'stores': len({result['store_name'] for result in results}),
+        'elapsed_seconds': round(elapsed, 2),
+        'edits': edits,
+        'saves': saves,
+        'writes_per_second': round((edits + saves) / elapsed, 1) if elapsed else 0.0,
+        'lock_denied': sum(result['lock_denied'] for result in results),
+        'save_conflicts': sum(result['save_conflicts'] for result in results),
+        'save_gave_up': sum(result['save_gave_up'] for result in results),
+        'busy_errors': busy_errors,
+        'lost_updates': sum(lost.values()),
+        'lost_updates_by_store': lost,
+        'visibility_ms': _percentiles([v for result in results for v in result['visibility_ms']]),
+        'edit_write_ms': _percentiles([v for result in results for v in result['write_ms']]),
+        'save_ms': _percentiles([v for result in results for v in result['save_ms']])
+    }
+
+
+def print_summary(summary: Dict[str, Any]):
+    def latency(label: str, values: Dict[str, Optional[float]]):
+        if not values['count']:
+            print(f"  {label}: 計測なし")
+            return
+        print(f"  {label}: p50 {values['p50']}ms / p95 {values['p95']}ms / p99 {values['p99']}ms "
+              f"/ 最大 {values['max']}ms（{values['count']}件）")
+
+    busy = summary['busy_errors']
+    print(f"端末数: {summary['devices']}（{summary['stores']}店舗） 計測時間: {summary['elapsed_seconds']}秒")
+    print(f"書き込み: 編集 {summary['edits']}件 / 保存 {summary['saves']}件（毎秒 {summary['writes_per_second']}件）")
+    print("レイテンシ:")
+    # 他の端末が取得する前に同じフィールドが上書きされた編集は、見えるまでの時間に含まれない
+    latency('編集が他の端末に見えるまで', summary['visibility_ms'])
+    latency('編集の書き込み', summary['edit_write_ms'])
+    latency('週次レポートの保存', summary['save_ms'])
+    print(f"ビジー/ロックエラー: 編集 {busy['edit']}件 / 同期 {busy['poll']}件 / 保存 {busy['save']}件")
+    print(f"編集ロックで拒否: {summary['lock_denied']}件")
+    print(f"保存の競合: {summary['save_conflicts']}件（再保存を断念: {summary['save_gave_up']}件）")
+    print(f"失われた更新: {summary['lost_updates']}件 {summary['lost_updates_by_store']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='マルチデバイス同時編集の負荷試験')
+    parser.add_argument('--devices', type=int, default=8, help='端末数')
+    parser.add_argument('--processes', type=int, default=1, help='端末を分散させるプロセス数（1の場合は全端末をスレッドで実行）')
+    parser.add_argument('--stores', type=int, default=4, help='店舗数（端末は店舗に均等に割り当てる）')
+    parser.add_argument('--duration', type=float, default=10.0, help='計測時間（秒）')
+    parser.add_argument('--think-time', type=float, default=0.2, help='端末ごとの編集間隔の平均（秒）')
+    parser.add_argument('--poll-interval', type=float, default=1.0, help='変更を取得する間隔（秒）')
+    parser.add_argument('--save-ratio', type=float, default=0.1, help='編集のうち週次レポートの保存も行う割合')
+    parser.add_argument('--no-occ', action='store_true', help='保存時にバージョンを確認しない（上書きによる失われた更新の確認用）')
+    parser.add_argument('--busy-timeout-ms', type=int, default=None, help='SQLiteのbusy_timeout（省略時は SQLITE_BUSY_TIMEOUT_MS）')
+    parser.add_argument('--db', default=None, help='使用するデータベース（省略時は一時ディレクトリに新規作成）')
+    parser.add_argument('--seed', type=int, default=0, help='乱数の種')
+    parser.add_argument('--json', action='store_true', help='結果をJSONで出力')
+    args = parser.parse_args()
+
+    if args.devices < 1 or args.processes < 1 or args.stores < 1:
+        parser.error('--devices / --processes / --stores は1以上を指定してください')
+    if args.busy_timeout_ms is not None:
+        # 子プロセスにも引き継ぐため、接続の作成前に環境変数で指定する
+        os.environ['SQLITE_BUSY_TIMEOUT_MS'] = str(args.busy_timeout_ms)
+
+    temp_dir = None
+    db_path = args.db
+    if db_path is None:
+        temp_dir = tempfile.mkdtemp(prefix='report_app_load_test_')
+        db_path = os.path.join(temp_dir, 'load_test.db')
+    db_path = os.path.abspath(db_path)
+
+    try:
+        store_names = prepare_database(db_path, args.stores)
+        if len(store_names) < args.stores:
+            parser.error(f'店舗を{args.stores}件用意できませんでした')
+        today = datetime.now().date()
+        monday = (today - timedelta(days=today.weekday())).strftime('%Y-%m-%d')
+
+        configs = [{
+            'db_path': db_path,
+            'device_index': i,
+            'store_name': store_names[i % len(store_names)],
+            'monday': monday,
+            'duration': args.duration,
+            'think_time': args.think_time,
+            'poll_interval': args.poll_interval,
+            'save_ratio': args.save_ratio,
+            'use_occ': not args.no_occ,
+            'seed': args.seed * 100003 + i
+        } for i in range(args.devices)]
+
+        if args.processes == 1:
+            results = run_devices(configs, threading.Barrier(len(configs)))
+        else:
+            context = multiprocessing.get_context('spawn')
+            barrier = context.Barrier(len(configs))
+            queue = context.Queue()
+            processes = [
+                context.Process(target=_process_main, args=(configs[p::args.processes], barrier, queue))
+                for p in range(min(args.processes, len(configs)))
+            ]
+            for process in processes:
+                process.start()
+            results = [result for _ in processes for result in queue.get()]
+            for process in processes:
+                process.join()
+
+        failed = [result for result in results if result.get('failed')]
+        if failed:
+            raise SystemExit(f"{len(failed)}台の端末が異常終了しました")
+
+        summary = summarize(results, count_lost_updates(db_path, monday, results))
+        summary['processes'] = args.processes
+        summary['use_occ'] = not args.no_occ
+        if args.json:
+            print(json.dumps(summary, ensure_ascii=False, indent=2))
+        else:
+            print_summary(summary)
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,169 +2,342 @@
 マルチデバイス対応機能
 複数のデバイス・PCから同時にレポート編集を可能にする機能群
 """
-import sqlite3
 import json
 import time
+import os
 import threading
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any
+from datetime import datetime
+from typing import Dict, List, Optional, Any, Tuple
 import streamlit as st
+from db_connection import get_connection_manager
+from db_migrations import apply_migrations
+from edit_log import get_edit_log
+from sync_bus import get_sync_bus
+from text_merge import three_way_merge
+
+# report_app.pyと同じデータベースファイルを参照する（起動ディレクトリに依存しないよう絶対パス）
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'apparel_reports.db')
+
+# 他デバイスの変更を確認する間隔（秒）。0の場合は自動確認せず同期ボタンのみ
+SYNC_POLL_INTERVAL_SECONDS = float(os.getenv('SYNC_POLL_INTERVAL_SECONDS', '5'))
+# 変更がない間は確認間隔をこの倍率で延ばし、最大この秒数まで間隔を空ける
+SYNC_POLL_BACKOFF = 2.0
+SYNC_POLL_MAX_INTERVAL_SECONDS = float(os.getenv('SYNC_POLL_MAX_INTERVAL_SECONDS', '60'))
+# 同じサーバープロセス内の変更（同期バス）を確認する間隔（秒）。メモリ上の確認のみのため短い間隔にできる
+SYNC_BUS_POLL_INTERVAL_SECONDS = float(os.getenv('SYNC_BUS_POLL_INTERVAL_SECONDS', '1'))
+
+# 同時編集を文字単位でマージするテキストフィールド（それ以外は後から保存した値を採用）
+MERGEABLE_FIELD_TYPES = ('daily_trend', 'topics', 'impact_day')
+# マージの元テキストとしてフィールドごとに保持するバージョン数
+TEXT_VERSION_HISTORY = 8
+
+# 編集ロックの有効期限（秒）。編集中は再実行ごとに延長し、この時間編集がなければ自動的に失効・解放する
+EDIT_LOCK_TTL_SECONDS = float(os.getenv('EDIT_LOCK_TTL_SECONDS', '60'))
+
+# セッションの最終アクティブ時刻をデータベースに書き込む間隔（秒）。この間の更新はまとめて1回で書き込む
+SESSION_HEARTBEAT_INTERVAL_SECONDS = float(os.getenv('SESSION_HEARTBEAT_INTERVAL_SECONDS', '30'))
+# アクティブなデバイスとして表示する期間（秒）と、セッションを削除するまでの期間（秒）
+ACTIVE_SESSION_WINDOW_SECONDS = 300
+INACTIVE_SESSION_TTL_SECONDS = 1800
+# 不要データを削除するバックグラウンド処理の実行間隔（秒）。0の場合は起動しない
+SYNC_JANITOR_INTERVAL_SECONDS = float(os.getenv('SYNC_JANITOR_INTERVAL_SECONDS', '300'))
 
 class MultiDeviceManager:
     """複数デバイス間でのデータ同期を管理するクラス"""
     
-    def __init__(self, db_path: str = 'apparel_reports.db'):
+    def __init__(self, db_path: str = DEFAULT_DB_PATH):
         self.db_path = db_path
-        self.lock = threading.Lock()
+        # DBManagerと同じ接続プール（スレッドごとに接続を再利用）を使用
+        self._connections = get_connection_manager(db_path)
+        # 入力欄の変更は編集ログに追記し、他のデバイスも編集ログから変更を取得する
+        self.edit_log = get_edit_log(db_path)
+        # セッションID -> 店舗名。heartbeat() で記録し、flush_heartbeats() でまとめて書き込む
+        self._pending_heartbeats: Dict[str, str] = {}
+        self._heartbeat_lock = threading.Lock()
+        self._last_heartbeat_flush = 0.0
         self._init_sync_tables()
     
     def _init_sync_tables(self):
-        """同期用のテーブルを初期化"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
-            
-            # デバイス・セッション管理テーブル
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS active_sessions (
-                    session_id TEXT PRIMARY KEY,
-                    device_info TEXT,
-                    store_name TEXT,
-                    last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    editing_data TEXT
-                )
-            ''')
-            
-            # リアルタイム同期用データテーブル
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS realtime_data (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    store_name TEXT NOT NULL,
-                    monday_date TEXT NOT NULL,
-                    field_type TEXT NOT NULL,  -- daily_trend, daily_factors, topics, impact_day, quantitative
-                    field_key TEXT,  -- 日付やフィールド名
-                    field_value TEXT,
-                    last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    session_id TEXT,
-                    UNIQUE(store_name, monday_date, field_type, field_key)
-                )
-            ''')
-            
-            # 編集ロック管理テーブル
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS edit_locks (
-                    store_name TEXT NOT NULL,
-                    monday_date TEXT NOT NULL,
-                    field_type TEXT NOT NULL,
-                    field_key TEXT,
-                    session_id TEXT NOT NULL,
-                    locked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    PRIMARY KEY (store_name, monday_date, field_type, field_key)
-                )
-            ''')
-            
-            conn.commit()
+        """同期用のテーブルを初期化（スキーマはdb_migrationsで管理）"""
+        apply_migrations(self.db_path)
     
     def register_session(self, store_name: str, device_info: str = "") -> str:
         """デバイス・セッションを登録"""
         session_id = f"session_{int(time.time() * 1000)}_{hash(device_info) % 10000}"
         
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connections.transaction() as conn:
             conn.execute('''
                 INSERT OR REPLACE INTO active_sessions 
                 (session_id, device_info, store_name, last_active)
                 VALUES (?, ?, ?, CURRENT_TIMESTAMP)
             ''', (session_id, device_info, store_name))
-            conn.commit()
         
         return session_id
     
-    def update_realtime_data(self, session_id: str, store_name: str, monday_date: str, 
-                           field_type: str, field_key: str, field_value: str):
-        """リアルタイムデータを更新"""
-        with self.lock:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.execute('''
-                    INSERT OR REPLACE INTO realtime_data 
-                    (store_name, monday_date, field_type, field_key, field_value, session_id)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (store_name, monday_date, field_type, field_key, field_value, session_id))
-                conn.commit()
-    
-    def get_latest_data(self, store_name: str, monday_date: str, exclude_session: str = None) -> Dict:
-        """最新のデータを取得（自分のセッション以外から）"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
-            
-            query = '''
-                SELECT field_type, field_key, field_value, last_updated, session_id
-                FROM realtime_data 
-                WHERE store_name = ? AND monday_date = ?
-            '''
-            params = [store_name, monday_date]
-            
-            if exclude_session:
-                query += ' AND session_id != ?'
-                params.append(exclude_session)
-                
-            query += ' ORDER BY last_updated DESC'
-            
-            rows = conn.execute(query, params).fetchall()
-            
-            result = {}
-            for row in rows:
-                field_type = row['field_type']
-                if field_type not in result:
-                    result[field_type] = {}
-                
-                result[field_type][row['field_key']] = {
-                    'value': row['field_value'],
-                    'updated': row['last_updated'],
-                    'session': row['session_id']
-                }
-            
-            return result
+    def heartbeat(self, session_id: str, store_name: str):
+        """セッションのアクティビティを記録（書き込みは前回からSESSION_HEARTBEAT_INTERVAL_SECONDS経過時にまとめて行う）"""
+        with self._heartbeat_lock:
+            self._pending_heartbeats[session_id] = store_name
+            if time.monotonic() - self._last_heartbeat_flush < SESSION_HEARTBEAT_INTERVAL_SECONDS:
+                return
+        self.flush_heartbeats()
+    
+    def flush_heartbeats(self) -> int:
+        """記録済みのアクティビティを1回の書き込みで反映し、更新したセッション数を返す"""
+        with self._heartbeat_lock:
+            pending, self._pending_heartbeats = self._pending_heartbeats, {}
+            self._last_heartbeat_flush = time.monotonic()
+        if not pending:
+            return 0
+        try:
+            with self._connections.transaction() as conn:
+                # 削除済み（長時間操作のなかった）セッションは登録し直す
+                conn.executemany('''
+                    INSERT INTO active_sessions (session_id, store_name, last_active)
+                    VALUES (?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT(session_id) DO UPDATE SET
+                        store_name = excluded.store_name,
+                        last_active = excluded.last_active
+                ''', list(pending.items()))
+        except Exception:
+            with self._heartbeat_lock:
+                for session_id, store_name in pending.items():
+                    self._pending_heartbeats.setdefault(session_id, store_name)
+            raise
+        return len(pending)
+    
+    def append_edit(self, session_id: str, store_name: str, monday_date: str,
+                    field_type: str, field_key: str, field_value: str,
+                    base_seq: Optional[int] = None) -> int:
+        """フィールドの変更を編集ログに追記し、採番した変更連番を返す（入力内容の保存もこの追記のみで行う）
+        
+        base_seqには編集の元にした変更の連番を指定する（テキストのマージ用）。
+        保存後、同じプロセスで購読中のセッションには同期バスで即時に配信する。
+        """
+        change_seq, created_at = self.edit_log.append(
+            session_id, store_name, monday_date, field_type, field_key, field_value, base_seq
+        )
+        get_sync_bus().publish(store_name, monday_date, {
+            'field_type': field_type,
+            'field_key': field_key,
+            'value': field_value,
+            'updated': created_at,
+            'session': session_id,
+            'seq': change_seq,
+            'base_seq': base_seq
+        })
+        return change_seq
+    
+    def get_current_seq(self, store_name: str, monday_date: str) -> int:
+        """指定した店舗・週の最新の変更連番を取得（変更がない場合は0）"""
+        return self.edit_log.get_current_seq(store_name, monday_date)
+    
+    def get_changes_since(self, store_name: str, monday_date: str, last_seq: int,
+                          exclude_session: str = None) -> Tuple[Dict, int]:
+        """前回取得した連番より後の変更のみを取得
+        
+        戻り値: ({field_type: {field_key: {'value', 'updated', 'session', 'seq', 'base_seq'}}}, 次回に渡す連番)
+        """
+        return self.edit_log.get_changes_since(store_name, monday_date, last_seq, exclude_session)
     
     def get_active_sessions(self, store_name: str) -> List[Dict]:
         """指定店舗でアクティブなセッション一覧を取得"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
-            
-            # 5分以内にアクティビティがあるセッションを取得
-            cutoff_time = datetime.now() - timedelta(minutes=5)
-            
+        conn = self._connections.get_connection()
+        
+        # 5分以内にアクティビティがあるセッションを取得
+        # last_activeはCURRENT_TIMESTAMP（UTC・'YYYY-MM-DD HH:MM:SS'形式）のため、比較もSQLite側の時刻で行う
+        rows = conn.execute('''
+            SELECT session_id, device_info, last_active
+            FROM active_sessions 
+            WHERE store_name = ? AND last_active > datetime('now', ?)
+            ORDER BY last_active DESC
+        ''', (store_name, f'-{ACTIVE_SESSION_WINDOW_SECONDS} seconds')).fetchall()
+        
+        return [dict(row) for row in rows]
+    
+    def get_locks(self, store_name: str, monday_date: str) -> Dict[Tuple[str, str], Dict]:
+        """指定した店舗・週の有効な編集ロックを1回のクエリで取得
+        
+        戻り値: {(field_type, field_key): {'session_id', 'expires_at'}}
+        """
+        conn = self._connections.get_connection()
+        rows = conn.execute('''
+            SELECT field_type, field_key, session_id, expires_at
+            FROM edit_locks
+            WHERE store_name = ? AND monday_date = ? AND expires_at > ?
+        ''', (store_name, monday_date, time.time())).fetchall()
+        return {
+            (row['field_type'], row['field_key']): {'session_id': row['session_id'], 'expires_at': row['expires_at']}
+            for row in rows
+        }
+    
+    def acquire_lock(self, session_id: str, store_name: str, monday_date: str,
+                     field_type: str, field_key: str, ttl_seconds: float = EDIT_LOCK_TTL_SECONDS) -> bool:
+        """編集ロックを取得（自分が保持中の場合は延長）。他のセッションが有効なロックを保持している場合はFalse"""
+        now = time.time()
+        with self._connections.transaction() as conn:
+            # 期限切れのロックのみ奪える。DO UPDATEのWHEREが偽の場合は行が返らない
             rows = conn.execute('''
-                SELECT session_id, device_info, last_active
-                FROM active_sessions 
-                WHERE store_name = ? AND last_active > ?
-                ORDER BY last_active DESC
-            ''', (store_name, cutoff_time.isoformat())).fetchall()
-            
-            return [dict(row) for row in rows]
+                INSERT INTO edit_locks (store_name, monday_date, field_type, field_key, session_id, locked_at, expires_at)
+                VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP, ?)
+                ON CONFLICT(store_name, monday_date, field_type, field_key) DO UPDATE SET
+                    session_id = excluded.session_id,
+                    locked_at = CASE WHEN edit_locks.session_id = excluded.session_id THEN edit_locks.locked_at ELSE excluded.locked_at END,
+                    expires_at = excluded.expires_at
+                WHERE edit_locks.session_id = excluded.session_id OR edit_locks.expires_at <= ?
+                RETURNING session_id
+            ''', (store_name, monday_date, field_type, field_key, session_id, now + ttl_seconds, now)).fetchall()
+        return bool(rows)
+    
+    def renew_locks(self, session_id: str, lock_keys: List[Tuple[str, str, str, str]],
+                    ttl_seconds: float = EDIT_LOCK_TTL_SECONDS) -> int:
+        """保持中のロック（(店舗, 週, field_type, field_key) の一覧）の期限を1回の更新でまとめて延長し、延長できた件数を返す"""
+        if not lock_keys:
+            return 0
+        placeholders = ", ".join("(?, ?, ?, ?)" for _ in lock_keys)
+        params = [value for lock_key in lock_keys for value in lock_key]
+        with self._connections.transaction() as conn:
+            cursor = conn.execute(f'''
+                UPDATE edit_locks SET expires_at = ?
+                WHERE session_id = ?
+                  AND (store_name, monday_date, field_type, field_key) IN (VALUES {placeholders})
+            ''', [time.time() + ttl_seconds, session_id, *params])
+        return cursor.rowcount
+    
+    def release_locks(self, session_id: str, lock_keys: List[Tuple[str, str, str, str]] = None):
+        """ロックを解放（lock_keysを省略した場合はセッションの全ロック）"""
+        with self._connections.transaction() as conn:
+            if lock_keys is None:
+                conn.execute('DELETE FROM edit_locks WHERE session_id = ?', (session_id,))
+                return
+            if not lock_keys:
+                return
+            placeholders = ", ".join("(?, ?, ?, ?)" for _ in lock_keys)
+            params = [value for lock_key in lock_keys for value in lock_key]
+            conn.execute(f'''
+                DELETE FROM edit_locks
+                WHERE session_id = ?
+                  AND (store_name, monday_date, field_type, field_key) IN (VALUES {placeholders})
+            ''', [session_id, *params])
     
-    def cleanup_inactive_sessions(self):
-        """非アクティブなセッションをクリーンアップ"""
-        cutoff_time = datetime.now() - timedelta(minutes=30)
+    def cleanup_inactive_sessions(self) -> Dict[str, int]:
+        """非アクティブなセッションをクリーンアップし、テーブルごとの削除件数を返す"""
+        # 未反映のアクティビティを先に書き込み、操作中のセッションを削除しないようにする
+        self.flush_heartbeats()
         
-        with sqlite3.connect(self.db_path) as conn:
-            # 古いセッションを削除
-            conn.execute('''
+        with self._connections.transaction() as conn:
+            # 古いセッションを削除（時刻はCURRENT_TIMESTAMPと同じUTCで比較）
+            removed_sessions = conn.execute('''
                 DELETE FROM active_sessions 
-                WHERE last_active < ?
-            ''', (cutoff_time.isoformat(),))
+                WHERE last_active < datetime('now', ?)
+            ''', (f'-{INACTIVE_SESSION_TTL_SECONDS} seconds',)).rowcount
             
-            # 古いリアルタイムデータを削除（1週間以上古い）
-            week_ago = datetime.now() - timedelta(weeks=1)
-            conn.execute('''
-                DELETE FROM realtime_data 
-                WHERE last_updated < ?
-            ''', (week_ago.isoformat(),))
+            # 編集ログは週次レポートへの反映後に圧縮処理（edit_log.EditLogCompactor）が削除する
             
-            conn.commit()
+            # 期限切れの編集ロックを削除
+            removed_locks = conn.execute('DELETE FROM edit_locks WHERE expires_at <= ?', (time.time(),)).rowcount
+        
+        return {
+            'active_sessions': removed_sessions,
+            'edit_locks': removed_locks
+        }
+
+
+class SessionJanitor(threading.Thread):
+    """非アクティブなセッション・期限切れロックを定期的に削除するバックグラウンドスレッド"""
+    
+    def __init__(self, manager: MultiDeviceManager, interval_seconds: float = SYNC_JANITOR_INTERVAL_SECONDS):
+        super().__init__(name='sync-janitor', daemon=True)
+        self.manager = manager
+        self.interval_seconds = interval_seconds
+        self._stop_event = threading.Event()
+        self.runs = 0
+        self.last_run: Optional[datetime] = None
+        self.last_removed: Dict[str, int] = {}
+        self.total_removed: Dict[str, int] = {}
+        self.last_error: Optional[str] = None
+    
+    def run_once(self) -> Dict[str, int]:
+        """削除を1回実行し、テーブルごとの削除件数を返す"""
+        removed = self.manager.cleanup_inactive_sessions()
+        # 終了したセッションの同期バスの購読も削除
+        removed['sync_bus'] = get_sync_bus().prune(INACTIVE_SESSION_TTL_SECONDS)
+        self.runs += 1
+        self.last_run = datetime.now()
+        self.last_removed = removed
+        for table, count in removed.items():
+            self.total_removed[table] = self.total_removed.get(table, 0) + count
+        if any(removed.values()):
+            print(f"同期データを削除しました: {removed}")
+        return removed
+    
+    def run(self):
+        # 起動直後に1回実行し、以降は一定間隔で実行
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"同期データの削除エラー: {str(e)}")
+            self._stop_event.wait(self.interval_seconds)
+    
+    def stop(self):
+        self._stop_event.set()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'interval_seconds': self.interval_seconds,
+            'runs': self.runs,
+            'last_run': self.last_run,
+            'last_removed': dict(self.last_removed),
+            'total_removed': dict(self.total_removed),
+            'last_error': self.last_error
+        }
+
+
+_janitor: Optional[SessionJanitor] = None
+_janitor_lock = threading.Lock()
+
+def start_session_janitor(manager: MultiDeviceManager) -> Optional[SessionJanitor]:
+    """プロセスで1つだけバックグラウンドの削除処理を起動（起動済みの場合は対象のManagerのみ差し替える）"""
+    global _janitor
+    if SYNC_JANITOR_INTERVAL_SECONDS <= 0:
+        return None
+    with _janitor_lock:
+        if _janitor is not None and _janitor.is_alive():
+            _janitor.manager = manager
+            return _janitor
+        _janitor = SessionJanitor(manager)
+        _janitor.start()
+        return _janitor
+
+def get_session_janitor_stats() -> Optional[Dict[str, Any]]:
+    """バックグラウンドの削除処理の実行状況（起動していない場合はNone）"""
+    janitor = _janitor
+    if janitor is None:
+        return None
+    stats = janitor.get_stats()
+    stats['alive'] = janitor.is_alive()
+    return stats
+
+@st.cache_resource(show_spinner=False)
+def get_multi_device_manager(db_path: str = DEFAULT_DB_PATH) -> MultiDeviceManager:
+    """プロセス全体で共有するMultiDeviceManagerを取得（同期テーブルの初期化は1回のみ）"""
+    manager = MultiDeviceManager(db_path)
+    start_session_janitor(manager)
+    return manager
+
+def clear_multi_device_manager():
+    """共有MultiDeviceManagerのキャッシュを破棄"""
+    get_multi_device_manager.clear()
+    if 'multi_device_manager' in st.session_state:
+        del st.session_state['multi_device_manager']
 
 def init_multi_device_session(store_name: str) -> str:
     """マルチデバイスセッションを初期化"""
     if 'multi_device_manager' not in st.session_state:
-        st.session_state['multi_device_manager'] = MultiDeviceManager()
+        st.session_state['multi_device_manager'] = get_multi_device_manager()
     
     if 'device_session_id' not in st.session_state:
         # デバイス情報を生成
@@ -173,28 +346,188 @@ def init_multi_device_session(store_name: str) -> str:
         st.session_state['device_session_id'] = st.session_state['multi_device_manager'].register_session(
             store_name, device_info
         )
+    else:
+        # 操作中であることを記録（書き込みは一定間隔でまとめて行う）
+        try:
+            st.session_state['multi_device_manager'].heartbeat(st.session_state['device_session_id'], store_name)
+        except Exception as e:
+            print(f"セッションの更新エラー: {str(e)}")
     
     return st.session_state['device_session_id']
 
+def _get_text_versions(store_name: str, monday_date: str, field_type: str, field_key: str) -> Dict[str, Any]:
+    """マージ用に保持しているフィールドのバージョン {'head': 現在の値の元にした連番, 'versions': {連番: テキスト}}
+    
+    連番Noneのバージョンは、同期を始める前の（読み込み時の）値。
+    """
+    states = st.session_state.setdefault('sync_text_versions', {})
+    return states.setdefault((store_name, monday_date, field_type, field_key), {'head': None, 'versions': {}})
+
+def _record_text_version(state: Dict[str, Any], seq: int, value: str):
+    """バージョンを記録し、古いバージョンを削除する（読み込み時の値は残す）"""
+    versions = state['versions']
+    versions[seq] = value
+    state['head'] = seq
+    numbered = sorted(key for key in versions if key is not None)
+    for old_seq in numbered[:-TEXT_VERSION_HISTORY]:
+        del versions[old_seq]
+
 def sync_field_update(store_name: str, monday_date: str, field_type: str, 
-                     field_key: str, field_value: str):
-    """フィールド更新を他のデバイスと同期"""
+                     field_key: str, field_value: str, previous_value: Optional[str] = None):
+    """フィールドの変更を編集ログに追記し（入力内容の保存）、他のデバイスと同期
+    
+    マージ対象のテキストフィールドは、previous_value（変更前の値）を同期前の元テキストとして記録する。
+    """
     if 'multi_device_manager' in st.session_state and 'device_session_id' in st.session_state:
-        st.session_state['multi_device_manager'].update_realtime_data(
+        state = None
+        if field_type in MERGEABLE_FIELD_TYPES:
+            state = _get_text_versions(store_name, monday_date, field_type, field_key)
+            if state['head'] is None and previous_value is not None:
+                state['versions'].setdefault(None, previous_value)
+        change_seq = st.session_state['multi_device_manager'].append_edit(
             st.session_state['device_session_id'],
-            store_name, monday_date, field_type, field_key, field_value
+            store_name, monday_date, field_type, field_key, field_value,
+            base_seq=state['head'] if state is not None else None
         )
+        if state is not None:
+            _record_text_version(state, change_seq, field_value)
+        # 編集中は他デバイスの変更も頻繁に確認する
+        _reset_sync_poll_interval(f"{store_name}_{monday_date}")
 
-def get_sync_updates(store_name: str, monday_date: str) -> Dict:
-    """他のデバイスからの更新を取得"""
-    if 'multi_device_manager' in st.session_state and 'device_session_id' in st.session_state:
-        return st.session_state['multi_device_manager'].get_latest_data(
-            store_name, monday_date, st.session_state['device_session_id']
-        )
-    return {}
+def merge_remote_text(store_name: str, monday_date: str, field_type: str, field_key: str,
+                      update: Dict[str, Any], current_value: str, widget_key: str) -> str:
+    """他のデバイスのテキストの変更を、この端末の未反映の入力と3方向マージし、入力欄に表示する値を返す
+    
+    共通の元テキストは、相手が編集の元にした変更（base_seq）のバージョン。マージ結果が相手の値と異なる場合は
+    入力欄の変更として同期される。自動でマージできない場合は相手の値を返し、競合として記録する
+    （show_text_conflictで表示）。
+    """
+    state = _get_text_versions(store_name, monday_date, field_type, field_key)
+    versions = state['versions']
+    local = st.session_state.get(widget_key, current_value)
+    remote = update['value']
+    base = versions.get(update.get('base_seq'), current_value)
+    merged = three_way_merge(base, local, remote)
+    _record_text_version(state, update['seq'], remote)
+    
+    conflicts = st.session_state.setdefault('sync_text_conflicts', {})
+    lock_key = (store_name, monday_date, field_type, field_key)
+    if merged is None:
+        conflicts[lock_key] = {'local': local, 'remote': remote, 'widget_key': widget_key}
+        return remote
+    conflicts.pop(lock_key, None)
+    if merged != remote:
+        # マージ結果は双方の編集を含むため、相手のロック中でも同期する
+        st.session_state.setdefault('sync_merge_passes', set()).add(lock_key)
+    return merged
+
+def show_text_conflict(store_name: str, monday_date: str, field_type: str, field_key: str):
+    """自動でマージできなかった編集を表示し、どちらの内容を採用するかを選択させる（入力欄の作成前に呼び出すこと）"""
+    lock_key = (store_name, monday_date, field_type, field_key)
+    conflict = st.session_state.get('sync_text_conflicts', {}).get(lock_key)
+    if conflict is None:
+        return
+    st.warning("⚠️ 他のデバイスでも同じ箇所が編集されたため、自動で統合できませんでした。入力欄には他のデバイスの内容を表示しています。")
+    st.text_area("あなたの編集内容", value=conflict['local'], disabled=True, key=f"conflict_local_{conflict['widget_key']}")
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button("自分の内容を採用", key=f"conflict_keep_local_{conflict['widget_key']}"):
+            st.session_state[conflict['widget_key']] = conflict['local']
+            st.session_state['sync_merge_passes'] = st.session_state.get('sync_merge_passes', set()) | {lock_key}
+            del st.session_state['sync_text_conflicts'][lock_key]
+    with col2:
+        if st.button("他のデバイスの内容を採用", key=f"conflict_keep_remote_{conflict['widget_key']}"):
+            del st.session_state['sync_text_conflicts'][lock_key]
+            st.rerun()
+
+def begin_sync_cycle():
+    """再実行の開始時に呼び出す（同じ再実行内では店舗・週ごとの差分取得・自動確認の表示を1回にする）"""
+    st.session_state['sync_fetched_keys'] = set()
+    st.session_state['sync_poller_keys'] = set()
+    st.session_state['sync_device_list_keys'] = set()
+    st.session_state['edit_lock_cache'] = {}
+    # ロックを取得できなかった入力欄を元の値に戻す（ウィジェット生成前でないと書き換えられないため次の再実行の冒頭で適用）
+    for widget_key, value in st.session_state.pop('pending_widget_resets', {}).items():
+        st.session_state[widget_key] = value
+
+def _is_db_poll_due(key: str) -> bool:
+    """データベースの変更（他のサーバープロセスの変更）を確認する時期かどうか"""
+    poll_state = st.session_state.get('sync_poll_state', {}).get(key)
+    if poll_state is None:
+        # 自動確認を行っていない場合は再実行ごとに確認する
+        return True
+    return time.monotonic() - poll_state['last_poll'] >= poll_state['interval']
+
+def _collect_sync_changes(store_name: str, monday_date: str, include_db: bool) -> int:
+    """同期バス（必要な場合はデータベースも）から他のデバイスの変更を取り出し、未反映の更新として蓄積する
+    
+    同期バスとデータベースの両方から届いた同じ変更は、フィールドごとの反映済み連番で1回に絞る。
+    戻り値: 新たに蓄積した更新の件数
+    """
+    manager = st.session_state['multi_device_manager']
+    session_id = st.session_state['device_session_id']
+    key = f"{store_name}_{monday_date}"
+    last_seqs = st.session_state.setdefault('sync_last_seq', {})
+    applied = st.session_state.setdefault('sync_applied_seq', {}).setdefault(key, {})
+    bucket = st.session_state.setdefault('sync_pending_updates', {}).setdefault(key, {})
+    
+    sources = [get_sync_bus().drain(session_id, store_name, monday_date)]
+    if include_db:
+        db_changes, last_seqs[key] = manager.get_changes_since(store_name, monday_date, last_seqs[key], session_id)
+        sources.append(db_changes)
+        poll_state = st.session_state.get('sync_poll_state', {}).get(key)
+        if poll_state is not None:
+            poll_state['last_poll'] = time.monotonic()
+    
+    collected = 0
+    for changes in sources:
+        for field_type, fields in changes.items():
+            for field_key, change in fields.items():
+                if change['seq'] <= applied.get((field_type, field_key), 0):
+                    continue
+                applied[(field_type, field_key)] = change['seq']
+                bucket.setdefault(field_type, {})[field_key] = change
+                collected += 1
+    return collected
+
+def get_sync_updates(store_name: str, monday_date: str, field_types: Optional[Tuple[str, ...]] = None) -> Dict:
+    """他のデバイスからの新しい更新（前回取得以降の差分）を取得
+    
+    同じプロセスのセッションの変更は同期バスから受け取り、データベースは確認間隔ごとにのみ参照する
+    （他のサーバープロセスの変更の取得用）。差分は店舗・週ごとに1回の再実行で1回だけ取得し、
+    field_typesを指定した場合はその種類の更新のみを取り出す（取り出した更新は再度返さない）。
+    初回は現在の最新連番から開始し、過去の更新は再生しない。
+    """
+    if 'multi_device_manager' not in st.session_state or 'device_session_id' not in st.session_state:
+        return {}
+    
+    manager = st.session_state['multi_device_manager']
+    key = f"{store_name}_{monday_date}"
+    last_seqs = st.session_state.setdefault('sync_last_seq', {})
+    pending = st.session_state.setdefault('sync_pending_updates', {})
+    fetched = st.session_state.setdefault('sync_fetched_keys', set())
+    
+    if key not in last_seqs:
+        # 購読を先に開始してから連番を読み、その間の変更を取りこぼさないようにする
+        get_sync_bus().subscribe(st.session_state['device_session_id'], store_name, monday_date)
+        last_seqs[key] = manager.get_current_seq(store_name, monday_date)
+        fetched.add(key)
+    elif key not in fetched:
+        fetched.add(key)
+        _collect_sync_changes(store_name, monday_date, include_db=_is_db_poll_due(key))
+    
+    bucket = pending.get(key, {})
+    if field_types is None:
+        pending[key] = {}
+        return bucket
+    return {field_type: bucket.pop(field_type) for field_type in field_types if field_type in bucket}
 
 def show_active_devices(store_name: str):
-    """現在アクティブなデバイス一覧を表示"""
+    """現在アクティブなデバイス一覧を表示（同じ再実行内では店舗ごとに1回のみ）"""
+    shown = st.session_state.setdefault('sync_device_list_keys', set())
+    if store_name in shown:
+        return
+    shown.add(store_name)
     if 'multi_device_manager' in st.session_state:
         sessions = st.session_state['multi_device_manager'].get_active_sessions(store_name)
         
@@ -208,21 +541,128 @@ def show_active_devices(store_name: str):
         else:
             st.success(f"✅ **{store_name}店 - 単独編集中**")
 
-def auto_refresh_data(store_name: str = None, context: str = "default"):
-    """定期的にデータを更新"""
-    import random
+def get_field_lock_owner(store_name: str, monday_date: str, field_type: str, field_key: str) -> Optional[str]:
+    """他のセッションが編集中（ロック保持中）の場合はそのセッションIDを返す
     
-    # 店舗名、コンテキスト、セッションID、ランダム要素を含めた完全にユニークなキーを生成
-    session_suffix = ""
-    if 'device_session_id' in st.session_state:
-        session_suffix = f"_{st.session_state['device_session_id'][-6:]}"
-    
-    # ランダム要素とタイムスタンプを追加してさらに一意性を保証
-    random_suffix = f"_{random.randint(1000, 9999)}"
-    timestamp_suffix = f"_{int(time.time() * 1000) % 100000}"
+    ロックは店舗・週ごとに1回の再実行で1回だけまとめて取得する。
+    """
+    manager = st.session_state.get('multi_device_manager')
+    if manager is None or 'device_session_id' not in st.session_state:
+        return None
+    cache = st.session_state.setdefault('edit_lock_cache', {})
+    key = f"{store_name}_{monday_date}"
+    if key not in cache:
+        cache[key] = manager.get_locks(store_name, monday_date)
+    lock = cache[key].get((field_type, field_key))
+    if lock is None or lock['session_id'] == st.session_state['device_session_id']:
+        return None
+    return lock['session_id']
+
+def acquire_field_lock(store_name: str, monday_date: str, field_type: str, field_key: str) -> bool:
+    """編集したフィールドのロックを取得（取得済みの場合は最終編集時刻のみ更新）"""
+    manager = st.session_state.get('multi_device_manager')
+    if manager is None or 'device_session_id' not in st.session_state:
+        return True
+    held_locks = st.session_state.setdefault('held_edit_locks', {})
+    lock_key = (store_name, monday_date, field_type, field_key)
+    if lock_key not in held_locks:
+        if not manager.acquire_lock(st.session_state['device_session_id'], store_name, monday_date, field_type, field_key):
+            return False
+    held_locks[lock_key] = time.monotonic()
+    return True
+
+def claim_field_edit(store_name: str, monday_date: str, field_type: str, field_key: str,
+                     widget_resets: Dict[str, Any]) -> bool:
+    """入力欄の変更前にロックを取得する
     
-    key_suffix = f"_{store_name}_{context}{session_suffix}{random_suffix}{timestamp_suffix}" if store_name else f"_{context}{session_suffix}{random_suffix}{timestamp_suffix}"
-    button_key = f"refresh_sync_data{key_suffix}"
+    取得できなかった場合は警告を表示し、widget_resets（ウィジェットのkey -> 元の値）を次の再実行で元に戻すよう予約する。
+    呼び出し元は False の場合、同期・保存を行わないこと。
+    """
+    if acquire_field_lock(store_name, monday_date, field_type, field_key):
+        return True
+    # 他のデバイスの変更とマージした値・競合時に選択した値は、ロックに関わらず同期する
+    merge_passes = st.session_state.get('sync_merge_passes', set())
+    if (store_name, monday_date, field_type, field_key) in merge_passes:
+        merge_passes.discard((store_name, monday_date, field_type, field_key))
+        return True
+    st.session_state.setdefault('pending_widget_resets', {}).update(widget_resets)
+    st.warning("⚠️ 他のデバイスが先に編集を始めたため、この変更は保存されませんでした。")
+    return False
+
+def renew_field_locks():
+    """再実行の最後に呼び出し、保持中のロックをまとめて延長する
     
-    if st.button("🔄 最新データを同期", key=button_key):
+    有効期限の間編集がなかったロックは解放する。延長・解放はそれぞれ1回の更新で行う。
+    """
+    manager = st.session_state.get('multi_device_manager')
+    held_locks = st.session_state.get('held_edit_locks')
+    if manager is None or not held_locks or 'device_session_id' not in st.session_state:
+        return
+    session_id = st.session_state['device_session_id']
+    now = time.monotonic()
+    idle_keys = [lock_key for lock_key, last_edit in held_locks.items() if now - last_edit >= EDIT_LOCK_TTL_SECONDS]
+    for lock_key in idle_keys:
+        del held_locks[lock_key]
+    try:
+        manager.release_locks(session_id, idle_keys)
+        manager.renew_locks(session_id, list(held_locks))
+    except Exception as e:
+        print(f"編集ロックの更新エラー: {str(e)}")
+
+def show_field_lock_indicator(owner_session_id: str):
+    """他のデバイスが編集中であることを表示"""
+    st.caption(f"🔒 他のデバイス（{owner_session_id[-8:]}）が編集中のため、編集できません")
+
+def _reset_sync_poll_interval(key: str, force: bool = False):
+    """確認間隔を初期値に戻す（force=Trueの場合は次の再実行でデータベースも確認する）"""
+    poll_state = st.session_state.get('sync_poll_state', {}).get(key)
+    if poll_state is not None:
+        poll_state['interval'] = SYNC_POLL_INTERVAL_SECONDS
+        if force:
+            poll_state['last_poll'] = 0.0
+
+def _poll_sync_changes(store_name: str, monday_date: str):
+    """他デバイスの変更の有無を確認し、変更があった場合のみページ全体を再実行する
+
+    フラグメントとして定期実行されるため、変更がない場合はこの関数だけが再実行される。
+    同期バスは毎回（メモリ上の確認のみ）、データベースは確認間隔が経過した場合のみ確認する。
+    変更の反映（入力欄の書き換え）は、入力欄の作成前に行う必要があるため全体の再実行時に行う。
+    """
+    key = f"{store_name}_{monday_date}"
+    poll_state = st.session_state.setdefault('sync_poll_state', {}).setdefault(
+        key, {'interval': SYNC_POLL_INTERVAL_SECONDS, 'last_poll': time.monotonic()}
+    )
+    manager = st.session_state.get('multi_device_manager')
+    session_id = st.session_state.get('device_session_id')
+    if manager is not None and session_id and key in st.session_state.get('sync_last_seq', {}):
+        include_db = SYNC_POLL_INTERVAL_SECONDS > 0 and _is_db_poll_due(key)
+        if include_db or get_sync_bus().has_pending(session_id, store_name, monday_date):
+            if _collect_sync_changes(store_name, monday_date, include_db):
+                poll_state['interval'] = SYNC_POLL_INTERVAL_SECONDS
+                st.rerun(scope="app")
+            if include_db:
+                # 変更がない間はデータベースの確認間隔を延ばす（アイドル時のサーバー負荷を抑える）
+                poll_state['interval'] = min(SYNC_POLL_MAX_INTERVAL_SECONDS, poll_state['interval'] * SYNC_POLL_BACKOFF)
+    if SYNC_POLL_INTERVAL_SECONDS > 0:
+        st.caption(f"🔄 自動同期中（他のサーバーの変更は{int(poll_state['interval'])}秒ごとに確認）")
+    else:
+        st.caption("🔄 自動同期中")
+
+def auto_refresh_data(store_name: str = None, context: str = "default", monday_date: str = None):
+    """他デバイスの変更の自動確認（フラグメント）と手動同期ボタンを表示"""
+    key_suffix = f"_{store_name}_{context}" if store_name else f"_{context}"
+    if st.button("🔄 最新データを同期", key=f"refresh_sync_data{key_suffix}"):
+        if store_name and monday_date:
+            _reset_sync_poll_interval(f"{store_name}_{monday_date}", force=True)
         st.rerun()
+    
+    # 自動確認は店舗・週ごとに1つだけ配置する（同じ再実行で複数配置すると確認が重複する）
+    run_every = SYNC_BUS_POLL_INTERVAL_SECONDS if SYNC_BUS_POLL_INTERVAL_SECONDS > 0 else SYNC_POLL_INTERVAL_SECONDS
+    if not (store_name and monday_date) or run_every <= 0 or not hasattr(st, 'fragment'):
+        return
+    poller_keys = st.session_state.setdefault('sync_poller_keys', set())
+    key = f"{store_name}_{monday_date}"
+    if key in poller_keys:
+        return
+    poller_keys.add(key)
+    st.fragment(run_every=run_every)(_poll_sync_changes)(store_name, monday_date)
@@ -0,0 +1,122 @@
+"""
+OpenAIクライアントの共有
+APIキーごとにプロセス全体で1つのクライアントを共有して接続を再利用し、キーの検証結果を一定時間キャッシュする機能群
+"""
+import hashlib
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import openai
+from dotenv import load_dotenv
+
+# キーの検証結果の有効期限（秒）。期限内はAPIを呼び出さずに有効として扱う（認証エラーが発生した場合は即座に破棄）
+OPENAI_KEY_VALIDATION_TTL_SECONDS = float(os.getenv('OPENAI_KEY_VALIDATION_TTL_SECONDS', '3600'))
+# キーの検証に使うモデルの既定値（モデル情報の取得のみで、トークンは消費しない）。通常は生成に使うモデルを指定する
+OPENAI_VALIDATION_MODEL = 'gpt-4o-mini'
+OPENAI_TIMEOUT_SECONDS = 60.0
+
+
+def _key_id(api_key: str, base_url: Optional[str] = None) -> str:
+    """APIキー（と接続先）を、キーを保持せずに識別するためのハッシュ"""
+    return hashlib.sha256(f"{api_key}\n{base_url or ''}".encode('utf-8')).hexdigest()
+
+
+class OpenAIClientPool:
+    """APIキーごとのOpenAIクライアントと、キーの検証結果を保持するクラス
+
+    クライアントは内部のHTTP接続プールを保持するため、使い回すことで接続（TLS）の確立を省略できる。
+    """
+
+    def __init__(self, validation_ttl_seconds: float = OPENAI_KEY_VALIDATION_TTL_SECONDS):
+        self.validation_ttl_seconds = validation_ttl_seconds
+        self._lock = threading.Lock()
+        self._clients: Dict[str, openai.OpenAI] = {}
+        # キーのハッシュ -> 検証した時刻（time.monotonic()）
+        self._validated_at: Dict[str, float] = {}
+        self._counters = {'clients_created': 0, 'validations': 0, 'validation_cache_hits': 0, 'invalidations': 0}
+
+    def get_client(self, api_key: str, base_url: Optional[str] = None) -> openai.OpenAI:
+        """APIキーのクライアントを取得（初回のみ作成）。base_url はOpenAI互換のサーバーを使う場合のみ指定"""
+        key_id = _key_id(api_key, base_url)
+        with self._lock:
+            client = self._clients.get(key_id)
+            if client is None:
+                client = openai.OpenAI(api_key=api_key, base_url=base_url, timeout=OPENAI_TIMEOUT_SECONDS)
+                self._clients[key_id] = client
+                self._counters['clients_created'] += 1
+            return client
+
+    def is_validated(self, api_key: str, base_url: Optional[str] = None) -> bool:
+        """有効期限内の検証結果があるかどうか"""
+        with self._lock:
+            validated_at = self._validated_at.get(_key_id(api_key, base_url))
+        return validated_at is not None and time.monotonic() - validated_at < self.validation_ttl_seconds
+
+    def validate(self, api_key: str, base_url: Optional[str] = None, model: str = OPENAI_VALIDATION_MODEL) -> openai.OpenAI:
+        """キーを検証してクライアントを返す（有効期限内の検証結果がある場合はAPIを呼び出さない）
+
+        検証は生成に使うモデル（model）の情報の取得で行う（接続先がそのモデルを提供していない場合はNotFoundError）。
+        検証に失敗した場合はOpenAIの例外（AuthenticationError等）をそのまま送出する。
+        """
+        client = self.get_client(api_key, base_url)
+        if self.is_validated(api_key, base_url):
+            with self._lock:
+                self._counters['validation_cache_hits'] += 1
+            return client
+        client.models.retrieve(model)
+        with self._lock:
+            self._validated_at[_key_id(api_key, base_url)] = time.monotonic()
+            self._counters['validations'] += 1
+        return client
+
+    def invalidate(self, api_key: str, base_url: Optional[str] = None):
+        """認証エラーが発生したキーの検証結果を破棄（次回は検証し直す）
+
+        クライアントは他のセッション・並列生成の処理が接続を使用中の可能性があるため、閉じずにそのまま使い回す。
+        """
+        with self._lock:
+            self._validated_at.pop(_key_id(api_key, base_url), None)
+            self._counters['invalidations'] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._counters)
+            stats['clients'] = len(self._clients)
+        stats['validation_ttl_seconds'] = self.validation_ttl_seconds
+        return stats
+
+
+_pool: Optional[OpenAIClientPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_openai_client_pool() -> OpenAIClientPool:
+    """プロセス全体で共有するOpenAIClientPoolを取得"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = OpenAIClientPool()
+        return _pool
+
+
+_env_mtimes: Dict[str, Optional[float]] = {}
+_env_lock = threading.Lock()
+
+
+def reload_env_if_changed(env_path) -> bool:
+    """.envファイルが前回の読み込み以降に更新された場合のみ再読み込みし（既存の環境変数を上書き）、読み込んだかどうかを返す"""
+    path = os.path.abspath(str(env_path))
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        mtime = None
+    with _env_lock:
+        if path in _env_mtimes and _env_mtimes[path] == mtime:
+            return False
+        _env_mtimes[path] = mtime
+    if mtime is None:
+        return False
+    load_dotenv(dotenv_path=path, override=True)
+    return True
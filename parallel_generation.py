@@ -0,0 +1,125 @@
+"""
+複数店舗のレポートの並列生成
+店舗ごとの生成をスレッドプールで同時に実行し、OpenAI APIの呼び出しをプロセス全体で共有する流量制限（トークンバケット）で抑える機能群
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+# 同時に生成する店舗数の上限
+REPORT_GENERATION_MAX_WORKERS = int(os.getenv('REPORT_GENERATION_MAX_WORKERS', '4'))
+# OpenAI APIの呼び出し回数の上限（1分あたり・プロセス全体。0以下は上限なし）と、連続して呼び出せる回数
+OPENAI_REQUESTS_PER_MINUTE = float(os.getenv('OPENAI_REQUESTS_PER_MINUTE', '60'))
+OPENAI_REQUEST_BURST = int(os.getenv('OPENAI_REQUEST_BURST', str(REPORT_GENERATION_MAX_WORKERS)))
+
+
+class TokenBucket:
+    """トークンバケット方式の流量制限
+
+    capacity回までは続けて許可し、以降は毎秒rate_per_second回の割合で許可する（rate_per_secondが0以下の場合は制限しない）。
+    """
+
+    def __init__(self, rate_per_second: float, capacity: int):
+        self.rate_per_second = rate_per_second
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.acquired = 0
+        self.waited_seconds = 0.0
+
+    def acquire(self) -> float:
+        """1回分の許可が得られるまで待ち、待った秒数を返す"""
+        if self.rate_per_second <= 0:
+            with self._lock:
+                self.acquired += 1
+            return 0.0
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate_per_second)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    self.acquired += 1
+                    self.waited_seconds += waited
+                    return waited
+                wait_seconds = (1 - self._tokens) / self.rate_per_second
+            time.sleep(wait_seconds)
+            waited += wait_seconds
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'requests_per_minute': self.rate_per_second * 60,
+                'burst': self.capacity,
+                'acquired': self.acquired,
+                'waited_seconds': self.waited_seconds
+            }
+
+
+_rate_limiter: Optional[TokenBucket] = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_openai_rate_limiter() -> TokenBucket:
+    """プロセス全体で共有するOpenAI APIの流量制限を取得"""
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = TokenBucket(OPENAI_REQUESTS_PER_MINUTE / 60, OPENAI_REQUEST_BURST)
+        return _rate_limiter
+
+
+def generate_concurrently(generate: Callable[..., Dict], inputs: Dict[str, Dict],
+                          max_workers: int = REPORT_GENERATION_MAX_WORKERS,
+                          on_progress: Optional[Callable[[str, Dict], None]] = None) -> Iterator[Tuple[str, Optional[Dict], float]]:
+    """店舗ごとの入力 {店舗名: data_for_ai} を並列に生成し、完了した店舗から (店舗名, 結果, 所要秒数) を返す
+
+    generateはワーカースレッドで実行されるため、Streamlitの表示は呼び出し元（結果を受け取った側）で行うこと。
+    on_progress を指定した場合は generate(data_for_ai, 途中経過のコールバック) の形で呼び出し、
+    途中経過は呼び出し元のスレッドで on_progress(店舗名, 途中経過) として渡す（店舗ごとに最新のもののみ）。
+    例外が発生した店舗の結果はNone。
+    """
+    if not inputs:
+        return
+    events: 'queue.Queue[Tuple[str, str, Any]]' = queue.Queue()
+
+    def run(store_name: str, data_for_ai: Dict):
+        started = time.monotonic()
+        result = None
+        try:
+            if on_progress is None:
+                result = generate(data_for_ai)
+            else:
+                result = generate(data_for_ai, lambda partial: events.put(('progress', store_name, partial)))
+        except Exception as e:
+            print(f"レポート生成エラー（{store_name}）: {str(e)}")
+        finally:
+            events.put(('done', store_name, (result, time.monotonic() - started)))
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(inputs))),
+                            thread_name_prefix='report-generation') as executor:
+        for store_name, data in inputs.items():
+            executor.submit(run, store_name, data)
+        remaining = len(inputs)
+        while remaining:
+            # 溜まっている途中経過は店舗ごとに最新のものだけを渡す
+            batch = [events.get()]
+            while True:
+                try:
+                    batch.append(events.get_nowait())
+                except queue.Empty:
+                    break
+            latest_progress = {store_name: payload for kind, store_name, payload in batch if kind == 'progress'}
+            for kind, store_name, payload in batch:
+                if kind == 'progress':
+                    if store_name in latest_progress:
+                        on_progress(store_name, latest_progress.pop(store_name))
+                else:
+                    remaining -= 1
+                    yield store_name, payload[0], payload[1]
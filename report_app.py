@@ -4,37 +4,51 @@ import openai
 from datetime import datetime, timedelta, date
 import json
 import re
-from typing import Dict, List, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
 import base64
 from io import BytesIO
 import numpy as np
-import sqlite3
 import pickle
-from pathlib import Path
 import hashlib # ハッシュ生成用にインポート
-from dotenv import load_dotenv # 追加
+from db_connection import close_connection_manager
+from db_migrations import get_schema_version
+from edit_log import (
+    start_edit_log_compactor,
+    get_edit_log_compactor_stats,
+    decode_edit_value,
+    DAILY_FIELD_TYPES,
+    EDIT_LOG_RETENTION_SECONDS
+)
+from sync_bus import get_sync_bus
+from llm_cache import build_cache_key, get_llm_response_cache
+from openai_clients import get_openai_client_pool, reload_env_if_changed
+from parallel_generation import generate_concurrently, get_openai_rate_limiter, REPORT_GENERATION_MAX_WORKERS
+from streaming_report import OPENAI_STREAMING, StreamProgress
+from llm_backends import LLMBackend, LLMBackendError, get_llm_backend, get_llm_backend_name, get_llm_backend_stats
 from multi_device_support import (
     init_multi_device_session, 
     sync_field_update, 
     get_sync_updates, 
+    merge_remote_text,
+    show_text_conflict,
+    begin_sync_cycle,
     show_active_devices,
-    auto_refresh_data
+    auto_refresh_data,
+    get_session_janitor_stats,
+    get_field_lock_owner,
+    claim_field_edit,
+    renew_field_locks,
+    show_field_lock_indicator,
+    clear_multi_device_manager
 )
 import os # 追加
 import pytz # 日本時間取得用に追加
 
-# .envファイルをロード
+# .envファイルをロード（再実行ごとに更新日時を確認し、変更された場合のみ再読み込み）
 import pathlib
 script_dir = pathlib.Path(__file__).parent.absolute()
 env_path = script_dir / '.env'
-load_dotenv(dotenv_path=env_path)
-
-# 環境変数の再読み込みを強制
-import importlib
-import sys
-if 'dotenv' in sys.modules:
-    importlib.reload(sys.modules['dotenv'])
-load_dotenv(dotenv_path=env_path, override=True)
+reload_env_if_changed(env_path)
 
 def get_japan_time():
     """日本時間の現在時刻を取得する"""
@@ -181,363 +195,243 @@ st.set_page_config(
 )
 
 # --- データベース設定とヘルパー関数 ---
-import os
-# データベースファイルの絶対パスを取得（他のデバイスからのアクセス対応）
-SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(SCRIPT_DIR, 'apparel_reports.db')
-
-class DBManager:
-    """データベース接続と操作を管理するクラス"""
-    def __init__(self, db_path: str = DB_PATH):
-        self.db_path = db_path
-        self._init_db()
-
-    def _get_connection(self):
-        """データベース接続を確立し、Rowファクトリを設定します。"""
-        try:
-            # データベースファイルの存在確認
-            if not os.path.exists(self.db_path):
-                print(f"Database file not found: {self.db_path}")
-                # データベースファイルが存在しない場合は作成する
-                self._init_db()
-            
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row # カラム名でアクセスできるようにする
-            return conn
-        except Exception as e:
-            print(f"Database connection error: {str(e)}")
-            raise e
-
-    def _init_db(self):
-        """データベースとテーブルを初期化します。指定された店舗名のみを登録します。"""
-        conn = self._get_connection()
-        with conn:
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS stores (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL UNIQUE
-                );
-            ''')
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS weekly_reports (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    store_id INTEGER NOT NULL,
-                    monday_date TEXT NOT NULL, --YYYY-MM-DD形式
-                    
-                    daily_reports_json TEXT,    -- 各曜日の動向と要因をJSON文字列で保存
-                    topics TEXT,
-                    impact_day TEXT,
-                    quantitative_data TEXT,
-                    
-                    generated_report_json TEXT, -- AI生成レポート（動向、要因、質問）をJSONで保存
-                    modified_report_json TEXT,  -- 修正後のレポート（動向、要因、修正理由など）をJSONで保存
-                    
-                    timestamp TEXT,             -- 作成/最終更新日時
-                    FOREIGN KEY (store_id) REFERENCES stores(id),
-                    UNIQUE(store_id, monday_date)
-                );
-            ''')
-            
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS learning_patterns (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    input_context_hash TEXT NOT NULL UNIQUE, -- 入力コンテキストのハッシュ値
-                    original_output_json TEXT,
-                    modified_output_json TEXT,
-                    edit_reason TEXT,
-                    usage_count INTEGER DEFAULT 1,
-                    last_used TEXT
-                )
-            ''')
-            
-            # 指定された店舗名のみを挿入 (既に存在する場合はスキップ)
-            for store_name in ['RAY', 'RSJ', 'ROS', 'RNG']:
-                conn.execute("INSERT OR IGNORE INTO stores (name) VALUES (?)", (store_name,))
-            conn.commit()
-        conn.close()
-
-    def get_store_id_by_name(self, store_name: str) -> int:
-        """ストア名からIDを取得します。"""
-        conn = self._get_connection()
-        store_id = conn.execute('SELECT id FROM stores WHERE name = ?', (store_name,)).fetchone()['id']
-        conn.close()
-        return store_id
-
-    def get_store_name_by_id(self, store_id: int) -> str:
-        """ストアIDから名前を取得します。"""
-        conn = self._get_connection()
-        store_name = conn.execute('SELECT name FROM stores WHERE id = ?', (store_id,)).fetchone()['name']
-        conn.close()
-        return store_name
-    
-    def get_all_stores(self) -> List[Tuple[int, str]]:
-        """全ての店舗のIDと名前を取得します。"""
-        conn = self._get_connection()
-        stores = conn.execute('SELECT id, name FROM stores ORDER BY name').fetchall()
-        conn.close()
-        return [(s['id'], s['name']) for s in stores]
-
-    def save_weekly_data(self, store_id: int, monday_date_str: str, data: Dict, original_report: Dict, modified_report: Dict = None):
-        """週次データをDBに保存または更新します。"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        daily_reports_json = json.dumps(data['daily_reports'], ensure_ascii=False)
-        generated_report_json = json.dumps(original_report, ensure_ascii=False)
-        modified_report_json = json.dumps(modified_report, ensure_ascii=False) if modified_report else None
-        
-        cursor.execute(
-            'SELECT id FROM weekly_reports WHERE store_id = ? AND monday_date = ?',
-            (store_id, monday_date_str)
-        )
-        existing_record = cursor.fetchone()
+from db_manager import DBManager, DB_PATH
 
-        if existing_record:
-            cursor.execute('''
-                UPDATE weekly_reports SET
-                   daily_reports_json = ?, topics = ?, impact_day = ?,
-                   quantitative_data = ?, generated_report_json = ?,
-                   modified_report_json = ?, timestamp = ?
-                WHERE id = ?
-            ''', (
-                daily_reports_json,
-                data.get('topics', ''),
-                data.get('impact_day', ''),
-                data.get('quantitative_data', ''),
-                generated_report_json,
-                modified_report_json,
-                datetime.now().isoformat(),
-                existing_record['id']
-            ))
-        else:
-            cursor.execute('''
-                INSERT INTO weekly_reports 
-                (store_id, monday_date, daily_reports_json, topics, impact_day, 
-                 quantitative_data, generated_report_json, modified_report_json, timestamp)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                store_id,
-                monday_date_str,
-                daily_reports_json,
-                data.get('topics', ''),
-                data.get('impact_day', ''),
-                data.get('quantitative_data', ''),
-                generated_report_json,
-                modified_report_json,
-                datetime.now().isoformat()
-            ))
-        
-        conn.commit()
-        conn.close()
-        return existing_record is not None
-
-    def get_weekly_report(self, store_id: int, monday_date_str: str) -> Dict:
-        """指定された週のレポートデータを取得します。"""
-        conn = self._get_connection()
-        report_row = conn.execute(
-            'SELECT * FROM weekly_reports WHERE store_id = ? AND monday_date = ?',
-            (store_id, monday_date_str)
-        ).fetchone()
-        conn.close()
-
-        if report_row:
-            report_data = dict(report_row) # Rowオブジェクトを辞書に変換
-            try:
-                report_data['daily_reports'] = json.loads(report_data['daily_reports_json']) if report_data['daily_reports_json'] else {}
-            except (json.JSONDecodeError, TypeError) as e:
-                print(f"日次レポートデータの解析に失敗しました: {str(e)}")
-                report_data['daily_reports'] = {}
-                
-            try:
-                report_data['generated_report'] = json.loads(report_data['generated_report_json']) if report_data['generated_report_json'] else {}
-            except (json.JSONDecodeError, TypeError) as e:
-                print(f"生成レポートデータの解析に失敗しました: {str(e)}")
-                report_data['generated_report'] = {}
-                
-            try:
-                report_data['modified_report'] = json.loads(report_data['modified_report_json']) if report_data['modified_report_json'] else None
-            except (json.JSONDecodeError, TypeError) as e:
-                print(f"修正レポートデータの解析に失敗しました: {str(e)}")
-                report_data['modified_report'] = None
-            
-            del report_data['daily_reports_json']
-            del report_data['generated_report_json']
-            if 'modified_report_json' in report_data:
-                del report_data['modified_report_json']
+# 元に戻す操作の履歴の上限（店舗・週ごと）
+EDIT_UNDO_LIMIT = 50
+# 定量データの項目
+QUANTITATIVE_ITEMS = ["売上", "入店客数", "買上客数", "買上率", "SET率", "客単価", "販売単価"]
+
+def save_field_edit(store_name: str, monday_date: str, field_type: str, field_key: str,
+                    value: str, previous_value: Optional[str] = None, record_undo: bool = True) -> bool:
+    """入力欄の変更を編集ログに1件追記して保存する（他のデバイスにも同期される）
 
-            return report_data
-        return {}
+    週次レポートへの反映はバックグラウンドの圧縮処理がまとめて行う。
+    record_undo=True の場合は、previous_value（変更前の値）とともに元に戻す操作の履歴に追加する。
+    """
+    init_multi_device_session(store_name)
+    try:
+        sync_field_update(store_name, monday_date, field_type, field_key, value, previous_value=previous_value)
+    except Exception as e:
+        print(f"自動保存エラー: {str(e)}")
+        return False
+    if record_undo and previous_value is not None:
+        push_edit_history(store_name, monday_date, [(field_type, field_key, previous_value, value)])
     
-    def get_all_weekly_reports(self, store_id: int = None) -> List[Dict]:
-        """全ての週次レポート、または指定した店舗の週次レポートを取得します。"""
-        try:
-            conn = self._get_connection()
-            if store_id:
-                reports_rows = conn.execute(
-                    'SELECT id, store_id, monday_date, timestamp, generated_report_json, modified_report_json '
-                    'FROM weekly_reports WHERE store_id = ? ORDER BY monday_date DESC', (store_id,)
-                ).fetchall()
-            else:
-                reports_rows = conn.execute(
-                    'SELECT id, store_id, monday_date, timestamp, generated_report_json, modified_report_json '
-                    'FROM weekly_reports ORDER BY monday_date DESC'
-                ).fetchall()
-            conn.close()
-
-            reports = []
-            for row in reports_rows:
-                report_data = dict(row)
-                try:
-                    report_data['store_name'] = self.get_store_name_by_id(report_data['store_id'])
-                except Exception as e:
-                    report_data['store_name'] = f"店舗ID:{report_data['store_id']}"
-                
-                # 生成レポートと修正レポートの有無をフラグとして追加
-                report_data['has_generated'] = report_data['generated_report_json'] is not None
-                report_data['has_modified'] = report_data['modified_report_json'] is not None
+    # 保存時刻を記録（日本時間）
+    japan_time = get_japan_time()
+    st.session_state['last_auto_save'] = japan_time.strftime('%Y年%m月%d日 %H:%M:%S')
+    st.session_state['last_auto_save_timestamp'] = japan_time.timestamp()
+    return True
 
-                # JSON文字列は生データとして保持し、必要に応じてパースする
-                reports.append(report_data)
-            return reports
-        except Exception as e:
-            print(f"Database error in get_all_weekly_reports: {str(e)}")
-            return []
+def set_loaded_report_version(store_name: str, monday_date: str, version: Optional[int]):
+    """週を読み込んだ時点の週次レポートのバージョンを記録（「修正して学習」の保存はこのバージョンを条件に行う）"""
+    st.session_state.setdefault('loaded_report_versions', {})[(store_name, monday_date)] = version or 0
 
-    def find_similar_cases(self, current_data: Dict) -> str:
-        """類似ケースを検索し、LLMに渡すためのコンテキストを生成します。"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT daily_reports_json, modified_report_json 
-            FROM weekly_reports 
-            WHERE modified_report_json IS NOT NULL
-            ORDER BY timestamp DESC
-            LIMIT 5
-        ''') 
-        
-        results = cursor.fetchall()
-        conn.close()
-        
-        similar_cases_context = []
-        for result in results:
-            try:
-                past_modified_report = json.loads(result[1])
-                
-                context_item = (
-                    f"- 過去の類似ケース (修正後): {past_modified_report.get('trend', '')[:100]}...\n"
-                    f"  要因: {', '.join(past_modified_report.get('factors', []))}\n"
-                    f"  (修正理由: {past_modified_report.get('edit_reason', '不明')[:50]}...)\n"
-                )
-                similar_cases_context.append(context_item)
+def get_loaded_report_version(store_name: str, monday_date: str) -> Optional[int]:
+    """記録済みのバージョン（読み込み前の週はNone）"""
+    return st.session_state.get('loaded_report_versions', {}).get((store_name, monday_date))
 
-            except json.JSONDecodeError:
-                continue
-        
-        if similar_cases_context:
-            return "\n【過去の修正済みレポート例】\n" + "\n".join(similar_cases_context)
-        return ""
-    
-    def get_learning_stats(self):
-        """学習に関する統計情報を取得します。"""
-        try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-            
-            total_reports = cursor.execute("SELECT COUNT(*) FROM weekly_reports").fetchone()[0]
-            corrections = cursor.execute("SELECT COUNT(*) FROM weekly_reports WHERE modified_report_json IS NOT NULL").fetchone()[0]
-            
-            # learning_patternsテーブルの存在確認
-            try:
-                total_patterns = cursor.execute("SELECT COUNT(*) FROM learning_patterns").fetchone()[0]
-            except Exception as e:
-                print(f"learning_patternsテーブルエラー: {e}")
-                total_patterns = 0
-            
-            conn.close()
-            
-            return {
-                'total_reports': total_reports,
-                'corrections': corrections,
-                'patterns': total_patterns
-            }
-        except Exception as e:
-            print(f"get_learning_stats エラー: {e}")
-            return {
-                'total_reports': 0,
-                'corrections': 0,
-                'patterns': 0
-            }
+def get_edit_history(store_name: str, monday_date: str) -> Dict[str, List]:
+    """店舗・週ごとの元に戻す・やり直しの履歴 {'undo': [...], 'redo': [...]}
 
-def save_draft_data(store_name: str, monday_date_str: str, daily_reports_data: Dict, topics: str = "", impact_day: str = "", quantitative_data: str = "", generated_report: Dict = None):
-    """入力途中のデータを自動保存する"""
-    try:
-        store_id = db_manager.get_store_id_by_name(store_name)
-        
-        # 既存レポートがあるかチェック
-        existing_report = db_manager.get_weekly_report(store_id, monday_date_str)
-        
-        # 選択された店舗のデータのみを保存（店舗キーなしの構造）
-        # daily_reports_dataが既に正しい構造（日付をキーとする辞書）の場合はそのまま使用
-        if isinstance(daily_reports_data, dict) and all(isinstance(k, str) and len(k) == 10 for k in daily_reports_data.keys()):
-            store_daily_reports = daily_reports_data
-        else:
-            # daily_reports_dataから該当店舗のデータを抽出
-            store_daily_reports = daily_reports_data.get(store_name, {})
-        
-        # 週の7日分を初期化（必要に応じて）
-        if not store_daily_reports:
-            date_obj = datetime.strptime(monday_date_str, '%Y-%m-%d').date()
-            store_daily_reports = {}
-            for i in range(7):
-                current_date = date_obj + timedelta(days=i)
-                date_str = current_date.strftime('%Y-%m-%d')
-                store_daily_reports[date_str] = {"trend": "", "factors": []}
-        
-        # データ構造の検証と修正（複数店舗データが混在している場合の対処）
-        clean_daily_reports = {}
-        for key, value in store_daily_reports.items():
-            # 日付形式のキーのみを保持（YYYY-MM-DD形式）
-            if isinstance(key, str) and len(key) == 10 and key.count('-') == 2:
-                try:
-                    datetime.strptime(key, '%Y-%m-%d')  # 日付形式を検証
-                    if isinstance(value, dict):
-                        clean_daily_reports[key] = value
-                except ValueError:
-                    pass  # 無効な日付形式は無視
-        
-        # 修正内容の自動保存も実行（新しい方法を使用）
-        auto_save_modification()
-        
-        draft_data = {
-            'daily_reports': clean_daily_reports,  # 清浄化されたデータのみ保存
-            'topics': topics or (existing_report.get('topics', '') if existing_report else ''),
-            'impact_day': impact_day or (existing_report.get('impact_day', '') if existing_report else ''),
-            'quantitative_data': quantitative_data or (existing_report.get('quantitative_data', '') if existing_report else '')
-        }
-        
-        # 既存の生成レポートと修正レポートは保持、新しいレポートがあれば更新
-        original_report = generated_report if generated_report else (existing_report.get('generated_report', {}) if existing_report else {})
-        modified_report = existing_report.get('modified_report') if existing_report else None
-        
-        # データを保存
-        db_manager.save_weekly_data(
-            store_id,
-            monday_date_str,
-            draft_data,
-            original_report,
-            modified_report
+    各要素は1回の操作で変更した入力欄の一覧 [(field_type, field_key, 変更前, 変更後)]（値は編集ログと同じ形式）。
+    """
+    return st.session_state.setdefault('edit_undo_history', {}).setdefault(
+        (store_name, monday_date), {'undo': [], 'redo': []}
+    )
+
+def push_edit_history(store_name: str, monday_date: str, changes: List[Tuple[str, str, str, str]]):
+    """1回の操作での入力欄の変更を元に戻す履歴に追加（新しい変更をした時点でやり直しの履歴は破棄）"""
+    history = get_edit_history(store_name, monday_date)
+    history['undo'].append(changes)
+    del history['undo'][:-EDIT_UNDO_LIMIT]
+    history['redo'].clear()
+
+def get_input_field_value(store_name: str, monday_date: str, field_type: str, field_key: str) -> str:
+    """入力欄の現在の値を編集ログと同じ形式（要因はJSON文字列）で取得"""
+    if field_type in DAILY_FIELD_TYPES:
+        day = st.session_state['daily_reports_input'].get(store_name, {}).get(field_key, {})
+        if field_type == 'daily_trend':
+            return day.get('trend', '')
+        return json.dumps(day.get('factors', []))
+    return get_weekly_additional_data(store_name, monday_date, field_type)
+
+def set_input_field_value(store_name: str, monday_date: str, field_type: str, field_key: str, value: str):
+    """入力欄の値を書き換える（元に戻す・復元用）
+
+    入力欄はkey付きのため、ウィジェットの状態も書き換える（入力欄の作成前に呼び出すこと）。
+    """
+    decoded = decode_edit_value(field_type, value)
+    if field_type in DAILY_FIELD_TYPES:
+        day = st.session_state['daily_reports_input'].setdefault(store_name, {}).setdefault(
+            field_key, {"trend": "", "factors": []}
         )
-        
-        # 保存時刻を記録（日本時間）
-        japan_time = get_japan_time()
-        st.session_state['last_auto_save'] = japan_time.strftime('%Y年%m月%d日 %H:%M:%S')
-        st.session_state['last_auto_save_timestamp'] = japan_time.timestamp()
-        
-        return True
-    except Exception as e:
-        print(f"自動保存エラー: {str(e)}")
-        return False
+        if field_type == 'daily_trend':
+            day['trend'] = decoded
+            st.session_state[f"{store_name}_{field_key}_trend_{monday_date}"] = decoded
+        else:
+            day['factors'] = decoded
+            st.session_state[f"{store_name}_{field_key}_factors_{monday_date}"] = ", ".join(decoded)
+        return
+
+    set_weekly_additional_data(store_name, monday_date, field_type, decoded)
+    if field_type == 'quantitative_data':
+        # 項目ごとの入力欄の状態を置き換える（次の解析処理で再初期化させる）
+        st.session_state.pop(f"quantitative_data_{store_name}_{monday_date}", None)
+        parsed_values = {}
+        for line in decoded.split('\n'):
+            if ':' in line:
+                item, item_value = line.split(':', 1)
+                parsed_values[item.strip()] = item_value.strip().rstrip('%％')
+        for item in QUANTITATIVE_ITEMS:
+            st.session_state[f"quant_{item}_{store_name}_{monday_date}"] = parsed_values.get(item, "")
+    else:
+        st.session_state[f"{field_type}_input_field_{store_name}_{monday_date}"] = decoded
+    # 後方互換性のため、最初に選択された店舗の場合は旧形式も更新
+    if store_name == st.session_state.get('selected_store_for_report'):
+        st.session_state[f"{field_type}_input"] = decoded
+
+def _apply_input_field_changes(store_name: str, monday_date: str,
+                               targets: List[Tuple[str, str, str, str]]) -> Tuple[List[Tuple[str, str, str, str]], int]:
+    """(field_type, field_key, 想定する現在の値, 新しい値) の一覧を入力欄に反映し、編集ログに追記する
+
+    現在の値が想定と異なる（他のデバイスがその後に変更した）項目や、他のデバイスが編集中の項目は反映しない。
+    戻り値: (反映した変更 [(field_type, field_key, 変更前, 変更後)], 反映しなかった件数)
+    """
+    applied = []
+    skipped = 0
+    for field_type, field_key, expected, value in targets:
+        current = get_input_field_value(store_name, monday_date, field_type, field_key)
+        if decode_edit_value(field_type, current) != decode_edit_value(field_type, expected):
+            skipped += 1
+            continue
+        if not claim_field_edit(store_name, monday_date, field_type, field_key, {}):
+            skipped += 1
+            continue
+        if not save_field_edit(store_name, monday_date, field_type, field_key, value,
+                               previous_value=current, record_undo=False):
+            skipped += 1
+            continue
+        set_input_field_value(store_name, monday_date, field_type, field_key, value)
+        applied.append((field_type, field_key, current, value))
+    return applied, skipped
+
+def undo_edit(store_name: str, monday_date: str, redo: bool = False) -> Tuple[int, int]:
+    """直前の操作を元に戻す（redo=True の場合はやり直す）
+
+    戻した値も編集ログに追記して保存・同期する。戻り値: (反映した件数, 反映しなかった件数)
+    """
+    history = get_edit_history(store_name, monday_date)
+    source, target = (history['redo'], history['undo']) if redo else (history['undo'], history['redo'])
+    if not source:
+        return 0, 0
+    changes = source.pop()
+    if redo:
+        targets = [(field_type, field_key, before, after) for field_type, field_key, before, after in changes]
+    else:
+        targets = [(field_type, field_key, after, before) for field_type, field_key, before, after in reversed(changes)]
+    applied, skipped = _apply_input_field_changes(store_name, monday_date, targets)
+    if applied:
+        # 履歴には常に元の操作の順序と (変更前, 変更後) の向きで記録する
+        if not redo:
+            applied = [(field_type, field_key, value, current) for field_type, field_key, current, value in reversed(applied)]
+        target.append(applied)
+    return len(applied), skipped
+
+def restore_week_inputs(store_name: str, monday_date: str, as_of_utc: str) -> Optional[Tuple[int, int]]:
+    """週の入力内容を指定時刻（UTC）の状態に戻す
+
+    現在と異なる項目のみ編集ログに追記し、復元全体を1回の操作として元に戻す履歴に追加する。
+    戻り値: (反映した件数, 反映しなかった件数)。保持期間より前などで復元できない場合はNone
+    """
+    state = db_manager.get_week_inputs_as_of(db_manager.get_store_id_by_name(store_name), monday_date, as_of_utc)
+    if state is None:
+        return None
+    monday = datetime.strptime(monday_date, '%Y-%m-%d')
+    restored_values = []
+    for i in range(7):
+        date_str = (monday + timedelta(days=i)).strftime('%Y-%m-%d')
+        day = state['daily_reports'].get(date_str, {})
+        restored_values.append(('daily_trend', date_str, day.get('trend') or ''))
+        restored_values.append(('daily_factors', date_str, json.dumps(day.get('factors') or [])))
+    for field in ('topics', 'impact_day', 'quantitative_data'):
+        restored_values.append((field, field, state.get(field) or ''))
+
+    targets = []
+    for field_type, field_key, value in restored_values:
+        current = get_input_field_value(store_name, monday_date, field_type, field_key)
+        if decode_edit_value(field_type, current) != decode_edit_value(field_type, value):
+            targets.append((field_type, field_key, current, value))
+    applied, skipped = _apply_input_field_changes(store_name, monday_date, targets)
+    if applied:
+        push_edit_history(store_name, monday_date, applied)
+    return len(applied), skipped
+
+def _on_undo_edit_click(store_name: str, monday_date: str, redo: bool):
+    """元に戻す・やり直すボタンのコールバック（再実行の前に入力欄の状態を書き換える）"""
+    applied, skipped = undo_edit(store_name, monday_date, redo=redo)
+    messages = []
+    if applied:
+        messages.append(('success', f"{'↪️ やり直しました' if redo else '↩️ 元に戻しました'}（{applied}項目）"))
+    if skipped:
+        messages.append(('warning', f"⚠️ {skipped}項目は他のデバイスで変更・編集中のため、反映しませんでした。"))
+    st.session_state['edit_history_messages'] = messages
+
+def _on_restore_week_click(store_name: str, monday_date: str, date_key: str, time_key: str):
+    """時刻を指定した復元ボタンのコールバック"""
+    restore_date = st.session_state[date_key]
+    restore_time = st.session_state[time_key]
+    as_of = pytz.timezone('Asia/Tokyo').localize(datetime.combine(restore_date, restore_time))
+    result = restore_week_inputs(store_name, monday_date, as_of.astimezone(pytz.utc).strftime('%Y-%m-%d %H:%M:%S'))
+    if result is None:
+        messages = [('error', "❌ 保持期間より前の時刻のため、復元できません。")]
+    elif result == (0, 0):
+        messages = [('info', "指定した時刻の内容は現在の入力内容と同じです。")]
+    else:
+        applied, skipped = result
+        messages = []
+        if applied:
+            messages.append(('success', f"✅ {restore_date.strftime('%m/%d')} {restore_time.strftime('%H:%M')} 時点の内容に復元しました（{applied}項目）"))
+        if skipped:
+            messages.append(('warning', f"⚠️ {skipped}項目は他のデバイスで編集中のため、復元しませんでした。"))
+    st.session_state['edit_history_messages'] = messages
+
+def render_edit_history_controls(store_name: str, monday_of_week: datetime):
+    """入力内容を元に戻す・やり直す・時刻を指定して復元するUIを描画する関数
+
+    操作はボタンのコールバック（入力欄の作成前）で行うため、履歴の件数が最新になるよう入力欄の後に描画する。
+    """
+    monday_str = monday_of_week.strftime('%Y-%m-%d')
+    history = get_edit_history(store_name, monday_str)
+
+    for level, message in st.session_state.pop('edit_history_messages', []):
+        getattr(st, level)(message)
+
+    col1, col2, col3 = st.columns([1, 1, 2])
+    with col1:
+        st.button(f"↩️ 元に戻す ({len(history['undo'])})", key=f"undo_edit_{store_name}_{monday_str}",
+                  disabled=not history['undo'], on_click=_on_undo_edit_click, args=(store_name, monday_str, False))
+    with col2:
+        st.button(f"↪️ やり直す ({len(history['redo'])})", key=f"redo_edit_{store_name}_{monday_str}",
+                  disabled=not history['redo'], on_click=_on_undo_edit_click, args=(store_name, monday_str, True))
+
+    with st.expander("🕒 時刻を指定してこの週の入力内容を復元"):
+        st.caption(f"直近{EDIT_LOG_RETENTION_SECONDS / 3600:g}時間以内の時刻の内容に戻せます。復元後も「元に戻す」で取り消せます。")
+        date_key = f"restore_date_{store_name}_{monday_str}"
+        time_key = f"restore_time_{store_name}_{monday_str}"
+        now = get_japan_time()
+        st.session_state.setdefault(date_key, now.date())
+        st.session_state.setdefault(time_key, now.time().replace(second=0, microsecond=0))
+        col1, col2, col3 = st.columns([1, 1, 1])
+        with col1:
+            st.date_input("日付", key=date_key)
+        with col2:
+            st.time_input("時刻", key=time_key, step=60)
+        with col3:
+            st.write("")
+            st.button("この時刻の内容に復元", key=f"restore_week_{store_name}_{monday_str}",
+                      on_click=_on_restore_week_click, args=(store_name, monday_str, date_key, time_key))
 
 
 def get_weekly_key(store_name, monday_date):
@@ -569,6 +463,127 @@ def set_weekly_report_output(store_name, monday_date, field, value):
     st.session_state['weekly_report_outputs'][key][field] = value
 
 
+def build_report_input(store_name: str, monday_date: str) -> Dict:
+    """レポート生成の入力データ（data_for_ai）を作成
+
+    編集中の店舗はこの端末の入力内容を、それ以外の店舗は保存済みの最新の内容（他の端末の編集を含む）を使う。
+    """
+    if store_name == st.session_state.get('selected_store_for_report') and store_name in st.session_state['daily_reports_input']:
+        daily_reports = st.session_state['daily_reports_input'][store_name]
+        topics = get_weekly_additional_data(store_name, monday_date, 'topics') or ''
+        impact_day = get_weekly_additional_data(store_name, monday_date, 'impact_day') or ''
+        quantitative_data = get_weekly_additional_data(store_name, monday_date, 'quantitative_data') or ''
+    else:
+        saved_report = db_manager.get_weekly_report(db_manager.get_store_id_by_name(store_name), monday_date) or {}
+        daily_reports = saved_report.get('daily_reports') or {}
+        topics = saved_report.get('topics') or ''
+        impact_day = saved_report.get('impact_day') or ''
+        quantitative_data = saved_report.get('quantitative_data') or ''
+    return {
+        'daily_reports': {store_name: daily_reports},
+        'topics': topics,
+        'impact_day': impact_day,
+        'quantitative_data': quantitative_data,
+        # 類似ケース検索で同一店舗・季節の重み付けに使用
+        'store_name': store_name,
+        'monday_date': monday_date
+    }
+
+
+def format_report_text(report_data) -> str:
+    """生成したレポート（辞書）を表示・ダウンロード用のテキストに整形"""
+    if not isinstance(report_data, dict):
+        # 文字列形式の場合（後方互換性）
+        return str(report_data)
+    display_text = report_data.get('trend', 'レポートデータが正しく生成されませんでした。')
+    factors = report_data.get('factors', [])
+    questions = report_data.get('questions', [])
+    
+    formatted_report = f"【週全体の動向】\n{display_text}\n\n"
+    if factors:
+        formatted_report += f"【主な要因】\n"
+        for i, factor in enumerate(factors, 1):
+            formatted_report += f"{i}. {factor}\n"
+        formatted_report += "\n"
+    if questions:
+        formatted_report += f"【AIからの質問】\n"
+        for i, question in enumerate(questions, 1):
+            formatted_report += f"{i}. {question}\n"
+    return formatted_report
+
+
+def render_partial_report(placeholder, partial: Dict):
+    """生成途中のレポート（受信済みの動向と、書き終わった要因・質問）を表示枠に表示"""
+    lines = ["**【週全体の動向】**", "", (partial.get('trend') or '') + " ▌"]
+    for title, field in (("【主な要因】", 'factors'), ("【AIからの質問】", 'questions')):
+        if partial.get(field):
+            lines += ["", f"**{title}**", ""]
+            lines += [f"{i}. {item}" for i, item in enumerate(partial[field], 1)]
+    placeholder.markdown("\n".join(lines))
+
+
+def is_saved_generated_report(store_name: str, monday_date: str, report_result: Dict) -> bool:
+    """生成したレポートが、その週に保存済み（未反映の編集ログを含む）の生成レポートと同じかどうか"""
+    try:
+        saved_report = db_manager.get_weekly_report(db_manager.get_store_id_by_name(store_name), monday_date) or {}
+    except Exception as e:
+        print(f"保存済みレポートの取得エラー: {str(e)}")
+        return False
+    return saved_report.get('generated_report') == report_result
+
+
+def show_generated_report(store_name: str, monday_date: str, report_result: Optional[Dict], elapsed_seconds: float):
+    """生成が完了した店舗のレポートを保存して表示（メインスレッドから呼び出すこと）
+
+    生成に失敗した結果（error あり）はエラーとして表示するのみで、保存・同期はしない。
+    """
+    if report_result and isinstance(report_result, dict) and report_result.get('error'):
+        st.error(f"❌ {store_name}店のレポート生成に失敗しました: {report_result['error']}")
+        return
+    if not (report_result and isinstance(report_result, dict) and report_result.get('trend')):
+        st.error(f"❌ {store_name}店のレポート生成に失敗しました。")
+        return
+    
+    from_cache = report_result.pop('from_cache', False)
+    if from_cache:
+        st.caption("♻️ 入力内容が前回の生成時と同じため、保存済みの生成結果を表示しています（API呼び出しなし）")
+    # レポート結果を辞書として保存
+    st.session_state[f"ai_generated_report_{store_name}_{monday_date}"] = report_result
+    # 週次出力データとして保存
+    set_weekly_report_output(store_name, monday_date, 'generated_report', report_result)
+    
+    # 現在選択中の店舗の場合は、従来の表示用変数も更新
+    if store_name == st.session_state.get('selected_store_for_report'):
+        st.session_state['generated_report_output'] = report_result
+    
+    # レポート生成時も入力データを保護（クリアしない）
+    st.session_state['preserve_input_data'] = True
+    
+    # データベースにも最新のレポートを保存（編集ログに追記し、他のデバイスにも同期される）
+    # キャッシュの応答・保存済みと同じ内容の場合は追記しない（他のデバイスで不要な再読み込みが発生するため）
+    if not from_cache and not is_saved_generated_report(store_name, monday_date, report_result):
+        save_field_edit(store_name, monday_date, 'generated_report', 'generated_report',
+                        json.dumps(report_result, ensure_ascii=False))
+    
+    formatted_report = format_report_text(report_result)
+    st.text_area(
+        f"🤖 AI生成レポート ({store_name}店)",
+        value=formatted_report,
+        height=300,
+        key=f"ai_report_display_{store_name}_{monday_date}"
+    )
+    
+    # ダウンロードボタン
+    st.download_button(
+        label=f"📊 {store_name}店レポートをダウンロード",
+        data=formatted_report,
+        file_name=f"weekly_report_{store_name}_{monday_date}.txt",
+        mime="text/plain",
+        key=f"download_{store_name}_{monday_date}"
+    )
+    st.caption(f"⏱️ 生成時間: {elapsed_seconds:.1f}秒")
+
+
 def render_weekly_additional_info(store_name: str, monday_of_week: datetime):
     """週次追加情報入力UIを描画する関数（店舗別）- マルチデバイス対応"""
     current_monday = monday_of_week.strftime('%Y-%m-%d')
@@ -580,7 +595,7 @@ def render_weekly_additional_info(store_name: str, monday_of_week: datetime):
     show_active_devices(store_name)
     
     # 他のデバイスからの更新をチェック
-    sync_updates = get_sync_updates(store_name, current_monday)
+    sync_updates = get_sync_updates(store_name, current_monday, ('topics', 'impact_day', 'quantitative_data', 'generated_report'))
     
     # 現在の値を新しいデータ構造から取得（後方互換性のため旧形式も確認）
     current_topics = get_weekly_additional_data(store_name, current_monday, 'topics')
@@ -604,22 +619,50 @@ def render_weekly_additional_info(store_name: str, monday_of_week: datetime):
             set_weekly_additional_data(store_name, current_monday, 'quantitative_data', current_quantitative_data)
     
     # 同期データがある場合、ローカルデータを更新
+    # 入力欄はkey付きのため、valueではなくウィジェットの状態を書き換えないと画面に反映されない
+    # （反映しないと古い入力値が「変更」として他のデバイスへ送り返されてしまう）
+    topics_input_key = f"topics_input_field_{store_name}_{current_monday}"
+    impact_day_input_key = f"impact_day_input_field_{store_name}_{current_monday}"
+    quantitative_key = f"quantitative_data_{store_name}_{current_monday}"
+    # テキストはこの端末の未反映の入力と3方向マージした値を入力欄に表示する（マージ結果は変更として同期される）
     if 'topics' in sync_updates and 'topics' in sync_updates['topics']:
-        current_topics = sync_updates['topics']['topics']['value']
+        topics_update = sync_updates['topics']['topics']
+        st.session_state[topics_input_key] = merge_remote_text(
+            store_name, current_monday, 'topics', 'topics', topics_update, current_topics, topics_input_key
+        )
+        current_topics = topics_update['value']
         set_weekly_additional_data(store_name, current_monday, 'topics', current_topics)
     
     if 'impact_day' in sync_updates and 'impact_day' in sync_updates['impact_day']:
-        current_impact_day = sync_updates['impact_day']['impact_day']['value']
+        impact_day_update = sync_updates['impact_day']['impact_day']
+        st.session_state[impact_day_input_key] = merge_remote_text(
+            store_name, current_monday, 'impact_day', 'impact_day', impact_day_update, current_impact_day, impact_day_input_key
+        )
+        current_impact_day = impact_day_update['value']
         set_weekly_additional_data(store_name, current_monday, 'impact_day', current_impact_day)
     
     if 'quantitative_data' in sync_updates and 'quantitative_data' in sync_updates['quantitative_data']:
         current_quantitative_data = sync_updates['quantitative_data']['quantitative_data']['value']
         set_weekly_additional_data(store_name, current_monday, 'quantitative_data', current_quantitative_data)
+        # 項目ごとの入力欄の状態を同期された値で置き換える（次の解析処理で再初期化させる）
+        st.session_state.pop(quantitative_key, None)
+        for line in current_quantitative_data.split('\n'):
+            if ':' in line:
+                item, value = line.split(':', 1)
+                st.session_state[f"quant_{item.strip()}_{store_name}_{current_monday}"] = value.strip().rstrip('%％')
+    
+    if 'generated_report' in sync_updates and 'generated_report' in sync_updates['generated_report']:
+        # 他のデバイスで生成されたレポート
+        generated_report_value = sync_updates['generated_report']['generated_report']['value']
+        try:
+            set_weekly_report_output(store_name, current_monday, 'generated_report', json.loads(generated_report_value) if generated_report_value else {})
+        except json.JSONDecodeError as e:
+            print(f"生成レポートの同期データの解析に失敗しました: {str(e)}")
     
     # 同期ボタン
     col1, col2 = st.columns([3, 1])
     with col2:
-        auto_refresh_data(store_name, "weekly")
+        auto_refresh_data(store_name, "weekly", current_monday)
     
     # 他のデバイスからの更新通知
     if 'topics' in sync_updates:
@@ -629,60 +672,57 @@ def render_weekly_additional_info(store_name: str, monday_of_week: datetime):
     if 'quantitative_data' in sync_updates:
         st.info("🔄 定量データが他のデバイスで更新されました")
     
-    # TOPICS入力
-    topics_input_key = f"topics_input_field_{store_name}_{current_monday}"
+    # TOPICS入力（他のデバイスが編集中の場合は入力不可）
+    show_text_conflict(store_name, current_monday, 'topics', 'topics')
+    topics_lock_owner = get_field_lock_owner(store_name, current_monday, 'topics', 'topics')
+    # 入力欄の値はウィジェットの状態のみで管理する（同期・元に戻すで状態を書き換えるため value= は指定しない）
+    if topics_input_key not in st.session_state:
+        st.session_state[topics_input_key] = current_topics
     new_topics = st.text_area(
         f"**TOPICS ({store_name}店用):** 週全体を通して特筆すべき事項や出来事を入力してください。",
-        value=current_topics,
         height=100,
-        key=topics_input_key
+        key=topics_input_key,
+        disabled=topics_lock_owner is not None
     )
+    if topics_lock_owner:
+        show_field_lock_indicator(topics_lock_owner)
+    if new_topics != current_topics and not claim_field_edit(store_name, current_monday, 'topics', 'topics', {topics_input_key: current_topics}):
+        new_topics = current_topics
     if new_topics != current_topics:
         # 新しいデータ構造に保存
         set_weekly_additional_data(store_name, current_monday, 'topics', new_topics)
-        # マルチデバイス同期
-        sync_field_update(store_name, current_monday, 'topics', 'topics', new_topics)
+        # 編集ログに追記して保存（他のデバイスにも同期される）
+        save_field_edit(store_name, current_monday, 'topics', 'topics', new_topics, previous_value=current_topics)
         # 後方互換性のため、最初に選択された店舗の場合は旧形式も更新
         if store_name == st.session_state.get('selected_store_for_report'):
             st.session_state['topics_input'] = new_topics
-        # 即座に自動保存（リアルタイム保存）
-        save_draft_data(
-            store_name,
-            current_monday,
-            {store_name: st.session_state['daily_reports_input'][store_name]},
-            new_topics,
-            get_weekly_additional_data(store_name, current_monday, 'impact_day') or st.session_state.get('impact_day_input', ''),
-            get_weekly_additional_data(store_name, current_monday, 'quantitative_data') or st.session_state.get('quantitative_data_input', '')
-        )
     else:
         # 入力フィールドの値でセッション状態を更新（データ整合性を保つ）
         set_weekly_additional_data(store_name, current_monday, 'topics', new_topics)
     
-    # インパクト大入力
-    impact_day_input_key = f"impact_day_input_field_{store_name}_{current_monday}"
+    # インパクト大入力（他のデバイスが編集中の場合は入力不可）
+    show_text_conflict(store_name, current_monday, 'impact_day', 'impact_day')
+    impact_day_lock_owner = get_field_lock_owner(store_name, current_monday, 'impact_day', 'impact_day')
+    if impact_day_input_key not in st.session_state:
+        st.session_state[impact_day_input_key] = current_impact_day
     new_impact_day = st.text_area(
         f"**インパクト大 ({store_name}店用):** 特に影響の大きかった日やイベント、その内容を記述してください。",
-        value=current_impact_day,
         height=100,
-        key=impact_day_input_key
+        key=impact_day_input_key,
+        disabled=impact_day_lock_owner is not None
     )
+    if impact_day_lock_owner:
+        show_field_lock_indicator(impact_day_lock_owner)
+    if new_impact_day != current_impact_day and not claim_field_edit(store_name, current_monday, 'impact_day', 'impact_day', {impact_day_input_key: current_impact_day}):
+        new_impact_day = current_impact_day
     if new_impact_day != current_impact_day:
         # 新しいデータ構造に保存
         set_weekly_additional_data(store_name, current_monday, 'impact_day', new_impact_day)
-        # マルチデバイス同期
-        sync_field_update(store_name, current_monday, 'impact_day', 'impact_day', new_impact_day)
+        # 編集ログに追記して保存（他のデバイスにも同期される）
+        save_field_edit(store_name, current_monday, 'impact_day', 'impact_day', new_impact_day, previous_value=current_impact_day)
         # 後方互換性のため、最初に選択された店舗の場合は旧形式も更新
         if store_name == st.session_state.get('selected_store_for_report'):
             st.session_state['impact_day_input'] = new_impact_day
-        # 即座に自動保存（リアルタイム保存）
-        save_draft_data(
-            store_name,
-            current_monday,
-            {store_name: st.session_state['daily_reports_input'][store_name]},
-            get_weekly_additional_data(store_name, current_monday, 'topics') or st.session_state.get('topics_input', ''),
-            new_impact_day,
-            get_weekly_additional_data(store_name, current_monday, 'quantitative_data') or st.session_state.get('quantitative_data_input', '')
-        )
     else:
         # 入力フィールドの値でセッション状態を更新（データ整合性を保つ）
         set_weekly_additional_data(store_name, current_monday, 'impact_day', new_impact_day)
@@ -691,46 +731,55 @@ def render_weekly_additional_info(store_name: str, monday_of_week: datetime):
     st.markdown(f"**定量データ ({store_name}店用):** 各項目に数値（％）を入力してください。")
     
     # 定量データ項目の定義
-    quantitative_items = [
-        "売上",
-        "入店客数", 
-        "買上客数",
-        "買上率",
-        "SET率",
-        "客単価",
-        "販売単価"
-    ]
+    quantitative_items = QUANTITATIVE_ITEMS
     
     # セッションステートで定量データを管理
-    quantitative_key = f"quantitative_data_{store_name}_{current_monday}"
     if quantitative_key not in st.session_state:
         # 既存データがあれば解析して初期化
         existing_data = current_quantitative_data
         st.session_state[quantitative_key] = {}
         if existing_data:
-            # 既存のテキストデータから数値を抽出（可能な場合）
+            # 既存のテキストデータから数値を抽出（「項目: 数値%」形式）
+            parsed_values = {}
+            for line in existing_data.split('\n'):
+                if ':' in line:
+                    item, value = line.split(':', 1)
+                    parsed_values[item.strip()] = value.strip().rstrip('%％')
             for item in quantitative_items:
-                st.session_state[quantitative_key][item] = ""
+                st.session_state[quantitative_key][item] = parsed_values.get(item, "")
         else:
             for item in quantitative_items:
                 st.session_state[quantitative_key][item] = ""
     
-    # 各項目の入力フィールドを作成
-    quantitative_data_changed = False
+    # 各項目の入力フィールドを作成（ロックは定量データ全体で1つ）
+    quantitative_lock_owner = get_field_lock_owner(store_name, current_monday, 'quantitative_data', 'quantitative_data')
+    quantitative_changes = {}
     cols = st.columns(2)  # 2列レイアウト
     
     for i, item in enumerate(quantitative_items):
         with cols[i % 2]:
             old_value = st.session_state[quantitative_key].get(item, "")
+            quant_input_key = f"quant_{item}_{store_name}_{current_monday}"
+            if quant_input_key not in st.session_state:
+                st.session_state[quant_input_key] = old_value
             new_value = st.text_input(
                 f"{item} ％",
-                value=old_value,
-                key=f"quant_{item}_{store_name}_{current_monday}",
-                placeholder="数値のみ"
+                key=quant_input_key,
+                placeholder="数値のみ",
+                disabled=quantitative_lock_owner is not None
             )
             if new_value != old_value:
-                st.session_state[quantitative_key][item] = new_value
-                quantitative_data_changed = True
+                quantitative_changes[item] = (old_value, new_value)
+    if quantitative_lock_owner:
+        show_field_lock_indicator(quantitative_lock_owner)
+    
+    quantitative_data_changed = bool(quantitative_changes) and claim_field_edit(
+        store_name, current_monday, 'quantitative_data', 'quantitative_data',
+        {f"quant_{item}_{store_name}_{current_monday}": old_value for item, (old_value, _) in quantitative_changes.items()}
+    )
+    if quantitative_data_changed:
+        for item, (_, new_value) in quantitative_changes.items():
+            st.session_state[quantitative_key][item] = new_value
     
     # 定量データを文字列形式に変換
     quantitative_items_list = []
@@ -741,24 +790,16 @@ def render_weekly_additional_info(store_name: str, monday_of_week: datetime):
     
     new_quantitative_data = "\n".join(quantitative_items_list)
     
-    # データが変更された場合の処理
-    if quantitative_data_changed or new_quantitative_data != current_quantitative_data:
+    # データが変更された場合の処理（入力欄が実際に変更された場合のみ保存・同期する）
+    if quantitative_data_changed:
         # 新しいデータ構造に保存
         set_weekly_additional_data(store_name, current_monday, 'quantitative_data', new_quantitative_data)
-        # マルチデバイス同期
-        sync_field_update(store_name, current_monday, 'quantitative_data', 'quantitative_data', new_quantitative_data)
+        # 編集ログに追記して保存（他のデバイスにも同期される）
+        save_field_edit(store_name, current_monday, 'quantitative_data', 'quantitative_data', new_quantitative_data,
+                        previous_value=current_quantitative_data)
         # 後方互換性のため、最初に選択された店舗の場合は旧形式も更新
         if store_name == st.session_state.get('selected_store_for_report'):
             st.session_state['quantitative_data_input'] = new_quantitative_data
-        # 即座に自動保存（リアルタイム保存）
-        save_draft_data(
-            store_name,
-            current_monday,
-            {store_name: st.session_state['daily_reports_input'][store_name]},
-            get_weekly_additional_data(store_name, current_monday, 'topics') or '',
-            get_weekly_additional_data(store_name, current_monday, 'impact_day') or '',
-            new_quantitative_data
-        )
     else:
         # 入力フィールドの値でセッション状態を更新（データ整合性を保つ）
         set_weekly_additional_data(store_name, current_monday, 'quantitative_data', new_quantitative_data)
@@ -775,7 +816,7 @@ def render_daily_report_input(store_name: str, monday_of_week: datetime):
     show_active_devices(store_name)
     
     # 他のデバイスからの更新をチェック
-    sync_updates = get_sync_updates(store_name, monday_str)
+    sync_updates = get_sync_updates(store_name, monday_str, ('daily_trend', 'daily_factors'))
     
     # 選択された店舗のdaily_reports_inputを確実に初期化
     if store_name not in st.session_state['daily_reports_input']:
@@ -783,10 +824,16 @@ def render_daily_report_input(store_name: str, monday_of_week: datetime):
             (monday_of_week + timedelta(days=i)).strftime('%Y-%m-%d'): {"trend": "", "factors": []} for i in range(7)
         }
 
-    # 同期データがある場合、ローカルデータを更新
+    # 同期データがある場合、ローカルデータと入力欄（ウィジェットの状態）を更新
+    # 動向はこの端末の未反映の入力と3方向マージした値を入力欄に表示する（マージ結果は変更として同期される）
     if 'daily_trend' in sync_updates:
         for date_key, update_data in sync_updates['daily_trend'].items():
             if date_key in st.session_state['daily_reports_input'][store_name]:
+                trend_input_key = f"{store_name}_{date_key}_trend_{st.session_state['selected_monday']}"
+                st.session_state[trend_input_key] = merge_remote_text(
+                    store_name, monday_str, 'daily_trend', date_key, update_data,
+                    st.session_state['daily_reports_input'][store_name][date_key]['trend'], trend_input_key
+                )
                 st.session_state['daily_reports_input'][store_name][date_key]['trend'] = update_data['value']
     
     if 'daily_factors' in sync_updates:
@@ -794,11 +841,12 @@ def render_daily_report_input(store_name: str, monday_of_week: datetime):
             if date_key in st.session_state['daily_reports_input'][store_name]:
                 factors_list = json.loads(update_data['value']) if update_data['value'] else []
                 st.session_state['daily_reports_input'][store_name][date_key]['factors'] = factors_list
+                st.session_state[f"{store_name}_{date_key}_factors_{st.session_state['selected_monday']}"] = ", ".join(factors_list)
 
     # 同期ボタン
     col1, col2 = st.columns([3, 1])
     with col2:
-        auto_refresh_data(store_name, "daily")
+        auto_refresh_data(store_name, "daily", monday_str)
     
     # 選択された店舗の日次レポート入力欄のみを表示
     for j in range(7): # 月曜日から日曜日まで
@@ -826,28 +874,27 @@ def render_daily_report_input(store_name: str, monday_of_week: datetime):
         
         # 入力フィールドのkeyを一意にして、値の保持を強化
         trend_input_key = f"{store_name}_{date_str}_trend_{st.session_state['selected_monday']}"
+        show_text_conflict(store_name, monday_str, 'daily_trend', date_str)
+        trend_lock_owner = get_field_lock_owner(store_name, monday_str, 'daily_trend', date_str)
+        # 入力欄の値はウィジェットの状態のみで管理する（同期・元に戻すで状態を書き換えるため value= は指定しない）
+        if trend_input_key not in st.session_state:
+            st.session_state[trend_input_key] = current_trend_value
         trend_value = st.text_area(
             f"**{current_date.strftime('%m/%d')} 動向:**",
-            value=current_trend_value,
             key=trend_input_key,
-            height=80
+            height=80,
+            disabled=trend_lock_owner is not None
         )
+        if trend_lock_owner:
+            show_field_lock_indicator(trend_lock_owner)
+        if trend_value != current_trend_value and not claim_field_edit(store_name, monday_str, 'daily_trend', date_str, {trend_input_key: current_trend_value}):
+            trend_value = current_trend_value
         
         # 値が変更された場合に自動保存とマルチデバイス同期
         if trend_value != current_trend_value:
             st.session_state['daily_reports_input'][store_name][date_str]['trend'] = trend_value
-            # 他のデバイスと同期
-            sync_field_update(store_name, monday_str, 'daily_trend', date_str, trend_value)
-            # 即座に保存
-            current_monday = monday_of_week.strftime('%Y-%m-%d')
-            save_draft_data(
-                store_name,
-                current_monday,
-                st.session_state['daily_reports_input'][store_name],
-                get_weekly_additional_data(store_name, current_monday, 'topics') or '',
-                get_weekly_additional_data(store_name, current_monday, 'impact_day') or '',
-                get_weekly_additional_data(store_name, current_monday, 'quantitative_data') or ''
-            )
+            # 編集ログに追記して保存（他のデバイスにも同期される）
+            save_field_edit(store_name, monday_str, 'daily_trend', date_str, trend_value, previous_value=current_trend_value)
         
         # セッション状態の値を確実に同期（入力フィールドとセッション状態の不整合を防ぐ）
         else:
@@ -860,129 +907,92 @@ def render_daily_report_input(store_name: str, monday_of_week: datetime):
         
         # 入力フィールドのkeyを一意にして、値の保持を強化
         factors_input_key = f"{store_name}_{date_str}_factors_{st.session_state['selected_monday']}"
+        factors_lock_owner = get_field_lock_owner(store_name, monday_str, 'daily_factors', date_str)
+        if factors_input_key not in st.session_state:
+            st.session_state[factors_input_key] = factors_str
         new_factors_str = st.text_input(
             f"**{current_date.strftime('%m/%d')} 要因 (カンマ区切り):**",
-            value=factors_str,
-            key=factors_input_key
+            key=factors_input_key,
+            disabled=factors_lock_owner is not None
         )
+        if factors_lock_owner:
+            show_field_lock_indicator(factors_lock_owner)
         
         # 値が変更された場合に自動保存とマルチデバイス同期
         new_factors_list = [f.strip() for f in new_factors_str.split(',') if f.strip()]
+        if new_factors_list != current_factors and not claim_field_edit(store_name, monday_str, 'daily_factors', date_str, {factors_input_key: factors_str}):
+            new_factors_list = current_factors
         if new_factors_list != current_factors:
             st.session_state['daily_reports_input'][store_name][date_str]['factors'] = new_factors_list
-            # 他のデバイスと同期
-            sync_field_update(store_name, monday_str, 'daily_factors', date_str, json.dumps(new_factors_list))
-            # 即座に保存
-            current_monday = monday_of_week.strftime('%Y-%m-%d')
-            save_draft_data(
-                store_name,
-                current_monday,
-                st.session_state['daily_reports_input'][store_name],
-                get_weekly_additional_data(store_name, current_monday, 'topics') or '',
-                get_weekly_additional_data(store_name, current_monday, 'impact_day') or '',
-                get_weekly_additional_data(store_name, current_monday, 'quantitative_data') or ''
-            )
+            # 編集ログに追記して保存（他のデバイスにも同期される）
+            save_field_edit(store_name, monday_str, 'daily_factors', date_str, json.dumps(new_factors_list),
+                            previous_value=json.dumps(current_factors))
         
         # セッション状態の値を確実に同期（入力フィールドとセッション状態の不整合を防ぐ）
         else:
             # 入力フィールドの値でセッション状態を更新（データ整合性を保つ）
             st.session_state['daily_reports_input'][store_name][date_str]['factors'] = new_factors_list
-    
-    # 日次データ入力完了後に自動保存（全ての日付の入力が完了してから実行）
-    # デバウンス処理: 入力中の保存を避けるため、全日付ループ完了後に一度だけ保存
-    auto_save_triggered = False
-    for i in range(7):
-        check_date = monday_of_week + timedelta(days=i)
-        check_date_str = check_date.strftime('%Y-%m-%d')
-        if (st.session_state['daily_reports_input'][store_name].get(check_date_str, {}).get('trend') or 
-            st.session_state['daily_reports_input'][store_name].get(check_date_str, {}).get('factors')):
-            auto_save_triggered = True
-            break
-    
-    if auto_save_triggered:
-        # 現在選択中の店舗・週の追加情報を使用
-        current_monday = monday_of_week.strftime('%Y-%m-%d')
-        
-        save_draft_data(
-            store_name,
-            current_monday,
-            {store_name: st.session_state['daily_reports_input'][store_name]},
-            get_weekly_additional_data(store_name, current_monday, 'topics') or '',
-            get_weekly_additional_data(store_name, current_monday, 'impact_day') or '',
-            get_weekly_additional_data(store_name, current_monday, 'quantitative_data') or ''
-        )
-    
-    # 日次データ入力完了後に自動保存（即座に保存）
-    # 入力が変更された場合は即座に保存する
-    current_monday = monday_of_week.strftime('%Y-%m-%d')
-    save_draft_data(
-        store_name,
-        current_monday,
-        {store_name: st.session_state['daily_reports_input'][store_name]},
-        get_weekly_additional_data(store_name, current_monday, 'topics') or '',
-        get_weekly_additional_data(store_name, current_monday, 'impact_day') or '',
-        get_weekly_additional_data(store_name, current_monday, 'quantitative_data') or ''
-    )
 
 
 class ApparelReportGenerator:
     def __init__(self):
-        self.openai_client = None
+        # AIの呼び出しに使うバックエンドはリクエストごとに解決して各メソッドに渡す（llm_backends.py を参照）
         self.training_data = None
         self.text_training_data = None 
         self.memory_db = None 
         self.learning_engine = None
+        # AIの応答キャッシュ（入力が同じ再生成ではAPIを呼び出さない）
+        self.response_cache = None
+        # OpenAI APIの呼び出しの流量制限（複数店舗の並列生成でもプロセス全体で上限を守る）
+        self.rate_limiter = None
         
     def set_dependencies(self, memory_db_instance, learning_engine_instance):
         """外部から依存関係を設定するためのメソッド"""
         self.memory_db = memory_db_instance
         self.learning_engine = learning_engine_instance
 
-    def initialize_openai(self, api_key: str):
-        """OpenAI APIクライアントを初期化"""
+    def resolve_openai_backend(self, api_key: str) -> Optional[LLMBackend]:
+        """APIキーを検証し、このリクエストで使うOpenAI APIのバックエンドを返す（失敗した場合はエラーを表示してNone）
+        
+        クライアントはAPIキーごとにプロセス全体で共有し（接続を再利用）、キーの検証は有効期限内の結果があれば省略する。
+        バックエンドはこのインスタンス（全セッションで共有）には保持せず、呼び出し元から生成の各メソッドに渡す。
+        """
         try:
             # APIキーの基本的なフォーマットチェック
             if not api_key or len(api_key.strip()) == 0:
                 st.error("❌ OpenAI APIキーが空です。")
-                return False
+                return None
                 
             api_key = api_key.strip()  # 前後の空白を除去
             
             if not api_key.startswith('sk-'):
                 st.error("❌ OpenAI APIキーが無効です。APIキーは 'sk-' で始まる必要があります。")
-                return False
+                return None
             
-            # OpenAIクライアントを初期化（タイムアウト設定追加）
-            self.openai_client = openai.OpenAI(
-                api_key=api_key,
-                timeout=60.0  # 60秒でタイムアウト
-            )
-            
-            # APIキーの有効性をテスト（簡単な呼び出しで確認）
+            # APIキーの有効性を確認（モデル情報の取得のみでトークンは消費しない・検証済みの場合は省略）
             try:
-                # より軽い呼び出しに変更
-                test_response = self.openai_client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[{"role": "user", "content": "test"}],
-                    max_tokens=1
-                )
-                return True
+                backend = get_llm_backend(api_key)
+                backend.validate()
+                return backend
             except openai.AuthenticationError as auth_error:
                 st.error(f"❌ OpenAI APIキーが無効です: {str(auth_error)}")
-                return False
+                return None
             except openai.PermissionDeniedError as perm_error:
                 st.error(f"❌ OpenAI APIキーの権限が不足しています: {str(perm_error)}")
-                return False
+                return None
             except openai.RateLimitError as rate_error:
                 st.error(f"❌ OpenAI APIの利用制限に達しています: {str(rate_error)}")
-                return False
+                return None
+            except openai.NotFoundError as not_found_error:
+                st.error(f"❌ 接続先でモデル「{backend.model}」を利用できません。LLM_MODEL の設定を確認してください: {str(not_found_error)}")
+                return None
             except Exception as api_error:
                 st.error(f"❌ OpenAI API接続エラー: {str(api_error)} (タイプ: {type(api_error).__name__})")
-                return False
+                return None
                 
         except Exception as e:
             st.error(f"❌ OpenAI API初期化エラー: {str(e)} (タイプ: {type(e).__name__})")
-            return False
+            return None
         
     def load_training_data(self, csv_file_path):
         """ファインチューニング用CSVデータを読み込み"""
@@ -1118,8 +1128,18 @@ class ApparelReportGenerator:
             'notes': validation_notes
         }
     
-    def analyze_trend_factors(self, daily_reports: Dict, topics: str, impact_day: str, quantitative_data: str) -> Dict:
-        """日次レポートを分析し、動向と要因を抽出"""
+    def analyze_trend_factors(self, daily_reports: Dict, topics: str, impact_day: str, quantitative_data: str,
+                              store_name: str = None, monday_date: str = None, force_regenerate: bool = False,
+                              on_progress: Optional[Callable[[Dict], None]] = None,
+                              llm_backend: Optional[LLMBackend] = None) -> Dict:
+        """日次レポートを分析し、動向と要因を抽出
+        
+        llm_backend は呼び出しごとに渡す（このインスタンスはプロセス全体・並列生成のワーカーで共有されるため、状態として保持しない）。
+        プロンプトが前回と同じ場合は保存済みの応答を使い、APIを呼び出さない（結果の from_cache が True）。
+        force_regenerate=True の場合は常にAPIを呼び出し、応答を保存し直す。
+        on_progress を指定した場合は応答をストリーミングで受信し、途中経過
+        （{'trend': 途中までの動向, 'factors': 書き終わった要因, 'questions': 書き終わった質問}）を渡して呼び出す。
+        """
         
         # 整合性チェックを実行
         consistency_check = self.validate_quantitative_data_consistency(daily_reports, quantitative_data)
@@ -1128,7 +1148,9 @@ class ApparelReportGenerator:
             'daily_reports': daily_reports,
             'topics': topics,
             'impact_day': impact_day,
-            'quantitative_data': quantitative_data
+            'quantitative_data': quantitative_data,
+            'store_name': store_name,
+            'monday_date': monday_date
         }
         enhanced_context = ""
         if self.memory_db and self.learning_engine:
@@ -1137,93 +1159,95 @@ class ApparelReportGenerator:
         system_prompt = self._build_system_prompt()
         user_prompt = self._build_user_prompt(daily_reports, topics, impact_day, quantitative_data, enhanced_context, consistency_check) 
         
-        if not self.openai_client:
-            st.error("OpenAIクライアントが初期化されていません。APIキーを確認してください。")
-            return {
-                'trend': 'OpenAI APIキーが設定されていないため分析できませんでした',
-                'factors': ['APIキーを設定してください'],
-                'questions': ['設定ページでAPIキーを正しく入力してください'],
-                'consistency_check': consistency_check
-            }
+        if llm_backend is None:
+            return self._error_result("OpenAIクライアントが初期化されていません。APIキーを確認してください。", consistency_check)
+        
+        model = llm_backend.model
+        temperature = 0.3
+        # 接続先（バックエンドの種類・base_url）ごとに分ける（スタブの応答を本番の生成で再利用しないため）
+        cache_key = build_cache_key(llm_backend.cache_namespace, model, system_prompt, user_prompt, temperature)
+        if self.response_cache is not None:
+            if force_regenerate:
+                self.response_cache.record_bypass()
+            else:
+                try:
+                    cached_result = self.response_cache.get(cache_key)
+                except Exception as e:
+                    print(f"応答キャッシュの取得エラー: {str(e)}")
+                    cached_result = None
+                if cached_result is not None:
+                    parsed_result = self._parse_analysis_result(cached_result)
+                    parsed_result['consistency_check'] = consistency_check
+                    parsed_result['from_cache'] = True
+                    return parsed_result
             
         try:
-            response = self.openai_client.chat.completions.create( 
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.3,
-                max_tokens=1000,
-                timeout=30
-            )
-            
-            result = response.choices[0].message.content
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            messages = [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ]
+            if on_progress is not None and OPENAI_STREAMING:
+                # 受信した分から表示する（タイムアウトは応答全体ではなく受信の間隔に対して適用される）
+                progress = StreamProgress(on_progress)
+                for text in llm_backend.stream(messages, temperature=temperature, max_tokens=1000, timeout=30):
+                    progress.feed(text)
+                result = progress.finish()
+            else:
+                result = llm_backend.complete(messages, temperature=temperature, max_tokens=1000, timeout=30)
             parsed_result = self._parse_analysis_result(result)
+            # 有効なJSONの応答のみ保存する（解析できなかった応答は次回の生成で取り直す）
+            if self.response_cache is not None and 'error' not in parsed_result:
+                try:
+                    self.response_cache.put(cache_key, model, result)
+                except Exception as e:
+                    print(f"応答キャッシュの保存エラー: {str(e)}")
             # 整合性チェック結果を結果に追加
             parsed_result['consistency_check'] = consistency_check
             return parsed_result
             
-        except Exception as e:
-            st.error(f"AI分析中にエラーが発生しました: {str(e)}")
-            # デフォルトの分析結果を返す（整合性チェック結果も含める）
-            return {
-                'trend': '分析できませんでした',
-                'factors': ['エラーのため分析を実行できませんでした'],
-                'questions': ['再度お試しください'],
-                'impact_analysis': '分析不可',
-                'next_actions': '再実行を推奨します',
-                'consistency_check': consistency_check
-            }
-            
+        # 生成はワーカースレッドで実行されるため、ここでは画面に表示せず error に表示用のメッセージを入れて返す
+        except openai.AuthenticationError as e:
+            # 検証済みのキーが無効になった場合は、次回の生成時に検証し直す（共有の状態は変更しない）
+            llm_backend.invalidate()
+            return self._error_result(f"OpenAI APIキーが無効です: {str(e)}", consistency_check)
+        except openai.APITimeoutError:
+            return self._error_result("OpenAI APIへのリクエストがタイムアウトしました。ネットワーク接続を確認し、再試行してください。", consistency_check)
         except openai.APIConnectionError as e:
-            st.error(f"OpenAI APIへの接続に失敗しました: {str(e)}")
-            return {
-                'trend': 'API接続エラーのため分析できませんでした',
-                'factors': ['OpenAI APIへの接続に失敗しました'],
-                'questions': ['ネットワーク接続を確認してください'],
-                'consistency_check': consistency_check
-            }
+            return self._error_result(f"OpenAI APIへの接続に失敗しました: {str(e)}", consistency_check)
         except openai.APIStatusError as e: # ここはopenaiモジュールレベルのエラークラスでOK
             if e.status_code == 401: # 認証エラー (Unauthorized)
-                st.error("OpenAI APIキーが無効です。設定ページでAPIキーを正しく入力してください。")
-                error_msg = "APIキーが無効です"
+                error_msg = "OpenAI APIキーが無効です。設定ページでAPIキーを正しく入力してください。"
             elif e.status_code == 429: # レート制限エラー (Too Many Requests)
-                st.error("OpenAI APIのリクエストがレート制限を超えました。しばらく待ってから再試行してください。")
-                error_msg = "API利用制限に達しました"
+                error_msg = "OpenAI APIのリクエストがレート制限を超えました。しばらく待ってから再試行してください。"
             elif e.status_code == 400: # Bad Request
-                st.error("リクエストが無効です。入力データを確認してください。")
-                error_msg = "リクエストが無効です"
-            elif e.status_code == 500: # Server Error
-                st.error("OpenAI APIサーバーエラーが発生しました。時間をおいて再試行してください。")
-                error_msg = "APIサーバーエラーです"
+                error_msg = "リクエストが無効です。入力データを確認してください。"
+            elif e.status_code >= 500: # Server Error
+                error_msg = "OpenAI APIサーバーエラーが発生しました。時間をおいて再試行してください。"
             else:
-                st.error(f"OpenAI APIエラー: {e.status_code} - {e.response}")
-                error_msg = f"APIエラー ({e.status_code})"
-            
-            return {
-                'trend': f'{error_msg}のため分析できませんでした',
-                'factors': ['APIエラーが発生しました'],
-                'questions': ['設定を確認して再試行してください'],
-                'consistency_check': consistency_check
-            }
-        except openai.APITimeoutError: # タイムアウトエラー
-            st.error("OpenAI APIへのリクエストがタイムアウトしました。ネットワーク接続を確認し、再試行してください。")
-            return {
-                'trend': 'APIタイムアウトのため分析できませんでした',
-                'factors': ['APIリクエストがタイムアウトしました'],
-                'questions': ['ネットワーク接続を確認して再試行してください'],
-                'consistency_check': consistency_check
-            }
+                error_msg = f"OpenAI APIエラー: {e.status_code} - {str(e)}"
+            return self._error_result(error_msg, consistency_check)
+        except LLMBackendError as e:
+            # OpenAI以外のバックエンド（スタブ等）のエラー
+            return self._error_result(f"AIバックエンド（{llm_backend.name}）がエラーを返しました（HTTP {e.status_code}）: {str(e)}", consistency_check)
         except Exception as e:
-            st.error(f"AI分析エラー: {str(e)}")
-            return {
-                'trend': f'予期しないエラーのため分析できませんでした: {str(e)}',
-                'factors': ['システムエラーが発生しました'],
-                'questions': ['管理者に連絡してください'],
-                'consistency_check': consistency_check
+            return self._error_result(f"AI分析中にエラーが発生しました: {str(e)}", consistency_check)
+
+    @staticmethod
+    def _error_result(message: str, consistency_check: Optional[Dict] = None) -> Dict:
+        """生成に失敗した場合の結果（error に表示用のメッセージ。呼び出し元で表示し、レポートとしては保存しない）"""
+        return {
+            'error': message,
+            'trend': '',
+            'factors': [],
+            'questions': [],
+            'consistency_check': consistency_check or {
+                'is_consistent': True,
+                'issues': [],
+                'notes': ['エラーのため整合性チェックをスキップしました']
             }
-        
+        }
     
     def _build_system_prompt(self) -> str:
         """システムプロンプトを構築"""
@@ -1373,7 +1397,7 @@ class ApparelReportGenerator:
         return "\n".join(context)
     
     def _parse_analysis_result(self, result: str) -> Dict:
-        """分析結果（JSON文字列）をパース"""
+        """分析結果（JSON文字列）をパース（解析できなかった場合は error にメッセージを入れる）"""
         parsed = {
             'trend': '',
             'factors': [],
@@ -1382,35 +1406,15 @@ class ApparelReportGenerator:
         }
         
         json_match = re.search(r'```json\s*(\{.*?\})\s*```', result, re.DOTALL)
-        if not json_match:
-            try:
-                json_data = json.loads(result)
-            except json.JSONDecodeError as e:
-                # JSONパースエラーの場合、エラーメッセージをtrendフィールドに設定
-                error_msg = f"エラー: AIからの出力が有効なJSON形式ではありませんでした。生の出力: {result[:200]}..."
-                parsed['trend'] = error_msg
-                try:
-                    # Streamlitコンテキストがある場合のみst.errorを実行
-                    st.error("AIからの出力が有効なJSON形式ではありませんでした。開発者向け情報: \n" + result)
-                except:
-                    # Streamlitコンテキスト外では無視
-                    pass
-                return parsed
-        else:
-            try:
-                json_string = json_match.group(1)
-                json_data = json.loads(json_string)
-            except json.JSONDecodeError as e:
-                # JSONパースエラーの場合、エラーメッセージをtrendフィールドに設定
-                error_msg = f"エラー: AIからのJSON出力のパースに失敗しました。生の出力: {json_string[:200]}..."
-                parsed['trend'] = error_msg
-                try:
-                    # Streamlitコンテキストがある場合のみst.errorを実行
-                    st.error("AIからのJSON出力のパースに失敗しました。開発者向け情報: \n" + json_string)
-                except:
-                    # Streamlitコンテキスト外では無視
-                    pass
-                return parsed
+        json_string = json_match.group(1) if json_match else result
+        try:
+            json_data = json.loads(json_string)
+        except json.JSONDecodeError:
+            parsed['error'] = f"AIからの出力が有効なJSON形式ではありませんでした。生の出力: {json_string[:200]}..."
+            return parsed
+        if not isinstance(json_data, dict):
+            parsed['error'] = f"AIからの出力が想定した形式ではありませんでした。生の出力: {json_string[:200]}..."
+            return parsed
 
         parsed['trend'] = json_data.get('trend', '').strip()
         parsed['factors'] = [f.strip() for f in json_data.get('factors', []) if f.strip()][:3]
@@ -1418,30 +1422,29 @@ class ApparelReportGenerator:
         
         return parsed
 
-    def generate_weekly_report(self, data_for_ai: Dict) -> Dict:
-        """週次レポートを生成するメインメソッド"""
+    def generate_weekly_report(self, data_for_ai: Dict, llm_backend: LLMBackend, force_regenerate: bool = False,
+                               on_progress: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """週次レポートを生成するメインメソッド
+        
+        llm_backend はリクエストごとに解決したバックエンド。force_regenerate=True の場合は応答キャッシュを使わない。
+        on_progress を指定した場合は生成の途中経過を渡して呼び出す。
+        """
         try:
             # analyze_trend_factorsメソッドを使用してレポートを生成
             return self.analyze_trend_factors(
                 daily_reports=data_for_ai.get('daily_reports', {}),
                 topics=data_for_ai.get('topics', ''),
                 impact_day=data_for_ai.get('impact_day', ''),
-                quantitative_data=data_for_ai.get('quantitative_data', '')
+                quantitative_data=data_for_ai.get('quantitative_data', ''),
+                store_name=data_for_ai.get('store_name'),
+                monday_date=data_for_ai.get('monday_date'),
+                force_regenerate=force_regenerate,
+                on_progress=on_progress,
+                llm_backend=llm_backend
             )
         except Exception as e:
-            st.error(f"週次レポート生成中にエラーが発生しました: {str(e)}")
-            return {
-                'trend': f'レポート生成エラー: {str(e)}',
-                'factors': ['システムエラーが発生しました'],
-                'questions': ['管理者に連絡してください'],
-                'consistency_check': {
-                    'is_consistent': True,
-                    'issues': [],
-                    'notes': ['エラーのため整合性チェックをスキップしました']
-                }
-            }
-        
-        return parsed
+            # ワーカースレッドで実行されるため、画面には表示せず結果の error で返す
+            return self._error_result(f"週次レポート生成中にエラーが発生しました: {str(e)}")
 
 class LearningEngine:
     """学習エンジンクラス。ユーザーの修正から学習パターンを生成・管理します。"""
@@ -1455,45 +1458,45 @@ class LearningEngine:
         input_context_str = json.dumps(input_data, ensure_ascii=False, sort_keys=True)
         input_context_hash = hashlib.sha256(input_context_str.encode('utf-8')).hexdigest()
         
-        conn = self.db_manager._get_connection() # DBManagerから接続を取得
-        cursor = conn.cursor()
-
         original_output_json = json.dumps(original_output, ensure_ascii=False)
         modified_output_json = json.dumps(modified_output, ensure_ascii=False)
         edit_reason = modified_output.get('edit_reason', '')
 
-        cursor.execute('''
-            SELECT id, usage_count FROM learning_patterns 
-            WHERE input_context_hash = ? AND modified_output_json = ?
-        ''', (input_context_hash, modified_output_json))
-        
-        existing_pattern = cursor.fetchone()
+        with self.db_manager._transaction() as conn: # DBManagerから接続を取得
+            cursor = conn.cursor()
 
-        if existing_pattern:
-            pattern_id, usage_count = existing_pattern
             cursor.execute('''
-                UPDATE learning_patterns 
-                SET usage_count = ?, last_used = ?
-                WHERE id = ?
-            ''', (usage_count + 1, datetime.now().isoformat(), pattern_id))
+                SELECT id, usage_count FROM learning_patterns 
+                WHERE input_context_hash = ? AND modified_output_json = ?
+            ''', (input_context_hash, modified_output_json))
+            
+            existing_pattern = cursor.fetchone()
+
+            if existing_pattern:
+                pattern_id, usage_count = existing_pattern
+                cursor.execute('''
+                    UPDATE learning_patterns 
+                    SET usage_count = ?, last_used = ?
+                    WHERE id = ?
+                ''', (usage_count + 1, datetime.now().isoformat(), pattern_id))
+            else:
+                cursor.execute('''
+                    INSERT INTO learning_patterns 
+                    (input_context_hash, original_output_json, modified_output_json, edit_reason, usage_count, last_used)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (
+                    input_context_hash,
+                    original_output_json,
+                    modified_output_json,
+                    edit_reason,
+                    1,
+                    datetime.now().isoformat()
+                ))
+
+        if existing_pattern:
             st.info("既存の学習パターンを更新しました。")
         else:
-            cursor.execute('''
-                INSERT INTO learning_patterns 
-                (input_context_hash, original_output_json, modified_output_json, edit_reason, usage_count, last_used)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (
-                input_context_hash,
-                original_output_json,
-                modified_output_json,
-                edit_reason,
-                1,
-                datetime.now().isoformat()
-            ))
             st.success("新しい学習パターンを保存しました！AIの精度向上に役立ちます。")
-        
-        conn.commit()
-        conn.close()
 
 
 # --- Streamlit UI Components ---
@@ -1528,37 +1531,70 @@ def get_excel_download_link(df, filename, text):
         href = f'<a href="data:file/csv;base64,{b64}" download="{csv_filename}">{text}</a>'
         return href
 
-# グローバルインスタンスの初期化
-db_manager = DBManager()
-report_generator = ApparelReportGenerator()
-learning_engine = LearningEngine(db_manager)
-
-# 依存関係を設定
-report_generator.set_dependencies(db_manager, learning_engine)
-
-# ★ここから追加するコード★
 TRAINING_CSV_FILE = "training_data.csv" # ここを実際のファイル名に置き換えてください！
 TEXT_TRAINING_CSV_FILE = "text_training_data.csv" # テキスト学習データファイル
 
-# training_data.csvの読み込み（表示なし）
-if Path(TRAINING_CSV_FILE).exists():
-    report_generator.load_training_data(TRAINING_CSV_FILE)
-    # st.sidebar.success(f"学習データ '{TRAINING_CSV_FILE}' を読み込みました。")  # 表示削除
-    # 読み込み失敗時のみエラー表示（デバッグ用）
-    # else:
-    #     st.sidebar.warning(f"学習データ '{TRAINING_CSV_FILE}' の読み込みに失敗しました。ファイルの内容を確認してください。")
-# else:
-    # st.sidebar.info(f"学習データ '{TRAINING_CSV_FILE}' が見つかりませんでした。")  # 表示削除
-
-# text_training_data.csvの読み込み（表示なし）
-if Path(TEXT_TRAINING_CSV_FILE).exists():
-    report_generator.load_text_training_data(TEXT_TRAINING_CSV_FILE)
-    # st.sidebar.success(f"テキスト学習データ '{TEXT_TRAINING_CSV_FILE}' を読み込みました。")  # 表示削除
-    # 読み込み失敗時のみエラー表示（デバッグ用）
-    # else:
-    #     st.sidebar.warning(f"テキスト学習データ '{TEXT_TRAINING_CSV_FILE}' の読み込みに失敗しました。ファイルの内容を確認してください。")
-# else:
-    # st.sidebar.info(f"テキスト学習データ '{TEXT_TRAINING_CSV_FILE}' が見つかりませんでした。")  # 表示削除
+# --- プロセス全体で共有するリソース ---
+# Streamlitはウィジェット操作のたびにスクリプト全体を再実行するため、
+# DB初期化やCSV読み込みは st.cache_resource で1プロセス1回に抑える。
+
+def _get_file_mtime(file_path: str):
+    """ファイルの更新時刻を取得（存在しない場合はNone）。キャッシュの無効化キーとして使用"""
+    try:
+        return os.path.getmtime(file_path)
+    except OSError:
+        return None
+
+@st.cache_resource(show_spinner=False)
+def get_db_manager(db_path: str = DB_PATH) -> DBManager:
+    """共有DBManagerを取得（スキーマ初期化と編集ログの圧縮処理の起動はプロセスごとに1回のみ）"""
+    manager = DBManager(db_path)
+    start_edit_log_compactor(manager)
+    return manager
+
+@st.cache_resource(show_spinner=False)
+def get_learning_engine(db_path: str = DB_PATH) -> 'LearningEngine':
+    """共有LearningEngineを取得"""
+    return LearningEngine(get_db_manager(db_path))
+
+@st.cache_resource(show_spinner=False)
+def get_report_generator(training_data_mtime, text_training_data_mtime, db_path: str = DB_PATH) -> ApparelReportGenerator:
+    """共有ApparelReportGeneratorを取得
+    
+    学習CSVの更新時刻を引数に取るため、CSVが差し替えられた場合のみ再読み込みされる。
+    """
+    generator = ApparelReportGenerator()
+    # 依存関係を設定
+    generator.set_dependencies(get_db_manager(db_path), get_learning_engine(db_path))
+    generator.response_cache = get_llm_response_cache(db_path)
+    generator.rate_limiter = get_openai_rate_limiter()
+    
+    # training_data.csvの読み込み（表示なし）
+    if training_data_mtime is not None:
+        generator.load_training_data(TRAINING_CSV_FILE)
+    
+    # text_training_data.csvの読み込み（表示なし）
+    if text_training_data_mtime is not None:
+        generator.load_text_training_data(TEXT_TRAINING_CSV_FILE)
+    
+    return generator
+
+def clear_cached_resources():
+    """共有リソースのキャッシュを破棄する（次回の再実行時に再構築される）"""
+    get_report_generator.clear()
+    get_learning_engine.clear()
+    get_db_manager.clear()
+    clear_multi_device_manager()
+    # 接続の共有も破棄する（DBファイル差し替え後に各スレッドが新しいファイルを開き直すため。使用中の他のスレッドの接続は閉じない）
+    close_connection_manager(DB_PATH)
+
+# グローバルインスタンスの取得（2回目以降の再実行ではキャッシュ済みインスタンスを返す）
+db_manager = get_db_manager()
+learning_engine = get_learning_engine()
+report_generator = get_report_generator(
+    _get_file_mtime(TRAINING_CSV_FILE),
+    _get_file_mtime(TEXT_TRAINING_CSV_FILE)
+)
 
 # 学習データの有無を確認（機能は維持）
 has_training_data = (report_generator.training_data is not None and not report_generator.training_data.empty)
@@ -1567,7 +1603,6 @@ has_text_training_data = (report_generator.text_training_data is not None and no
 # 学習データが全くない場合のみ警告表示（重要なエラー情報として残す）
 if not has_training_data and not has_text_training_data:
     st.sidebar.warning("学習データが見つかりませんでした。学習機能は無効になります。")
-# ★ここまで追加するコード★
 
 def get_monday_of_week(selected_date: date) -> date:
     """与えられた日付が属する週の月曜日を計算します。"""
@@ -1669,32 +1704,6 @@ def show_report_creation_page():
     
     # 日付が変更された場合の処理（改善版：データ保持を優先）
     if 'last_selected_monday' not in st.session_state or st.session_state['last_selected_monday'] != st.session_state['selected_monday']:
-        # 前の週のデータを自動保存してから新しい週に移る
-        if 'last_selected_monday' in st.session_state and st.session_state['last_selected_monday'] and st.session_state.get('preserve_input_data', True):
-            old_monday = st.session_state['last_selected_monday']
-            # 各店舗の現在の入力データを保存
-            for store_name in store_names:
-                if st.session_state.get('daily_reports_input', {}).get(store_name):
-                    # データが空でない場合のみ保存
-                    has_data = any(
-                        data.get('trend') or data.get('factors') 
-                        for data in st.session_state['daily_reports_input'][store_name].values()
-                        if isinstance(data, dict)
-                    )
-                    if has_data:
-                        try:
-                            save_draft_data(
-                                store_name,
-                                old_monday,
-                                {store_name: st.session_state['daily_reports_input'][store_name]},
-                                get_weekly_additional_data(store_name, old_monday, 'topics') or '',
-                                get_weekly_additional_data(store_name, old_monday, 'impact_day') or '',
-                                get_weekly_additional_data(store_name, old_monday, 'quantitative_data') or ''
-                            )
-                        except Exception as e:
-                            # 保存エラーは無視して継続
-                            pass
-        
         # データ復元フラグをリセット（新しい週のデータを読み込むため）
         if 'data_restored_for_week' not in st.session_state:
             st.session_state['data_restored_for_week'] = {}
@@ -1800,6 +1809,8 @@ def show_report_creation_page():
         for store_name in store_names:
             store_id = db_manager.get_store_id_by_name(store_name)
             existing_report = db_manager.get_weekly_report(store_id, st.session_state['selected_monday'])
+            # 「修正して学習」の保存は読み込んだ時点のバージョンを条件に行う（他の端末の保存を上書きしない）
+            set_loaded_report_version(store_name, st.session_state['selected_monday'], existing_report.get('version') if existing_report else 0)
             
             if existing_report:
                 # 新しいデータ構造（店舗キーなし）で直接日付データを設定
@@ -1873,30 +1884,14 @@ def show_report_creation_page():
     
     # 日付が変更された場合の処理（修正版）
     if 'last_selected_monday' not in st.session_state or st.session_state['last_selected_monday'] != st.session_state['selected_monday']:
-        # 日付変更時は、現在の入力内容を自動保存してから新しい週のデータを読み込む
-        if 'last_selected_monday' in st.session_state and st.session_state['last_selected_monday']:
-            # 前の週のデータを保存
-            old_monday = st.session_state['last_selected_monday']
-            for store_name in store_names:
-                if st.session_state['daily_reports_input'].get(store_name):
-                    # 空でないデータがあるかチェック
-                    has_data = any(
-                        data.get('trend', '').strip() or data.get('factors') 
-                        for data in st.session_state['daily_reports_input'][store_name].values()
-                        if isinstance(data, dict)
-                    )
-                    if has_data:
-                        # 前の週のデータを保存
-                        topics = get_weekly_additional_data(store_name, old_monday, 'topics')
-                        impact_day = get_weekly_additional_data(store_name, old_monday, 'impact_day')
-                        quantitative_data = get_weekly_additional_data(store_name, old_monday, 'quantitative_data')
-                        save_draft_data(store_name, old_monday, st.session_state['daily_reports_input'], topics, impact_day, quantitative_data)
-        
+        # 前の週の変更は入力のたびに編集ログへ保存済み
         # 新しい週のデータを読み込み
         for store_name in store_names:
             # 既存データの読み込み（データベースから）
             store_id = db_manager.get_store_id_by_name(store_name)
             existing_report = db_manager.get_weekly_report(store_id, st.session_state['selected_monday'])
+            # 「修正して学習」の保存は読み込んだ時点のバージョンを条件に行う（他の端末の保存を上書きしない）
+            set_loaded_report_version(store_name, st.session_state['selected_monday'], existing_report.get('version') if existing_report else 0)
             
             # データベースに既存データがある場合はそれを使用、ない場合のみ空構造で初期化
             if existing_report and existing_report.get('daily_reports'):
@@ -2011,6 +2006,9 @@ def show_report_creation_page():
     # 週次追加情報入力 - 単一店舗モード
     if selected_store_for_editing:
         render_weekly_additional_info(selected_store_for_editing, monday_of_week)
+        # この週の入力内容（日次・週全体）を元に戻す・復元する
+        st.markdown("#### ↩️ 入力内容の履歴")
+        render_edit_history_controls(selected_store_for_editing, monday_of_week)
     else:
         st.warning("⚠️ 編集する店舗を選択してください。")
     
@@ -2019,8 +2017,16 @@ def show_report_creation_page():
     # レポート出力ボタン
     st.header("4. レポート出力")
     
-    # 選択された店舗のレポート出力
-    if selected_store_for_editing:
+    # 選択された店舗のレポート出力（全店舗モードでは全店舗を並列に生成）
+    generate_all_stores = st.checkbox(
+        "🏪 全店舗のレポートをまとめて生成する",
+        key="generate_all_stores",
+        help=f"最大{REPORT_GENERATION_MAX_WORKERS}店舗ずつ同時に生成し、完了した店舗から表示します。編集中以外の店舗は保存済みの最新の入力内容を使います。"
+    )
+    if generate_all_stores:
+        output_stores = list(store_names)
+        st.info(f"📋 出力対象店舗: {'、'.join(output_stores)}")
+    elif selected_store_for_editing:
         output_stores = [selected_store_for_editing]
         st.info(f"📋 出力対象店舗: {selected_store_for_editing}")
     else:
@@ -2028,141 +2034,81 @@ def show_report_creation_page():
         st.warning("⚠️ まず編集する店舗を選択してください。")
         return
     
+    force_regenerate = st.checkbox(
+        "🔁 入力内容が前回と同じでもAIで再生成する",
+        key="force_regenerate_report",
+        help="未チェックの場合、入力内容が前回の生成時と同じなら保存済みの生成結果を表示します（API呼び出しなし）。"
+    )
+    
     if st.button("📄 レポート出力", type="primary"):
         try:
-            # APIキーの確認（絶対パス使用で確実に読み込み）
-            script_dir = pathlib.Path(__file__).parent.absolute()
-            env_path = script_dir / '.env'
-            load_dotenv(dotenv_path=env_path, override=True)
-            openai_api_key = os.getenv("OPENAI_API_KEY")
+            if get_llm_backend_name() == 'stub':
+                # 動作確認・性能計測用のスタブ（APIキー・ネットワーク不要）
+                llm_backend = get_llm_backend()
+                st.caption("🧪 スタブのAIバックエンドで生成します（LLM_BACKEND=stub）")
+            else:
+                # APIキーの確認（.envの変更は再実行の開始時に読み込み済み）
+                openai_api_key = os.getenv("OPENAI_API_KEY")
             
-            if not openai_api_key:
-                st.error("❌ OpenAI APIキーが設定されていません。システム管理者にAPIキーの設定を依頼してください。")
-                st.info("管理者の方は、`.env`ファイルに`OPENAI_API_KEY=your_api_key_here`の形式でAPIキーを設定してください。")
-                return
+                if not openai_api_key:
+                    st.error("❌ OpenAI APIキーが設定されていません。システム管理者にAPIキーの設定を依頼してください。")
+                    st.info("管理者の方は、`.env`ファイルに`OPENAI_API_KEY=your_api_key_here`の形式でAPIキーを設定してください。")
+                    return
             
-            # OpenAIクライアントを初期化
-            if not report_generator.initialize_openai(openai_api_key):
-                st.warning("💡 **OpenAI APIキーのトラブルシューティング:**")
-                with st.expander("APIキーの確認・更新方法", expanded=True):
-                    st.markdown("""
-                **1. OpenAI Platform にアクセス:**
-                - https://platform.openai.com/ にアクセス
-                - アカウントにログイン
+                # OpenAIクライアントを初期化
+                llm_backend = report_generator.resolve_openai_backend(openai_api_key)
+                if llm_backend is None:
+                    st.warning("💡 **OpenAI APIキーのトラブルシューティング:**")
+                    with st.expander("APIキーの確認・更新方法", expanded=True):
+                        st.markdown("""
+                    **1. OpenAI Platform にアクセス:**
+                    - https://platform.openai.com/ にアクセス
+                    - アカウントにログイン
                 
-                **2. APIキーの確認:**
-                - 左サイドバーの「API Keys」をクリック
-                - 既存のキーが有効か確認（使用制限やクレジット残高も確認）
+                    **2. APIキーの確認:**
+                    - 左サイドバーの「API Keys」をクリック
+                    - 既存のキーが有効か確認（使用制限やクレジット残高も確認）
                 
-                **3. 新しいAPIキーの作成（必要に応じて）:**
-                - 「Create new secret key」をクリック
-                """)
-                return
+                    **3. 新しいAPIキーの作成（必要に応じて）:**
+                    - 「Create new secret key」をクリック
+                    """)
+                    return
             
-            # 複数店舗のレポート生成
-            with st.spinner(f"📝 {len(output_stores)}店舗のレポートを生成中..."):
-                for store_index, selected_store_name in enumerate(output_stores):
+            # 複数店舗のレポート生成（店舗ごとの表示枠を先に確保し、生成が完了した店舗から表示する）
+            current_monday_str = st.session_state['selected_monday']
+            inputs_for_ai = {}
+            store_containers = {}
+            store_statuses = {}
+            for store_index, selected_store_name in enumerate(output_stores):
+                inputs_for_ai[selected_store_name] = build_report_input(selected_store_name, current_monday_str)
+                store_containers[selected_store_name] = st.container()
+                with store_containers[selected_store_name]:
                     st.markdown(f"### 🏪 {selected_store_name}店のレポート")
-                    
-                    # 進捗表示
-                    progress_text = f"店舗 {store_index + 1}/{len(output_stores)}: {selected_store_name}店"
-                    progress_bar = st.progress((store_index) / len(output_stores), text=progress_text)
-                    
-                    # 現在選択中の店舗・週の追加情報を取得
-                    current_monday_str = st.session_state['selected_monday']
-                    topics_data = get_weekly_additional_data(selected_store_name, current_monday_str, 'topics') or ''
-                    impact_day_data = get_weekly_additional_data(selected_store_name, current_monday_str, 'impact_day') or ''
-                    quantitative_data_data = get_weekly_additional_data(selected_store_name, current_monday_str, 'quantitative_data') or ''
-                    
-                    data_for_ai = {
-                        'daily_reports': {selected_store_name: st.session_state['daily_reports_input'][selected_store_name]},
-                        'topics': topics_data,
-                        'impact_day': impact_day_data,
-                        'quantitative_data': quantitative_data_data
-                    }
-                    
-                    # AI生成したレポートのキーを生成
-                    ai_report_key = f"ai_generated_report_{selected_store_name}_{current_monday_str}"
-                    
-                    # レポート生成（常に最新データで再生成）
-                    report_result = report_generator.generate_weekly_report(data_for_ai)
-                    if report_result and isinstance(report_result, dict) and report_result.get('trend'):
-                        # レポート結果を辞書として保存
-                        st.session_state[ai_report_key] = report_result
-                        # 週次出力データとして保存
-                        set_weekly_report_output(selected_store_name, current_monday_str, 'generated_report', report_result)
-                        
-                        # 現在選択中の店舗の場合は、従来の表示用変数も更新
-                        if selected_store_name == st.session_state.get('selected_store_for_report'):
-                            st.session_state['generated_report_output'] = report_result
-                        
-                        # データベースにも最新のレポートを保存
-                        store_id = db_manager.get_store_id_by_name(selected_store_name)
-                        
-                        # レポート生成時も入力データを保護（クリアしない）
-                        st.session_state['preserve_input_data'] = True
-                        
-                        save_draft_data(
-                            selected_store_name,
-                            current_monday_str,
-                            {selected_store_name: st.session_state['daily_reports_input'][selected_store_name]},
-                            topics_data,
-                            impact_day_data,
-                            quantitative_data_data,
-                            report_result  # 生成されたレポートも保存
-                        )
-                    else:
-                        st.error(f"❌ {selected_store_name}店のレポート生成に失敗しました。")
-                        continue
-                    
-                    # レポート表示
-                    if ai_report_key in st.session_state:
-                        report_data = st.session_state[ai_report_key]
-                        # 辞書形式のレポートデータから表示用テキストを生成
-                        if isinstance(report_data, dict):
-                            display_text = report_data.get('trend', 'レポートデータが正しく生成されませんでした。')
-                            factors = report_data.get('factors', [])
-                            questions = report_data.get('questions', [])
-                            
-                            # 表示用のフォーマット済みテキストを作成
-                            formatted_report = f"【週全体の動向】\n{display_text}\n\n"
-                            if factors:
-                                formatted_report += f"【主な要因】\n"
-                                for i, factor in enumerate(factors, 1):
-                                    formatted_report += f"{i}. {factor}\n"
-                                formatted_report += "\n"
-                            if questions:
-                                formatted_report += f"【AIからの質問】\n"
-                                for i, question in enumerate(questions, 1):
-                                    formatted_report += f"{i}. {question}\n"
-                        else:
-                            # 文字列形式の場合（後方互換性）
-                            formatted_report = str(report_data)
-                        
-                        with st.container():
-                            st.text_area(
-                                f"🤖 AI生成レポート ({selected_store_name}店)",
-                                value=formatted_report,
-                                height=300,
-                                key=f"ai_report_display_{selected_store_name}_{current_monday_str}"
-                            )
-                            
-                            # ダウンロードボタン
-                            st.download_button(
-                                label=f"📊 {selected_store_name}店レポートをダウンロード",
-                                data=formatted_report,
-                                file_name=f"weekly_report_{selected_store_name}_{current_monday_str}.txt",
-                                mime="text/plain",
-                                key=f"download_{selected_store_name}_{current_monday_str}"
-                            )
-                    
-                    # 進捗更新
-                    progress_bar.progress((store_index + 1) / len(output_stores), text=f"完了: {selected_store_name}店")
-                    
-                    if store_index < len(output_stores) - 1:
-                        st.markdown("---")
+                    store_statuses[selected_store_name] = st.empty()
+                    store_statuses[selected_store_name].info("⏳ 生成中...")
+                if store_index < len(output_stores) - 1:
+                    st.markdown("---")
+            progress_bar = st.progress(0.0, text=f"0/{len(output_stores)}店舗 完了")
+            
+            generation_started = datetime.now()
+            completed_count = 0
+            with st.spinner(f"📝 {len(output_stores)}店舗のレポートを生成中..."):
+                # 生成中の店舗は受信した分から表示する（途中経過の表示はこのスレッドで行う）
+                for selected_store_name, report_result, elapsed_seconds in generate_concurrently(
+                    lambda data_for_ai, on_progress: report_generator.generate_weekly_report(
+                        data_for_ai, llm_backend, force_regenerate=force_regenerate, on_progress=on_progress),
+                    inputs_for_ai,
+                    on_progress=lambda store_name, partial: render_partial_report(store_statuses[store_name], partial)
+                ):
+                    completed_count += 1
+                    progress_bar.progress(completed_count / len(output_stores),
+                                          text=f"{completed_count}/{len(output_stores)}店舗 完了: {selected_store_name}店")
+                    with store_containers[selected_store_name]:
+                        store_statuses[selected_store_name].empty()
+                        show_generated_report(selected_store_name, current_monday_str, report_result, elapsed_seconds)
                 
-                st.success(f"✅ {len(output_stores)}店舗のレポート生成が完了しました！")
+                total_seconds = (datetime.now() - generation_started).total_seconds()
+                st.success(f"✅ {len(output_stores)}店舗のレポート生成が完了しました！（{total_seconds:.1f}秒）")
                 
         except Exception as e:
             st.error(f"❌ レポート生成中にエラーが発生しました: {str(e)}")
@@ -2317,13 +2263,26 @@ def show_report_creation_page():
                 }
 
                 # DBに保存し、学習エンジンに渡す
-                is_updated = db_manager.save_weekly_data(
+                save_result = db_manager.save_weekly_data(
                     store_id,
                     monday_date_str,
                     input_data_for_learning, # daily_reports_inputを直接渡す
                     st.session_state['generated_report_output'],
-                    modified_report_data
+                    modified_report_data,
+                    expected_version=get_loaded_report_version(current_store_name, monday_date_str)
                 )
+                set_loaded_report_version(current_store_name, monday_date_str, save_result['version'])
+                is_updated = not save_result['created']
+                if save_result['conflict']:
+                    # 他の端末が先に保存していた入力内容を残し、修正レポートのみを反映した
+                    latest_report = save_result['report']
+                    input_data_for_learning = {
+                        'daily_reports': {current_store_name: latest_report.get('daily_reports', {})},
+                        'topics': latest_report.get('topics', ''),
+                        'impact_day': latest_report.get('impact_day', ''),
+                        'quantitative_data': latest_report.get('quantitative_data', '')
+                    }
+                    st.warning("⚠️ 他のデバイスで先に保存された入力内容があったため、入力内容は最新の保存内容のまま修正レポートのみを保存しました。")
                 
                 learning_engine.learn_from_correction(
                     input_data=input_data_for_learning,
@@ -2350,30 +2309,62 @@ def show_report_history_page():
     all_stores = db_manager.get_all_stores()
     store_names = [s[1] for s in all_stores]
     store_id_map = {s[1]: s[0] for s in all_stores}
+    status_options = {"すべて": None, "あり": True, "なし": False}
 
-    selected_store_name = st.selectbox("ダウンロード対象の店舗を選択:", ["全店舗"] + store_names)
+    # 絞り込み条件
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        selected_store_name = st.selectbox("ダウンロード対象の店舗を選択:", ["全店舗"] + store_names)
+        search_text = st.text_input("キーワード検索（空白区切りで複数指定）:", key="history_search_text", placeholder="例: 羽織 欠品")
+    with col2:
+        date_from = st.date_input("対象週（開始）:", value=None, key="history_date_from")
+        date_to = st.date_input("対象週（終了）:", value=None, key="history_date_to")
+    with col3:
+        generated_label = st.selectbox("AI生成:", list(status_options.keys()), key="history_generated_filter")
+        modified_label = st.selectbox("修正:", list(status_options.keys()), key="history_modified_filter")
+
+    filters = {
+        'store_id': store_id_map.get(selected_store_name),
+        'date_from': date_from.strftime('%Y-%m-%d') if date_from else None,
+        'date_to': date_to.strftime('%Y-%m-%d') if date_to else None,
+        'has_generated': status_options[generated_label],
+        'has_modified': status_options[modified_label],
+        'text': search_text.strip() or None
+    }
 
-    if selected_store_name == "全店舗":
-        reports = db_manager.get_all_weekly_reports()
-    else:
-        selected_store_id = store_id_map[selected_store_name]
-        reports = db_manager.get_all_weekly_reports(selected_store_id)
+    # 絞り込み条件が変わったら1ページ目に戻す（cursorsは各ページの開始カーソルのスタック）
+    filter_signature = tuple(sorted(filters.items()))
+    if st.session_state.get('history_filter_signature') != filter_signature:
+        st.session_state['history_filter_signature'] = filter_signature
+        st.session_state['history_page_cursors'] = [None]
+    page_cursors = st.session_state['history_page_cursors']
+
+    # キーワードが入力されている場合は、関連度順の検索結果と一致箇所を表示
+    if filters['text']:
+        search_results = db_manager.search_reports(filters['text'], store_id=filters['store_id'])
+        with st.expander(f"🔍 「{filters['text']}」の検索結果（関連度順・{len(search_results)}件）", expanded=True):
+            if not search_results:
+                st.write("一致するレポートはありません。")
+            for result in search_results:
+                st.markdown(f"**{result['store_name']}店 {result['monday_date']}週**（ID: {result['id']}）")
+                st.caption(result['snippet'])
+
+    reports, next_cursor = db_manager.list_weekly_reports(cursor=page_cursors[-1], **filters)
 
     if not reports:
+        if len(page_cursors) > 1:
+            # 前回表示中のページが空になった場合（削除等）は1ページ目に戻す
+            st.session_state['history_page_cursors'] = [None]
+            st.rerun()
         st.warning("ダウンロード可能なレポートがありません。")
         st.info("💡 ヒント: 「週次レポート作成」ページでレポートを生成・保存してください。")
         return
 
     report_data = []
     for r in reports:
-        try:
-            store_name = db_manager.get_store_name_by_id(r['store_id'])
-        except Exception as e:
-            store_name = f"店舗ID:{r['store_id']}"
-            
         report_data.append({
             "ID": r['id'],
-            "店舗名": store_name,
+            "店舗名": r['store_name'],
             "週次レポート (月曜日)": r['monday_date'],
             "最終更新日時": datetime.fromisoformat(r['timestamp']).strftime('%Y/%m/%d %H:%M'),
             "AI生成済み": "はい" if r['has_generated'] else "いいえ",
@@ -2383,6 +2374,19 @@ def show_report_history_page():
     df = pd.DataFrame(report_data)
     st.dataframe(df.set_index('ID'), use_container_width=True)
 
+    # ページ送り
+    col_prev, col_page, col_next = st.columns([1, 2, 1])
+    with col_prev:
+        if st.button("◀ 前へ", key="history_prev_page", disabled=len(page_cursors) <= 1):
+            page_cursors.pop()
+            st.rerun()
+    with col_page:
+        st.caption(f"{len(page_cursors)}ページ目（{len(reports)}件表示）")
+    with col_next:
+        if st.button("次へ ▶", key="history_next_page", disabled=next_cursor is None):
+            page_cursors.append(next_cursor)
+            st.rerun()
+
     # ダウンロード機能
     st.subheader("📥 レポートダウンロード")
     report_ids = [r['id'] for r in reports]
@@ -2421,7 +2425,7 @@ def show_report_history_page():
                 return
                 
             if full_report:
-                store_name = db_manager.get_store_name_by_id(full_report['store_id'])
+                store_name = selected_report_db['store_name']
                 st.success(f"✅ 選択: {store_name}店 - {full_report['monday_date']} ({datetime.fromisoformat(full_report['timestamp']).strftime('%Y/%m/%d %H:%M')})")
 
                 # ダウンロード用のデータ整形（エラーハンドリング強化）
@@ -2455,21 +2459,19 @@ def show_report_history_page():
                 # 日次レポートの詳細を安全に追加
                 daily_reports = full_report.get('daily_reports', {})
                 if isinstance(daily_reports, dict):
-                    for store_name_key, dates_data in daily_reports.items():
-                        if isinstance(dates_data, dict):
-                            for date_str, report_data in dates_data.items():
-                                try:
-                                    if isinstance(report_data, dict):
-                                        export_data[f"日次動向_{store_name_key}_{date_str}"] = str(report_data.get('trend', ''))
-                                        factors = report_data.get('factors', [])
-                                        export_data[f"日次要因_{store_name_key}_{date_str}"] = ", ".join(factors) if isinstance(factors, list) else str(factors)
-                                    else:
-                                        export_data[f"日次動向_{store_name_key}_{date_str}"] = ''
-                                        export_data[f"日次要因_{store_name_key}_{date_str}"] = ''
-                                except Exception as e:
-                                    print(f"日次データ処理エラー: {e}")
-                                    export_data[f"日次動向_{store_name_key}_{date_str}"] = ''
-                                    export_data[f"日次要因_{store_name_key}_{date_str}"] = ''
+                    for date_str, report_data in sorted(daily_reports.items()):
+                        try:
+                            if isinstance(report_data, dict):
+                                export_data[f"日次動向_{store_name}_{date_str}"] = str(report_data.get('trend', ''))
+                                factors = report_data.get('factors', [])
+                                export_data[f"日次要因_{store_name}_{date_str}"] = ", ".join(factors) if isinstance(factors, list) else str(factors)
+                            else:
+                                export_data[f"日次動向_{store_name}_{date_str}"] = ''
+                                export_data[f"日次要因_{store_name}_{date_str}"] = ''
+                        except Exception as e:
+                            print(f"日次データ処理エラー: {e}")
+                            export_data[f"日次動向_{store_name}_{date_str}"] = ''
+                            export_data[f"日次要因_{store_name}_{date_str}"] = ''
 
                 df_export = pd.DataFrame([export_data])
                 
@@ -2547,6 +2549,75 @@ def show_settings_page():
         st.error(f"学習データの読み込みでエラーが発生しました: {str(e)}")
         st.info("データベースの初期化が必要な可能性があります。")
 
+    # 共有リソースの再読み込み
+    st.markdown("---")
+    st.subheader("キャッシュ管理")
+    st.info("データベース接続や学習データはプロセス全体で共有・キャッシュされています。学習データCSVやデータベースを差し替えた場合は再読み込みしてください。")
+    if st.button("🔄 共有リソースを再読み込み", key="clear_cached_resources_button"):
+        clear_cached_resources()
+        st.success("キャッシュをクリアしました。次回の操作時に再読み込みされます。")
+
+    st.markdown("---")
+    st.subheader("データベース診断")
+    st.write(f"スキーマバージョン: {get_schema_version(db_manager._get_connection())}")
+    st.write(f"保存の競合（他のデバイスが先に保存していたため変更した項目のみ反映）: {db_manager.save_conflict_count}件")
+    with st.expander("主要クエリの実行計画"):
+        for query_name, plan in db_manager.explain_query_plans().items():
+            st.markdown(f"**{query_name}**")
+            st.code("\n".join(plan), language="text")
+
+    # マルチデバイス同期データの定期削除の状況
+    janitor_stats = get_session_janitor_stats()
+    if janitor_stats is None:
+        st.write("同期データの定期削除: 無効")
+    else:
+        last_run = janitor_stats['last_run'].strftime('%Y-%m-%d %H:%M:%S') if janitor_stats['last_run'] else "未実行"
+        st.write(f"同期データの定期削除: {'実行中' if janitor_stats['alive'] else '停止'}（{int(janitor_stats['interval_seconds'])}秒間隔・{janitor_stats['runs']}回実行・最終実行 {last_run}）")
+        removed_labels = {'active_sessions': 'セッション', 'edit_locks': '編集ロック', 'sync_bus': '同期バスの購読'}
+        st.write("削除件数（累計）: " + "、".join(
+            f"{label} {janitor_stats['total_removed'].get(table, 0)}件" for table, label in removed_labels.items()
+        ))
+        if janitor_stats['last_error']:
+            st.warning(f"前回の削除でエラーが発生しました: {janitor_stats['last_error']}")
+    # 編集ログの週次レポートへの反映（圧縮）の状況
+    compactor_stats = get_edit_log_compactor_stats()
+    if compactor_stats is None:
+        st.write("編集ログの圧縮: 未起動")
+    else:
+        last_run = compactor_stats['last_run'].strftime('%Y-%m-%d %H:%M:%S') if compactor_stats['last_run'] else "未実行"
+        st.write(f"編集ログの圧縮: {'実行中' if compactor_stats['alive'] else '停止'}（{int(compactor_stats['interval_seconds'])}秒または{compactor_stats['every_edits']}件ごと・{compactor_stats['runs']}回実行・最終実行 {last_run}）")
+        st.write(f"反映件数（累計）: {compactor_stats['total'].get('edits', 0)}件（{compactor_stats['total'].get('weeks', 0)}週分）・削除件数（累計）: {compactor_stats['total'].get('truncated', 0)}件")
+        if compactor_stats['last_error']:
+            st.warning(f"前回の圧縮でエラーが発生しました: {compactor_stats['last_error']}")
+    # OpenAIクライアントの共有・キーの検証の状況
+    pool_stats = get_openai_client_pool().get_stats()
+    st.write(f"OpenAIクライアント: {pool_stats['clients']}件共有（作成 {pool_stats['clients_created']}回）・"
+             f"キーの検証 {pool_stats['validations']}回（省略 {pool_stats['validation_cache_hits']}回・有効期限{pool_stats['validation_ttl_seconds'] / 60:g}分）・"
+             f"認証エラーによる検証のやり直し {pool_stats['invalidations']}回")
+    # AIバックエンドごとの呼び出し回数・使用トークン数
+    st.write(f"AIバックエンド: {get_llm_backend_name()}")
+    for backend_stats in get_llm_backend_stats():
+        st.write(f"・{backend_stats['backend']}（{backend_stats['model']}）: 呼び出し {backend_stats['requests']}回"
+                 f"（ストリーミング {backend_stats['streams']}回・エラー {backend_stats['errors']}回）・"
+                 f"トークン 入力 {backend_stats['prompt_tokens']}・出力 {backend_stats['completion_tokens']}")
+    # 複数店舗の並列生成・API呼び出しの流量制限の状況
+    limiter_stats = get_openai_rate_limiter().get_stats()
+    if limiter_stats['requests_per_minute'] > 0:
+        rate_limit_text = f"API呼び出し上限 {limiter_stats['requests_per_minute']:g}回/分（連続{limiter_stats['burst']}回まで）"
+    else:
+        rate_limit_text = "API呼び出し上限なし"
+    st.write(f"レポートの並列生成: 最大{REPORT_GENERATION_MAX_WORKERS}店舗同時・{rate_limit_text}・"
+             f"呼び出し {limiter_stats['acquired']}回・上限による待ち時間（累計）{limiter_stats['waited_seconds']:.1f}秒")
+    # AIの応答キャッシュの状況
+    cache_stats = get_llm_response_cache(DB_PATH).get_stats()
+    cache_hits = cache_stats['memory_hits'] + cache_stats['db_hits']
+    st.write(f"AIの応答キャッシュ: {cache_stats['db_entries']}件保存（上限{cache_stats['max_entries']}件・有効期限{cache_stats['ttl_seconds'] / 3600:g}時間）・"
+             f"ヒット {cache_hits}件（メモリ {cache_stats['memory_hits']}件）・ミス {cache_stats['misses']}件・再生成 {cache_stats['bypasses']}件・期限切れ等の削除 {cache_stats['evictions']}件")
+    if st.button("🗑️ AIの応答キャッシュを削除", key="clear_llm_cache_button"):
+        st.success(f"応答キャッシュを{get_llm_response_cache(DB_PATH).clear()}件削除しました。")
+    bus_stats = get_sync_bus().get_stats()
+    st.write(f"同期バス: 購読 {bus_stats['subscriptions']}件・配信 {bus_stats['delivered']}件（発行 {bus_stats['published']}件）")
+
     # 学習データのエクスポート機能 (例)
     st.markdown("---")
     st.subheader("学習データのエクスポート")
@@ -2554,7 +2625,6 @@ def show_settings_page():
         # 仮の学習データ取得ロジック（実際にはlearning_patternsテーブルから取得）
         conn = db_manager._get_connection()
         learning_data_df = pd.read_sql_query("SELECT * FROM learning_patterns", conn)
-        conn.close()
 
         if not learning_data_df.empty:
             st.download_button(
@@ -2571,10 +2641,15 @@ def show_settings_page():
 # メインナビゲーション
 st.sidebar.title("ナビゲーション")
 
+# 他デバイスの変更の差分取得を、この再実行で店舗・週ごとに1回にする
+begin_sync_cycle()
+
 selection = st.sidebar.radio("Go to", ["週次レポート作成", "レポートダウンロード", "設定"])
 
 if selection == "週次レポート作成":
     show_report_creation_page()
+    # 保持中の編集ロックをまとめて延長（一定時間編集のないロックは解放）
+    renew_field_locks()
 elif selection == "レポートダウンロード":
     show_report_history_page()
 elif selection == "設定":
@@ -0,0 +1,281 @@
+"""
+類似ケース検索
+過去の週次レポートを文字n-gramのTF-IDFベクトルで索引化し、現在の入力とのコサイン類似度で検索する機能群
+"""
+import math
+import re
+import threading
+import unicodedata
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# 特徴量ハッシュの次元数（2のべき乗）
+N_FEATURES = 1 << 18
+# 日本語は分かち書きせずに文字n-gramで扱う
+NGRAM_SIZES = (2, 3)
+# 同一店舗・近い季節のケースに掛けるスコア倍率の加算分
+STORE_BOOST = 0.3
+SEASON_BOOST = 0.2
+# KPI帯トークンの出現回数（テキストのn-gramに埋もれないよう重み付けする）
+KPI_TOKEN_REPEAT = 3
+# 差分（未圧縮）ドキュメント数・削除済み割合がこれを超えたら索引を再構築する
+MAX_DELTA_DOCS = 64
+MAX_TOMBSTONE_RATIO = 0.2
+
+_WHITESPACE_PATTERN = re.compile(r'\s+')
+_KPI_PATTERN = re.compile(r'^\s*([^:：]+)[:：]\s*([-+]?\d+(?:\.\d+)?)\s*[%％]?\s*$')
+
+
+def char_ngrams(text: str) -> List[str]:
+    """テキストを正規化し、文字n-gramの一覧を返す"""
+    if not text:
+        return []
+    normalized = _WHITESPACE_PATTERN.sub('', unicodedata.normalize('NFKC', str(text)).lower())
+    tokens = []
+    for n in NGRAM_SIZES:
+        tokens.extend(normalized[i:i + n] for i in range(len(normalized) - n + 1))
+    return tokens
+
+
+def kpi_tokens(quantitative_data: str) -> List[str]:
+    """定量データ（「項目: 前年比%」の行）を5ポイント刻みの帯トークンに変換する
+
+    例: 「売上: 97%」→「#kpi:売上:-5」（前年比-5〜0ポイントの帯）
+    """
+    tokens = []
+    for line in (quantitative_data or '').splitlines():
+        match = _KPI_PATTERN.match(unicodedata.normalize('NFKC', line))
+        if not match:
+            continue
+        change = float(match.group(2)) - 100
+        band = int(max(-30, min(30, math.floor(change / 5) * 5)))
+        tokens.extend([f"#kpi:{match.group(1).strip()}:{band}"] * KPI_TOKEN_REPEAT)
+    return tokens
+
+
+def build_case_terms(daily_reports: Dict, topics: str = '', impact_day: str = '', quantitative_data: str = '') -> List[str]:
+    """週次の入力内容（日次の動向・要因、TOPICS、インパクト大、定量データ）から索引用のトークンを作る
+
+    daily_reports: {日付: {'trend': str, 'factors': list}}
+    """
+    tokens = []
+    for day in (daily_reports or {}).values():
+        if not isinstance(day, dict):
+            continue
+        tokens.extend(char_ngrams(day.get('trend', '')))
+        for factor in day.get('factors', []) or []:
+            tokens.extend(char_ngrams(factor))
+    tokens.extend(char_ngrams(topics))
+    tokens.extend(char_ngrams(impact_day))
+    tokens.extend(kpi_tokens(quantitative_data))
+    return tokens
+
+
+def vectorize(tokens: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """トークン列を特徴量ハッシュで疎ベクトル（昇順の特徴量番号, 対数TF）に変換する"""
+    if not tokens:
+        return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+    # crc32はプロセス間で値が変わらない（組み込みのhashはプロセスごとにランダム化される）
+    hashed = np.fromiter((zlib.crc32(t.encode('utf-8')) & (N_FEATURES - 1) for t in tokens), dtype=np.int32, count=len(tokens))
+    indices, counts = np.unique(hashed, return_counts=True)
+    return indices.astype(np.int32), (1.0 + np.log(counts)).astype(np.float32)
+
+
+class SimilarCaseIndex:
+    """過去ケースのTF-IDF索引
+
+    圧縮済みの本体は特徴量ごとの転置リスト（CSC形式のNumPy配列）で保持し、検索時は
+    クエリに含まれる特徴量の転置リストだけを集計する。追加・更新は差分として保持し、
+    更新前のドキュメントは削除フラグ（tombstone）で除外する。差分や削除済みが増えたら再構築する。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # スロット（ドキュメントの格納位置）ごとの情報
+        self._slot_terms: List[Tuple[np.ndarray, np.ndarray]] = []
+        self._slot_meta: List[Dict[str, Any]] = []
+        self._slot_norms: List[float] = []
+        self._slot_store_codes: List[int] = []
+        self._slot_months: List[int] = []
+        self._alive: List[bool] = []
+        self._key_to_slot: Dict[Any, int] = {}
+        self._store_codes: Dict[str, int] = {}
+        # 検索時に使うスロット単位の配列（ノルム・生存フラグ・店舗・月）。変更時に破棄して作り直す
+        self._slot_arrays: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]] = None
+        # 生存ドキュメントの文書頻度
+        self._df = np.zeros(N_FEATURES, dtype=np.int32)
+        # 圧縮時点のIDF（差分ドキュメントにも同じIDFを使う）
+        self._idf = np.ones(N_FEATURES, dtype=np.float32)
+        # 圧縮済み本体（スロット0〜_main_size-1）の転置リスト
+        self._main_size = 0
+        self._post_indptr = np.zeros(N_FEATURES + 1, dtype=np.int64)
+        self._post_slots = np.zeros(0, dtype=np.int32)
+        self._post_tf = np.zeros(0, dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self._key_to_slot)
+
+    def _norm(self, indices: np.ndarray, tf: np.ndarray) -> float:
+        return float(np.sqrt(np.sum((tf * self._idf[indices]) ** 2)))
+
+    def _append_slot(self, key, indices: np.ndarray, tf: np.ndarray, meta: Dict[str, Any]):
+        self._key_to_slot[key] = len(self._slot_terms)
+        self._slot_terms.append((indices, tf))
+        self._slot_meta.append(meta)
+        self._slot_norms.append(self._norm(indices, tf))
+        self._slot_store_codes.append(self._store_codes.setdefault(meta.get('store_name'), len(self._store_codes)))
+        self._slot_months.append(meta.get('month') or 0)
+        self._alive.append(True)
+        self._slot_arrays = None
+
+    def _add_slot(self, key, indices: np.ndarray, tf: np.ndarray, meta: Dict[str, Any]):
+        self._append_slot(key, indices, tf, meta)
+        self._df[indices] += 1
+
+    def _remove_slot(self, key):
+        slot = self._key_to_slot.pop(key, None)
+        if slot is None:
+            return
+        self._alive[slot] = False
+        self._df[self._slot_terms[slot][0]] -= 1
+        self._slot_arrays = None
+
+    def _compact(self):
+        """生存ドキュメントのみで転置リストとIDFを作り直す"""
+        live = [slot for slot, alive in enumerate(self._alive) if alive]
+        terms = [self._slot_terms[slot] for slot in live]
+        metas = [self._slot_meta[slot] for slot in live]
+        keys = {slot: key for key, slot in self._key_to_slot.items()}
+        df = self._df
+
+        self._reset()
+        self._df = df
+        n_docs = len(live)
+        self._idf = (np.log((n_docs + 1) / (df + 1)) + 1.0).astype(np.float32)
+        for slot, (indices, tf), meta in zip(live, terms, metas):
+            self._append_slot(keys[slot], indices, tf, meta)
+
+        if n_docs:
+            lengths = np.array([len(indices) for indices, _ in terms], dtype=np.int64)
+            all_indices = np.concatenate([indices for indices, _ in terms])
+            all_tf = np.concatenate([tf for _, tf in terms])
+            all_slots = np.repeat(np.arange(n_docs, dtype=np.int32), lengths)
+            order = np.argsort(all_indices, kind='stable')
+            self._post_slots = all_slots[order]
+            self._post_tf = all_tf[order]
+            self._post_indptr[1:] = np.cumsum(np.bincount(all_indices, minlength=N_FEATURES))
+        self._main_size = n_docs
+
+    def _get_slot_arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        if self._slot_arrays is None:
+            norms = np.array(self._slot_norms, dtype=np.float64)
+            self._slot_arrays = (
+                norms,
+                np.array(self._alive, dtype=bool) & (norms > 0),
+                np.array(self._slot_store_codes, dtype=np.int32),
+                np.array(self._slot_months, dtype=np.int32)
+            )
+        return self._slot_arrays
+
+    def _needs_compaction(self) -> bool:
+        total = len(self._alive)
+        if total == 0:
+            return False
+        delta = total - self._main_size
+        dead = total - len(self._key_to_slot)
+        return delta > MAX_DELTA_DOCS or dead > total * MAX_TOMBSTONE_RATIO
+
+    def rebuild(self, documents: List[Tuple[Any, List[str], Dict[str, Any]]]):
+        """(キー, トークン列, メタ情報) の一覧から索引を作り直す"""
+        with self._lock:
+            self._reset()
+            for key, tokens, meta in documents:
+                indices, tf = vectorize(tokens)
+                self._add_slot(key, indices, tf, meta)
+            self._compact()
+
+    def upsert(self, key, tokens: List[str], meta: Dict[str, Any]):
+        """ドキュメントを追加・更新する（更新前のドキュメントは削除扱い）"""
+        indices, tf = vectorize(tokens)
+        with self._lock:
+            self._remove_slot(key)
+            self._add_slot(key, indices, tf, meta)
+            if self._needs_compaction():
+                self._compact()
+
+    def remove(self, key):
+        """ドキュメントを索引から除外する"""
+        with self._lock:
+            self._remove_slot(key)
+            if self._needs_compaction():
+                self._compact()
+
+    def search(self, tokens: List[str], top_k: int = 5, store_name: Optional[str] = None,
+               month: Optional[int] = None, exclude_key=None) -> List[Tuple[float, Dict[str, Any]]]:
+        """類似度の高い順に (スコア, メタ情報) を最大top_k件返す
+
+        スコアはコサイン類似度に、同一店舗・同月/隣接月の場合の倍率を掛けたもの。
+        """
+        q_indices, q_tf = vectorize(tokens)
+        with self._lock:
+            n_slots = len(self._alive)
+            if n_slots == 0 or len(q_indices) == 0:
+                return []
+
+            q_weights = q_tf * self._idf[q_indices]
+            q_norm = float(np.sqrt(np.sum(q_weights ** 2)))
+            if q_norm == 0:
+                return []
+
+            dots = np.zeros(n_slots, dtype=np.float64)
+            # 圧縮済み本体: クエリの特徴量の転置リストだけを取り出して集計
+            if self._main_size:
+                starts = self._post_indptr[q_indices]
+                lengths = self._post_indptr[q_indices + 1] - starts
+                total = int(lengths.sum())
+                if total:
+                    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+                    weights = np.repeat(q_weights * self._idf[q_indices], lengths) * self._post_tf[offsets]
+                    dots[:self._main_size] = np.bincount(self._post_slots[offsets], weights=weights, minlength=self._main_size)
+            # 差分ドキュメント: 件数が少ないため個別に内積を計算
+            for slot in range(self._main_size, n_slots):
+                if not self._alive[slot]:
+                    continue
+                indices, tf = self._slot_terms[slot]
+                _, q_pos, d_pos = np.intersect1d(q_indices, indices, assume_unique=True, return_indices=True)
+                if len(q_pos):
+                    dots[slot] = float(np.sum(q_weights[q_pos] * self._idf[indices[d_pos]] * tf[d_pos]))
+
+            norms, alive, store_codes, months = self._get_slot_arrays()
+            scores = np.zeros(n_slots, dtype=np.float64)
+            scores[alive] = dots[alive] / (norms[alive] * q_norm)
+
+            if exclude_key is not None and exclude_key in self._key_to_slot:
+                scores[self._key_to_slot[exclude_key]] = 0.0
+
+            candidates = np.flatnonzero(scores > 0)
+            if len(candidates) == 0:
+                return []
+            factors = np.ones(len(candidates), dtype=np.float64)
+            if store_name in self._store_codes:
+                factors += STORE_BOOST * (store_codes[candidates] == self._store_codes[store_name])
+            if month:
+                # 月の差（12月と1月は隣接として扱う）。月が不明なケース（0）は対象外
+                diff = np.abs(months[candidates] - month) % 12
+                distance = np.minimum(diff, 12 - diff)
+                known = months[candidates] > 0
+                factors += SEASON_BOOST * ((distance == 0) & known)
+                factors += (SEASON_BOOST / 2) * ((distance == 1) & known)
+            boosted = scores[candidates] * factors
+
+            if len(candidates) > top_k:
+                top = np.argpartition(-boosted, top_k - 1)[:top_k]
+            else:
+                top = np.arange(len(candidates))
+            top = top[np.argsort(-boosted[top], kind='stable')]
+            return [(float(boosted[i]), self._slot_meta[candidates[i]]) for i in top]
@@ -0,0 +1,160 @@
+"""
+レポート生成のストリーミング表示
+AIの応答（JSON）を受信した分から逐次解析し、動向の途中までの文章と、書き終わった要因・質問を取り出す機能群
+"""
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+# 応答をストリーミングで受信するかどうか（0で従来どおり応答全体を待つ）
+OPENAI_STREAMING = os.getenv('OPENAI_STREAMING', '1') != '0'
+# 途中経過を画面に反映する最短間隔（秒）。要因・質問が1件書き終わった場合は間隔に関わらず反映する
+STREAM_RENDER_INTERVAL_SECONDS = float(os.getenv('STREAM_RENDER_INTERVAL_SECONDS', '0.1'))
+
+# 途中経過として取り出す項目（文字列は途中まで、リストは書き終わった要素のみ）
+STREAM_TEXT_FIELDS = ('trend',)
+STREAM_LIST_FIELDS = ('factors', 'questions')
+
+_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f', '"': '"', '\\': '\\', '/': '/'}
+
+
+class PartialReportParser:
+    """AIの応答のJSONを受信した断片ごとに解析するクラス
+
+    最上位のオブジェクトの文字列値（動向）は受信した文字まで、配列の値（要因・質問）は閉じた文字列の要素のみを
+    partial に反映する。前後の ```json のような余分な文字は無視する。断片は1文字ずつ一度だけ走査するため、
+    応答全体の解析にかかる時間は応答の長さに比例する。
+    """
+
+    def __init__(self):
+        self.partial: Dict[str, Any] = {field: '' for field in STREAM_TEXT_FIELDS}
+        self.partial.update({field: [] for field in STREAM_LIST_FIELDS})
+        # 括弧の深さ（最上位のオブジェクトの中が1）
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        # \uXXXX の16進数（読み取り中のみ文字列）
+        self._unicode: Optional[str] = None
+        self._high_surrogate: Optional[int] = None
+        self._chars: List[str] = []
+        # 最上位のオブジェクトで、次の文字列がキーかどうかと、現在の値のキー
+        self._expect_key = True
+        self._key: Optional[str] = None
+        self._array_key: Optional[str] = None
+
+    def feed(self, text: str) -> bool:
+        """受信した断片を解析し、partial の要因・質問の件数が増えたかどうかを返す"""
+        completed = False
+        for char in text:
+            if self._in_string:
+                completed = self._feed_string_char(char) or completed
+                continue
+            if char == '"':
+                self._in_string = True
+                self._chars = []
+            elif char in '{[':
+                self._depth += 1
+                if char == '[' and self._depth == 2 and self._key in STREAM_LIST_FIELDS:
+                    self._array_key = self._key
+            elif char in '}]':
+                if char == ']' and self._depth == 2:
+                    self._array_key = None
+                self._depth -= 1
+            elif self._depth == 1 and char == ':':
+                self._expect_key = False
+            elif self._depth == 1 and char == ',':
+                self._expect_key = True
+                self._key = None
+        return completed
+
+    def _feed_string_char(self, char: str) -> bool:
+        """文字列の中の1文字を解析し、配列の要素の文字列が閉じたかどうかを返す"""
+        if self._unicode is not None:
+            self._unicode += char
+            if len(self._unicode) == 4:
+                try:
+                    code = int(self._unicode, 16)
+                except ValueError:
+                    code = 0xFFFD
+                self._unicode = None
+                if 0xD800 <= code < 0xDC00:
+                    self._high_surrogate = code
+                    return False
+                if 0xDC00 <= code < 0xE000 and self._high_surrogate is not None:
+                    code = 0x10000 + ((self._high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+                self._high_surrogate = None
+                self._append_char(chr(code))
+            return False
+        if self._escape:
+            self._escape = False
+            if char == 'u':
+                self._unicode = ''
+            else:
+                self._append_char(_ESCAPES.get(char, char))
+            return False
+        if char == '\\':
+            self._escape = True
+            return False
+        if char != '"':
+            self._append_char(char)
+            return False
+
+        # 文字列の終わり
+        self._in_string = False
+        value = ''.join(self._chars)
+        if self._depth == 1 and self._expect_key:
+            self._key = value
+            return False
+        if self._depth == 2 and self._array_key is not None:
+            self.partial[self._array_key].append(value.strip())
+            return True
+        return False
+
+    def _append_char(self, char: str):
+        self._chars.append(char)
+        # 最上位のオブジェクトの文字列値（動向）は閉じる前から反映する
+        if self._depth == 1 and not self._expect_key and self._key in STREAM_TEXT_FIELDS:
+            self.partial[self._key] += char
+
+
+class StreamProgress:
+    """受信した断片を解析し、途中経過をコールバックに渡す頻度を間引くクラス"""
+
+    def __init__(self, on_progress: Callable[[Dict], None], interval_seconds: float = STREAM_RENDER_INTERVAL_SECONDS):
+        self.on_progress = on_progress
+        self.interval_seconds = interval_seconds
+        self.parser = PartialReportParser()
+        self._chunks: List[str] = []
+        self._last_rendered = 0.0
+        self._pending = False
+        self.first_chunk_seconds: Optional[float] = None
+        self._started = time.monotonic()
+
+    def feed(self, text: str):
+        if not text:
+            return
+        if self.first_chunk_seconds is None:
+            self.first_chunk_seconds = time.monotonic() - self._started
+        self._chunks.append(text)
+        completed = self.parser.feed(text)
+        self._pending = True
+        now = time.monotonic()
+        if completed or now - self._last_rendered >= self.interval_seconds:
+            self._emit(now)
+
+    def finish(self) -> str:
+        """残りの途中経過を反映し、受信した応答全体を返す"""
+        if self._pending:
+            self._emit(time.monotonic())
+        return ''.join(self._chunks)
+
+    def _emit(self, now: float):
+        self._last_rendered = now
+        self._pending = False
+        partial = {field: list(value) if isinstance(value, list) else value
+                   for field, value in self.parser.partial.items()}
+        try:
+            self.on_progress(partial)
+        except Exception as e:
+            # 表示の失敗で生成自体を止めない
+            print(f"途中経過の表示エラー: {str(e)}")
@@ -0,0 +1,127 @@
+"""
+同一プロセス内の同期バス
+同じサーバープロセスで動作するセッション間で、フィールドの変更をデータベースを介さずに受け渡す機能群
+（複数のサーバープロセスで動作する場合の変更は、データベースのedit_logから取得する）
+"""
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+# (店舗名, 月曜日)
+BusKey = Tuple[str, str]
+# (field_type, field_key)
+FieldKey = Tuple[str, str]
+
+
+class SyncBus:
+    """店舗・週ごとの変更を購読中のセッションに配信するクラス
+
+    配信待ちの変更はフィールドごとに最新の1件（変更連番が最大のもの）だけを保持するため、
+    受け取られないままの購読でもメモリ使用量はフィールド数で頭打ちになる。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (店舗名, 月曜日) -> 購読者ID -> {(field_type, field_key): 変更}
+        self._queues: Dict[BusKey, Dict[str, Dict[FieldKey, Dict[str, Any]]]] = {}
+        # (購読者ID, 店舗名, 月曜日) -> 最後に受け取った時刻（長時間受け取られない購読の削除に使用）
+        self._last_drained: Dict[Tuple[str, str, str], float] = {}
+        self.published_count = 0
+        self.delivered_count = 0
+
+    def subscribe(self, subscriber_id: str, store_name: str, monday_date: str):
+        """購読を開始（以降に発行された変更が配信される）"""
+        with self._lock:
+            self._queues.setdefault((store_name, monday_date), {}).setdefault(subscriber_id, {})
+            self._last_drained[(subscriber_id, store_name, monday_date)] = time.monotonic()
+
+    def unsubscribe(self, subscriber_id: str, store_name: Optional[str] = None, monday_date: Optional[str] = None):
+        """購読を解除（店舗・週を省略した場合は購読者の全ての購読）"""
+        with self._lock:
+            for bus_key in list(self._queues):
+                if (store_name is None or bus_key[0] == store_name) and (monday_date is None or bus_key[1] == monday_date):
+                    self._remove(subscriber_id, bus_key)
+
+    def _remove(self, subscriber_id: str, bus_key: BusKey):
+        """購読を削除（呼び出し元で self._lock を取得済みであること）"""
+        subscribers = self._queues.get(bus_key)
+        if subscribers is None:
+            return
+        subscribers.pop(subscriber_id, None)
+        self._last_drained.pop((subscriber_id,) + bus_key, None)
+        if not subscribers:
+            del self._queues[bus_key]
+
+    def publish(self, store_name: str, monday_date: str, change: Dict[str, Any]):
+        """変更を購読中のセッションに配信（変更したセッション自身には配信しない）
+
+        change: {'field_type', 'field_key', 'value', 'updated', 'session', 'seq', 'base_seq'}
+        """
+        field = (change['field_type'], change['field_key'])
+        with self._lock:
+            self.published_count += 1
+            for subscriber_id, queue in self._queues.get((store_name, monday_date), {}).items():
+                if subscriber_id == change['session']:
+                    continue
+                queued = queue.get(field)
+                if queued is None or queued['seq'] < change['seq']:
+                    queue[field] = change
+
+    def has_pending(self, subscriber_id: str, store_name: str, monday_date: str) -> bool:
+        """配信待ちの変更があるかどうか"""
+        with self._lock:
+            return bool(self._queues.get((store_name, monday_date), {}).get(subscriber_id))
+
+    def drain(self, subscriber_id: str, store_name: str, monday_date: str) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        """配信待ちの変更を取り出す
+
+        戻り値: {field_type: {field_key: {'value', 'updated', 'session', 'seq', 'base_seq'}}}
+        """
+        with self._lock:
+            subscribers = self._queues.get((store_name, monday_date))
+            if subscribers is None or subscriber_id not in subscribers:
+                return {}
+            queue, subscribers[subscriber_id] = subscribers[subscriber_id], {}
+            self._last_drained[(subscriber_id, store_name, monday_date)] = time.monotonic()
+            self.delivered_count += len(queue)
+
+        result = {}
+        for (field_type, field_key), change in queue.items():
+            result.setdefault(field_type, {})[field_key] = {
+                'value': change['value'],
+                'updated': change['updated'],
+                'session': change['session'],
+                'seq': change['seq'],
+                'base_seq': change.get('base_seq')
+            }
+        return result
+
+    def prune(self, idle_seconds: float) -> int:
+        """一定時間受け取られていない購読（終了したセッション）を削除し、削除した件数を返す"""
+        cutoff = time.monotonic() - idle_seconds
+        with self._lock:
+            stale = [key for key, drained_at in self._last_drained.items() if drained_at < cutoff]
+            for subscriber_id, store_name, monday_date in stale:
+                self._remove(subscriber_id, (store_name, monday_date))
+        return len(stale)
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'subscriptions': len(self._last_drained),
+                'published': self.published_count,
+                'delivered': self.delivered_count
+            }
+
+
+_bus: Optional[SyncBus] = None
+_bus_lock = threading.Lock()
+
+
+def get_sync_bus() -> SyncBus:
+    """プロセス全体で共有するSyncBusを取得"""
+    global _bus
+    with _bus_lock:
+        if _bus is None:
+            _bus = SyncBus()
+        return _bus
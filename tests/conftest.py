@@ -0,0 +1,20 @@
+"""
+テスト共通の設定
+リポジトリ直下のモジュールをimportできるようにし、一時データベースのフィクスチャを提供する
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db_connection import close_connection_manager  # noqa: E402
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    """テストごとの一時データベースファイルのパス（終了時に共有の接続管理を破棄する）"""
+    path = str(tmp_path / 'apparel_reports.db')
+    yield path
+    close_connection_manager(path)
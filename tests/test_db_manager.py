@@ -0,0 +1,192 @@
+"""db_manager.py（週次レポートの保存・取得）のテスト"""
+from datetime import date, timedelta
+
+import pytest
+
+from db_manager import DBManager
+
+MONDAY = '2025-01-06'
+
+
+@pytest.fixture
+def manager(db_path):
+    return DBManager(db_path)
+
+
+@pytest.fixture
+def store_id(manager):
+    return manager.get_store_id_by_name('RAY')
+
+
+def test_save_with_version_detects_conflicts(manager, store_id):
+    created = manager.save_week_changes(store_id, MONDAY, {'topics': '初売り'}, expected_version=0)
+    assert (created['version'], created['created'], created['conflict']) == (1, True, False)
+
+    updated = manager.save_week_changes(store_id, MONDAY, {'topics': '初売り好調'}, expected_version=1)
+    assert (updated['version'], updated['conflict']) == (2, False)
+    assert manager.save_conflict_count == 0
+
+    # 他の端末がバージョン1を元に保存（既にバージョン2のため競合）
+    stale = manager.save_week_changes(store_id, MONDAY, {'impact_day': '1/11 セール'}, expected_version=1)
+    assert stale['conflict'] is True
+    assert stale['version'] == 3
+    assert manager.save_conflict_count == 1
+    # 変更した項目のみを最新の行に適用し、他の端末の保存内容は残す
+    report = manager.get_weekly_report(store_id, MONDAY)
+    assert report['topics'] == '初売り好調'
+    assert report['impact_day'] == '1/11 セール'
+    assert stale['report']['version'] == 3
+
+
+def test_conflict_without_rebase_does_not_save(manager, store_id):
+    manager.save_week_changes(store_id, MONDAY, {'topics': 'A'}, expected_version=0)
+    manager.save_week_changes(store_id, MONDAY, {'topics': 'B'}, expected_version=1)
+    result = manager.save_week_changes(store_id, MONDAY, {'topics': 'C'}, expected_version=1, rebase_on_conflict=False)
+    assert result['conflict'] is True
+    assert result['report']['topics'] == 'B'
+    assert manager.get_weekly_report(store_id, MONDAY)['topics'] == 'B'
+    assert manager.save_conflict_count == 1
+
+
+def test_save_without_version_is_not_counted(manager, store_id):
+    manager.save_week_changes(store_id, MONDAY, {'topics': 'A'}, expected_version=0)
+    result = manager.save_week_changes(store_id, MONDAY, {'topics': 'B'})
+    assert result['conflict'] is False
+    assert result['version'] == 2
+    assert manager.save_conflict_count == 0
+
+
+def test_daily_only_change_bumps_version(manager, store_id):
+    manager.save_week_changes(store_id, MONDAY, {'topics': 'A'}, expected_version=0)
+    result = manager.save_week_changes(
+        store_id, MONDAY, daily_updates={'2025-01-07': {'trend': '雨天で客数減', 'factors': ['雨']}}, expected_version=1
+    )
+    assert result['version'] == 2
+    # 日次のみの保存でも、古いバージョンを元にした保存は競合になる
+    assert manager.save_week_changes(store_id, MONDAY, {'topics': 'B'}, expected_version=1)['conflict'] is True
+    assert manager.get_weekly_report(store_id, MONDAY)['daily_reports']['2025-01-07'] == {'trend': '雨天で客数減', 'factors': ['雨']}
+
+
+def _create_weeks(manager):
+    """4店舗×7週の28件を、週・IDの順序が一致しない順で作成（3件に1件はAI生成済み、4件に1件は修正済み）"""
+    store_ids = [manager.get_store_id_by_name(name) for name in ('RNG', 'RAY', 'ROS', 'RSJ')]
+    mondays = [(date(2025, 1, 6) + timedelta(weeks=week)).isoformat() for week in (3, 0, 6, 1, 5, 2, 4)]
+    for i, (monday, store_id) in enumerate((monday, store_id) for monday in mondays for store_id in store_ids):
+        fields = {'topics': f'{i}件目'}
+        if i % 3 == 0:
+            fields['generated_report'] = {'trend': f'{i}件目の動向', 'factors': [], 'questions': []}
+        if i % 4 == 0:
+            fields['modified_report'] = {'trend': f'{i}件目の修正', 'factors': [], 'questions': []}
+        manager.upsert_weekly_report(store_id, monday, fields)
+
+
+def _list_all_pages(manager, limit, **filters):
+    """次ページのカーソルがなくなるまで一覧を取得し、(ページごとの件数, 全件) を返す"""
+    page_sizes, reports, cursor = [], [], None
+    while True:
+        page, cursor = manager.list_weekly_reports(cursor=cursor, limit=limit, **filters)
+        page_sizes.append(len(page))
+        reports.extend(page)
+        if cursor is None:
+            return page_sizes, reports
+
+
+def _keys(reports):
+    return [(report['monday_date'], report['id']) for report in reports]
+
+
+def test_list_weekly_reports_pages_through_all_rows(manager):
+    _create_weeks(manager)
+    page_sizes, reports = _list_all_pages(manager, 3)
+    assert page_sizes == [3] * 9 + [1]
+    keys = _keys(reports)
+    # 重複・欠落なく、(週, ID) の新しい順
+    assert len(set(keys)) == 28
+    assert keys == sorted(keys, reverse=True)
+    assert keys == _keys(manager.list_weekly_reports(limit=100)[0])
+    # 同じ週の4店舗がページをまたいでもIDで続きから取得できる
+    assert len({monday for monday, _ in keys}) == 7
+
+
+def test_list_weekly_reports_last_page_has_no_cursor(manager):
+    _create_weeks(manager)
+    reports, cursor = manager.list_weekly_reports(limit=28)
+    assert len(reports) == 28 and cursor is None
+    reports, cursor = manager.list_weekly_reports(limit=27)
+    assert cursor == (reports[-1]['monday_date'], reports[-1]['id'])
+    assert len(manager.list_weekly_reports(cursor=cursor, limit=27)[0]) == 1
+
+
+def test_list_weekly_reports_filters_with_cursor(manager):
+    _create_weeks(manager)
+    everything = manager.list_weekly_reports(limit=100)[0]
+
+    page_sizes, generated = _list_all_pages(manager, 3, has_generated=True)
+    assert page_sizes == [3, 3, 3, 1]
+    assert all(report['has_generated'] for report in generated)
+    assert _keys(generated) == _keys(report for report in everything if report['has_generated'])
+
+    _, unmodified = _list_all_pages(manager, 4, has_generated=True, has_modified=False)
+    assert _keys(unmodified) == _keys(
+        report for report in everything if report['has_generated'] and not report['has_modified']
+    )
+
+    ray = manager.get_store_id_by_name('RAY')
+    _, ray_recent = _list_all_pages(manager, 2, store_id=ray, date_from='2025-01-20')
+    assert [report['monday_date'] for report in ray_recent] == ['2025-02-17', '2025-02-10', '2025-02-03', '2025-01-27', '2025-01-20']
+    assert {report['store_name'] for report in ray_recent} == {'RAY'}
+
+
+def _minutes_ago(manager, minutes):
+    return manager._get_connection().execute("SELECT datetime('now', ?)", (f'{-minutes} minutes',)).fetchone()[0]
+
+
+def _backdate(manager, table, column, value, minutes):
+    manager._get_connection().execute(
+        f'UPDATE {table} SET created_at = ? WHERE {column} = ?', (_minutes_ago(manager, minutes), value)
+    )
+
+
+def _restore(manager, store_id, minutes):
+    state = manager.get_week_inputs_as_of(store_id, MONDAY, _minutes_ago(manager, minutes))
+    if state is None:
+        return None
+    return state['daily_reports'].get('2025-01-07', {}).get('trend', ''), state['topics']
+
+
+def _latest_checkpoint_id(manager):
+    return manager._get_connection().execute('SELECT MAX(id) FROM edit_checkpoints').fetchone()[0]
+
+
+def test_restore_week_inputs_as_of(manager, store_id):
+    edit_log = manager.edit_log
+    seq, _ = edit_log.append('s1', 'RAY', MONDAY, 'daily_trend', '2025-01-07', 'v1')
+    _backdate(manager, 'edit_log', 'seq', seq, 60)
+    manager.compact_edit_log()
+    _backdate(manager, 'edit_checkpoints', 'id', _latest_checkpoint_id(manager), 59)
+    seq, _ = edit_log.append('s1', 'RAY', MONDAY, 'daily_trend', '2025-01-07', 'v2')
+    _backdate(manager, 'edit_log', 'seq', seq, 40)
+    seq, _ = edit_log.append('s1', 'RAY', MONDAY, 'topics', 'topics', 'T')
+    _backdate(manager, 'edit_log', 'seq', seq, 30)
+    # 前回のチェックポイントから一定時間が経っているため、反映前の状態をチェックポイントとして記録する
+    manager.compact_edit_log()
+    _backdate(manager, 'edit_checkpoints', 'id', _latest_checkpoint_id(manager), 25)
+    seq, _ = edit_log.append('s1', 'RAY', MONDAY, 'daily_trend', '2025-01-07', '')
+    _backdate(manager, 'edit_log', 'seq', seq, 10)
+
+    assert _restore(manager, store_id, 61) == ('', '')
+    assert _restore(manager, store_id, 50) == ('v1', '')
+    assert _restore(manager, store_id, 35) == ('v2', '')
+    assert _restore(manager, store_id, 20) == ('v2', 'T')
+    assert _restore(manager, store_id, 5) == ('', 'T')
+
+    # 保持期間（20分）より前の時刻は、復元の起点が削除されるため復元できない
+    manager.edit_log.truncate(retention_seconds=20 * 60)
+    assert _restore(manager, store_id, 50) is None
+    assert _restore(manager, store_id, 20) == ('v2', 'T')
+
+
+def test_restore_includes_explicit_saves(manager, store_id):
+    manager.edit_log.append('s1', 'RAY', MONDAY, 'topics', 'topics', '入力中')
+    manager.save_week_changes(store_id, MONDAY, {'topics': '保存済み'}, expected_version=0)
+    assert _restore(manager, store_id, -1) == ('', '保存済み')
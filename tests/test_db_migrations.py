@@ -0,0 +1,71 @@
+"""db_migrations.py（スキーママイグレーションの適用）のテスト"""
+import os
+import shutil
+import sqlite3
+import threading
+
+from db_connection import get_connection_manager
+from db_migrations import MIGRATIONS, apply_migrations, get_schema_version
+
+REPO_DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'apparel_reports.db')
+
+
+def _table_names(conn):
+    return {row['name'] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def test_versions_are_sequential():
+    assert [version for version, _, _ in MIGRATIONS] == list(range(1, len(MIGRATIONS) + 1))
+
+
+def test_apply_to_new_database(db_path):
+    assert apply_migrations(db_path) == [version for version, _, _ in MIGRATIONS]
+    conn = get_connection_manager(db_path).get_connection()
+    assert get_schema_version(conn) == MIGRATIONS[-1][0]
+    tables = _table_names(conn)
+    assert {'stores', 'weekly_reports', 'daily_entries', 'edit_log', 'edit_checkpoints', 'llm_response_cache'} <= tables
+    # 置き換え済みの同期テーブルは残らない
+    assert 'realtime_data' not in tables
+    assert 'sync_sequence' not in tables
+    assert [row['name'] for row in conn.execute('SELECT name FROM stores ORDER BY id')] == ['RAY', 'RSJ', 'ROS', 'RNG']
+
+
+def test_apply_is_idempotent(db_path):
+    apply_migrations(db_path)
+    assert apply_migrations(db_path) == []
+    conn = get_connection_manager(db_path).get_connection()
+    assert conn.execute('SELECT COUNT(*) FROM schema_version').fetchone()[0] == len(MIGRATIONS)
+
+
+def test_concurrent_apply_runs_each_migration_once(db_path):
+    results = []
+    errors = []
+
+    def run():
+        try:
+            results.append(apply_migrations(db_path))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    applied = sorted(version for versions in results for version in versions)
+    assert applied == [version for version, _, _ in MIGRATIONS]
+
+
+def test_upgrade_unmanaged_database_keeps_data(db_path):
+    # スキーマ管理の導入前に作成されたデータベース（リポジトリ同梱のもの）のコピーを移行する
+    shutil.copyfile(REPO_DB_PATH, db_path)
+    legacy = sqlite3.connect(db_path)
+    report_count = legacy.execute('SELECT COUNT(*) FROM weekly_reports').fetchone()[0]
+    legacy.close()
+
+    assert apply_migrations(db_path)[0] == 1
+    conn = get_connection_manager(db_path).get_connection()
+    assert get_schema_version(conn) == MIGRATIONS[-1][0]
+    assert conn.execute('SELECT COUNT(*) FROM weekly_reports').fetchone()[0] == report_count
+    assert 'realtime_data' not in _table_names(conn)
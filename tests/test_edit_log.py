@@ -0,0 +1,111 @@
+"""edit_log.py（編集ログの追記・週次レポートへの反映・削除）のテスト"""
+import json
+
+import pytest
+
+from db_manager import DBManager
+from edit_log import EditLogCompactor, apply_edits, fold_edits
+
+STORE = 'RAY'
+MONDAY = '2025-01-06'
+
+
+@pytest.fixture
+def manager(db_path):
+    return DBManager(db_path)
+
+
+def _edit(seq, field_type, field_key, value):
+    return {'seq': seq, 'field_type': field_type, 'field_key': field_key, 'field_value': value}
+
+
+def _backdate(manager, table, minutes):
+    manager._get_connection().execute(f"UPDATE {table} SET created_at = datetime('now', ?)", (f'-{minutes} minutes',))
+
+
+def test_fold_edits_keeps_last_value_per_field():
+    fields, daily = fold_edits([
+        _edit(1, 'topics', 'topics', 'A'),
+        _edit(2, 'daily_trend', '2025-01-07', '雨'),
+        _edit(3, 'topics', 'topics', 'B'),
+        _edit(4, 'daily_factors', '2025-01-07', json.dumps(['雨天'])),
+        _edit(5, 'generated_report', 'generated_report', '{壊れたJSON'),
+    ])
+    assert fields == {'topics': 'B', 'generated_report': {}}
+    assert daily == {'2025-01-07': {'trend': '雨', 'factors': ['雨天']}}
+
+
+def test_apply_edits_updates_only_changed_days():
+    report = {'topics': 'A', 'daily_reports': {'2025-01-07': {'trend': '晴れ', 'factors': ['晴天']}}}
+    apply_edits(report, [_edit(1, 'daily_trend', '2025-01-07', '雨'), _edit(2, 'daily_trend', '2025-01-08', '曇り')])
+    assert report['daily_reports'] == {
+        '2025-01-07': {'trend': '雨', 'factors': ['晴天']},
+        '2025-01-08': {'trend': '曇り', 'factors': []},
+    }
+    assert report['topics'] == 'A'
+
+
+def test_unapplied_edits_are_visible_before_compaction(manager):
+    store_id = manager.get_store_id_by_name(STORE)
+    manager.edit_log.append('s1', STORE, MONDAY, 'topics', 'topics', '初売り')
+    manager.edit_log.append('s1', STORE, MONDAY, 'daily_trend', '2025-01-07', '雨天')
+    assert manager.get_weekly_report(store_id, MONDAY)['topics'] == '初売り'
+    assert manager.get_weekly_report(store_id, MONDAY, include_edit_log=False) == {}
+    assert manager.edit_log.get_pending_weeks() == [(STORE, MONDAY)]
+
+
+def test_compaction_writes_snapshot_without_changing_version(manager):
+    store_id = manager.get_store_id_by_name(STORE)
+    manager.edit_log.append('s1', STORE, MONDAY, 'topics', 'topics', 'A')
+    last_seq, _ = manager.edit_log.append('s1', STORE, MONDAY, 'topics', 'topics', 'B')
+    manager.edit_log.append('s1', STORE, MONDAY, 'daily_trend', '2025-01-07', '雨天')
+    result = manager.compact_edit_log()
+    assert (result['weeks'], result['edits']) == (1, 3)
+
+    snapshot = manager.get_weekly_report(store_id, MONDAY, include_edit_log=False)
+    assert snapshot['topics'] == 'B'
+    assert snapshot['daily_reports']['2025-01-07']['trend'] == '雨天'
+    assert snapshot['snapshot_seq'] == last_seq + 1
+    # 明示的な保存がまだない週はバージョン0のまま
+    assert snapshot['version'] == 0
+    assert manager.edit_log.get_pending_weeks() == []
+    assert manager.compact_edit_log()['edits'] == 0
+
+
+def test_changes_since_skips_own_session_but_advances_seq(manager):
+    first, _ = manager.edit_log.append('s1', STORE, MONDAY, 'topics', 'topics', 'A')
+    second, _ = manager.edit_log.append('s2', STORE, MONDAY, 'impact_day', 'impact_day', 'B')
+    changes, last_seq = manager.edit_log.get_changes_since(STORE, MONDAY, 0, exclude_session='s1')
+    assert last_seq == second
+    assert list(changes) == ['impact_day']
+    assert changes['impact_day']['impact_day']['value'] == 'B'
+    assert manager.edit_log.get_changes_since(STORE, MONDAY, last_seq) == ({}, last_seq)
+
+
+def test_truncate_keeps_edits_needed_for_restore(manager):
+    manager.edit_log.append('s1', STORE, MONDAY, 'topics', 'topics', 'A')
+    manager.compact_edit_log()  # 記録開始前の状態（連番0）のチェックポイント
+    _backdate(manager, 'edit_checkpoints', 20)
+    second, _ = manager.edit_log.append('s1', STORE, MONDAY, 'topics', 'topics', 'B')
+    manager.compact_edit_log()  # 1件目までを含むチェックポイント
+    # ここまでの記録を保持期間より前のものとして扱う
+    _backdate(manager, 'edit_log', 60 * 25)
+    _backdate(manager, 'edit_checkpoints', 60 * 25)
+    third, _ = manager.edit_log.append('s1', STORE, MONDAY, 'topics', 'topics', 'C')
+
+    # 保持期間より前の最新のチェックポイントに含まれるログと、それより古いチェックポイントのみ削除する
+    assert manager.edit_log.truncate() == 1
+    assert [edit['seq'] for edit in manager.edit_log.get_tail(STORE, MONDAY, 0)] == [second, third]
+    checkpoints = manager._get_connection().execute('SELECT seq FROM edit_checkpoints').fetchall()
+    assert [row['seq'] for row in checkpoints] == [second - 1]
+
+
+def test_compactor_run_once_accumulates_totals(manager):
+    compactor = EditLogCompactor(manager, interval_seconds=3600)
+    manager.edit_log.append('s1', STORE, MONDAY, 'topics', 'topics', 'A')
+    manager.edit_log.append('s1', 'RSJ', MONDAY, 'topics', 'topics', 'B')
+    assert compactor.run_once()['weeks'] == 2
+    assert compactor.run_once()['weeks'] == 0
+    stats = compactor.get_stats()
+    assert stats['runs'] == 2
+    assert stats['total']['edits'] == 2
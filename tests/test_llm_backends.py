@@ -0,0 +1,99 @@
+"""llm_backends.py（AI呼び出しのバックエンドとスタブ）のテスト"""
+import json
+
+import openai
+import pytest
+
+from llm_backends import LLMBackend, LLMBackendError, OpenAIBackend, StubBackend, start_stub_server
+
+MESSAGES = [{'role': 'system', 'content': 'system'}, {'role': 'user', 'content': 'RAY店 1/6週のデータ'}]
+
+
+def _stub(**kwargs):
+    options = {'latency_seconds': 0, 'first_token_seconds': 0}
+    options.update(kwargs)
+    return StubBackend(**options)
+
+
+def test_backend_is_abstract():
+    with pytest.raises(TypeError):
+        LLMBackend('model')
+
+
+def test_stub_is_deterministic_and_streams_the_same_text():
+    backend = _stub()
+    text = backend.complete(MESSAGES, 0.7, 1000, 10)
+    assert text == _stub().complete(MESSAGES, 0.7, 1000, 10)
+    assert text != backend.complete(MESSAGES[:1], 0.7, 1000, 10)
+    assert ''.join(backend.stream(MESSAGES, 0.7, 1000, 10)) == text
+    report = json.loads(text)
+    assert report['trend'] and len(report['factors']) == 3
+    stats = backend.get_stats()
+    assert (stats['backend'], stats['requests'], stats['streams']) == ('stub', 3, 1)
+    assert stats['total_tokens'] == stats['prompt_tokens'] + stats['completion_tokens'] > 0
+
+
+def test_stub_uses_canned_responses():
+    backend = _stub(responses=[{'trend': '固定の応答', 'factors': [], 'questions': []}])
+    assert json.loads(backend.complete(MESSAGES, 0.7, 1000, 10))['trend'] == '固定の応答'
+
+
+def test_stub_errors_are_seeded():
+    def outcomes():
+        backend = _stub(error_rate=0.5, error_status=429, seed=7)
+        results = []
+        for _ in range(20):
+            try:
+                backend.complete(MESSAGES, 0.7, 1000, 10)
+                results.append('ok')
+            except LLMBackendError as e:
+                assert e.status_code == 429
+                results.append('error')
+        return results
+
+    first = outcomes()
+    assert first == outcomes()
+    assert 'ok' in first and 'error' in first
+
+
+def test_cache_namespace_includes_base_url():
+    assert OpenAIBackend('sk-test', base_url=None).cache_namespace == 'openai|'
+    assert OpenAIBackend('sk-test', base_url='http://127.0.0.1:8765/v1').cache_namespace == 'openai|http://127.0.0.1:8765/v1'
+    assert _stub().cache_namespace == 'stub'
+
+
+@pytest.fixture
+def stub_server():
+    servers = []
+
+    def start(backend):
+        server, base_url = start_stub_server(backend)
+        servers.append(server)
+        return base_url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_openai_backend_against_stub_server(stub_server):
+    stub = _stub()
+    base_url = stub_server(stub)
+    backend = OpenAIBackend('sk-stub', model='stub', base_url=base_url)
+    backend.validate()
+    text = backend.complete(MESSAGES, 0.7, 1000, 10)
+    assert text == stub.complete(MESSAGES, 0.7, 1000, 10)
+    assert ''.join(backend.stream(MESSAGES, 0.7, 1000, 10)) == text
+    stats = backend.get_stats()
+    assert (stats['requests'], stats['streams'], stats['errors']) == (2, 1, 0)
+    # 使用トークン数は通常の応答・ストリーミングの両方で受け取る
+    assert stats['prompt_tokens'] > 0 and stats['completion_tokens'] > 0
+
+
+def test_stub_server_error_status_maps_to_openai_errors(stub_server):
+    base_url = stub_server(_stub(error_rate=1, error_status=400))
+    backend = OpenAIBackend('sk-stub', model='stub', base_url=base_url)
+    with pytest.raises(openai.BadRequestError):
+        backend.complete(MESSAGES, 0.7, 1000, 10)
+    assert backend.get_stats()['errors'] == 1
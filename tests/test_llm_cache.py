@@ -0,0 +1,90 @@
+"""llm_cache.py（AIの応答キャッシュ）のテスト"""
+import pytest
+
+from db_migrations import apply_migrations
+from llm_cache import LLMResponseCache, build_cache_key, get_llm_response_cache
+
+
+@pytest.fixture
+def cache_db(db_path):
+    apply_migrations(db_path)
+    return db_path
+
+
+def _key(**overrides):
+    args = {'namespace': 'openai|', 'model': 'gpt-4o-mini', 'system_prompt': 'system',
+            'user_prompt': 'RAY店 1/6週', 'temperature': 0.7}
+    args.update(overrides)
+    return build_cache_key(**args)
+
+
+def test_cache_key_covers_every_input():
+    assert _key() == _key()
+    variants = [
+        _key(namespace='openai|http://127.0.0.1:8765/v1'),
+        _key(namespace='stub'),
+        _key(model='gpt-4o'),
+        _key(system_prompt='system2'),
+        _key(user_prompt='RSJ店 1/6週'),
+        _key(temperature=0.2),
+    ]
+    assert len(set(variants + [_key()])) == len(variants) + 1
+
+
+def test_put_and_get_from_memory_and_database(cache_db):
+    cache = LLMResponseCache(cache_db)
+    assert cache.get(_key()) is None
+    cache.put(_key(), 'gpt-4o-mini', '{"trend": "好調"}')
+    assert cache.get(_key()) == '{"trend": "好調"}'
+
+    # 別のプロセス（プロセス内のLRUが空）ではデータベースから取得する
+    other = LLMResponseCache(cache_db)
+    assert other.get(_key()) == '{"trend": "好調"}'
+    assert other.get(_key()) == '{"trend": "好調"}'
+    assert cache.get_stats()['memory_hits'] == 1
+    stats = other.get_stats()
+    assert (stats['db_hits'], stats['memory_hits'], stats['db_entries']) == (1, 1, 1)
+    row = other._connections.get_connection().execute('SELECT hit_count FROM llm_response_cache').fetchone()
+    assert row['hit_count'] == 1
+
+
+def test_expired_responses_are_not_used(cache_db):
+    LLMResponseCache(cache_db).put(_key(), 'gpt-4o-mini', 'old')
+    conn = LLMResponseCache(cache_db)._connections.get_connection()
+    conn.execute("UPDATE llm_response_cache SET created_at = datetime('now', '-2 hours')")
+    cache = LLMResponseCache(cache_db, ttl_seconds=3600)
+    assert cache.get(_key()) is None
+    # 保存時に期限切れの応答を削除する
+    cache.put(_key(user_prompt='other'), 'gpt-4o-mini', 'new')
+    assert cache.get_stats()['evictions'] == 1
+    assert cache.get_stats()['db_entries'] == 1
+
+
+def test_least_recently_used_entries_are_evicted(cache_db):
+    cache = LLMResponseCache(cache_db, max_entries=2)
+    conn = cache._connections.get_connection()
+    for minutes, name in ((3, 'a'), (2, 'b')):
+        cache.put(_key(user_prompt=name), 'gpt-4o-mini', name)
+        conn.execute("UPDATE llm_response_cache SET last_used_at = datetime('now', ?) WHERE response_text = ?",
+                     (f'-{minutes} minutes', name))
+    cache.put(_key(user_prompt='c'), 'gpt-4o-mini', 'c')
+    remaining = {row['response_text'] for row in conn.execute('SELECT response_text FROM llm_response_cache')}
+    assert remaining == {'b', 'c'}
+    assert cache.get_stats()['evictions'] == 1
+
+
+def test_memory_lru_is_bounded(cache_db):
+    cache = LLMResponseCache(cache_db, memory_entries=2)
+    for name in ('a', 'b', 'c'):
+        cache.put(_key(user_prompt=name), 'gpt-4o-mini', name)
+    assert list(cache._memory) == [_key(user_prompt='b'), _key(user_prompt='c')]
+
+
+def test_clear_and_shared_instance(cache_db):
+    cache = get_llm_response_cache(cache_db)
+    assert cache is get_llm_response_cache(cache_db)
+    cache.put(_key(), 'gpt-4o-mini', 'x')
+    cache.record_bypass()
+    assert cache.clear() == 1
+    assert cache.get(_key()) is None
+    assert cache.get_stats()['bypasses'] == 1
@@ -0,0 +1,186 @@
+"""multi_device_support.py（編集ロック・セッションの管理）のテスト"""
+import time
+
+import pytest
+
+from multi_device_support import MultiDeviceManager, SessionJanitor
+
+WEEK = ('RAY', '2025-01-06')
+TOPICS = WEEK + ('topics', 'topics')
+IMPACT_DAY = WEEK + ('impact_day', 'impact_day')
+DAILY = WEEK + ('daily_trend', '2025-01-07')
+
+
+@pytest.fixture
+def manager(db_path):
+    return MultiDeviceManager(db_path)
+
+
+def _lock_row(manager, lock_key):
+    return manager._connections.get_connection().execute(
+        'SELECT session_id, locked_at, expires_at FROM edit_locks '
+        'WHERE store_name = ? AND monday_date = ? AND field_type = ? AND field_key = ?', lock_key
+    ).fetchone()
+
+
+def _set_locked_at(manager, lock_key, locked_at):
+    with manager._connections.transaction() as conn:
+        conn.execute(
+            'UPDATE edit_locks SET locked_at = ? '
+            'WHERE store_name = ? AND monday_date = ? AND field_type = ? AND field_key = ?', (locked_at, *lock_key)
+        )
+
+
+def _trace(manager):
+    """このスレッドの接続で実行したSQL文の一覧（呼び出し以降）"""
+    statements = []
+    manager._connections.get_connection().set_trace_callback(statements.append)
+    return statements
+
+
+def test_lock_is_refused_to_other_sessions(manager):
+    assert manager.acquire_lock('s1', *TOPICS)
+    assert not manager.acquire_lock('s2', *TOPICS)
+    assert _lock_row(manager, TOPICS)['session_id'] == 's1'
+    # 別の入力欄は他のセッションもロックできる
+    assert manager.acquire_lock('s2', *IMPACT_DAY)
+    locks = manager.get_locks(*WEEK)
+    assert {key: lock['session_id'] for key, lock in locks.items()} == {
+        ('topics', 'topics'): 's1', ('impact_day', 'impact_day'): 's2'
+    }
+
+
+def test_expired_lock_can_be_taken_over(manager):
+    assert manager.acquire_lock('s1', *TOPICS, ttl_seconds=0)
+    _set_locked_at(manager, TOPICS, '2025-01-06 09:00:00')
+    assert manager.get_locks(*WEEK) == {}
+    assert manager.acquire_lock('s2', *TOPICS)
+    row = _lock_row(manager, TOPICS)
+    # 奪ったロックは取得時刻も新しくなる
+    assert row['session_id'] == 's2'
+    assert row['locked_at'] != '2025-01-06 09:00:00'
+    assert not manager.acquire_lock('s1', *TOPICS)
+
+
+def test_reacquiring_own_lock_extends_it_and_keeps_locked_at(manager):
+    assert manager.acquire_lock('s1', *TOPICS, ttl_seconds=10)
+    _set_locked_at(manager, TOPICS, '2025-01-06 09:00:00')
+    expires_at = _lock_row(manager, TOPICS)['expires_at']
+    assert manager.acquire_lock('s1', *TOPICS, ttl_seconds=60)
+    row = _lock_row(manager, TOPICS)
+    assert row['locked_at'] == '2025-01-06 09:00:00'
+    assert row['expires_at'] > expires_at
+    # 期限切れ後に自分で取得し直す場合も取得時刻は変わらない
+    assert manager.acquire_lock('s1', *TOPICS, ttl_seconds=0)
+    assert manager.acquire_lock('s1', *TOPICS)
+    assert _lock_row(manager, TOPICS)['locked_at'] == '2025-01-06 09:00:00'
+
+
+def test_renew_locks_extends_only_own_locks_in_one_update(manager):
+    manager.acquire_lock('s1', *TOPICS, ttl_seconds=10)
+    manager.acquire_lock('s1', *DAILY, ttl_seconds=10)
+    manager.acquire_lock('s2', *IMPACT_DAY, ttl_seconds=10)
+    before = {lock_key: _lock_row(manager, lock_key)['expires_at'] for lock_key in (TOPICS, DAILY, IMPACT_DAY)}
+
+    statements = _trace(manager)
+    assert manager.renew_locks('s1', [TOPICS, DAILY, IMPACT_DAY], ttl_seconds=60) == 2
+    updates = [sql for sql in statements if sql.lstrip().startswith('UPDATE')]
+    assert len(updates) == 1 and 'IN (VALUES' in updates[0]
+
+    assert _lock_row(manager, TOPICS)['expires_at'] > before[TOPICS]
+    assert _lock_row(manager, DAILY)['expires_at'] > before[DAILY]
+    # 他のセッションのロックは延長しない
+    assert _lock_row(manager, IMPACT_DAY)['expires_at'] == before[IMPACT_DAY]
+    assert manager.renew_locks('s1', []) == 0
+
+
+def test_release_locks_removes_only_own_locks(manager):
+    manager.acquire_lock('s1', *TOPICS)
+    manager.acquire_lock('s1', *DAILY)
+    manager.acquire_lock('s2', *IMPACT_DAY)
+
+    manager.release_locks('s1', [TOPICS, IMPACT_DAY])
+    assert _lock_row(manager, TOPICS) is None
+    assert _lock_row(manager, IMPACT_DAY)['session_id'] == 's2'
+    assert _lock_row(manager, DAILY)['session_id'] == 's1'
+
+    manager.release_locks('s1', [])
+    assert _lock_row(manager, DAILY) is not None
+    # 省略した場合はセッションの全ロックを解放する
+    manager.release_locks('s1')
+    assert _lock_row(manager, DAILY) is None
+    assert _lock_row(manager, IMPACT_DAY)['session_id'] == 's2'
+
+
+def _session_rows(manager):
+    rows = manager._connections.get_connection().execute('SELECT session_id, store_name FROM active_sessions')
+    return {row['session_id']: row['store_name'] for row in rows}
+
+
+def _backdate_session(manager, session_id, seconds):
+    with manager._connections.transaction() as conn:
+        conn.execute("UPDATE active_sessions SET last_active = datetime('now', ?) WHERE session_id = ?",
+                     (f'-{seconds} seconds', session_id))
+
+
+def test_heartbeats_are_flushed_in_one_write(manager):
+    # 直前に書き込んだ扱いにし、間隔内のアクティビティはメモリ上に溜める
+    manager.flush_heartbeats()
+    statements = _trace(manager)
+    for i in range(20):
+        manager.heartbeat(f's{i % 5}', 'RAY' if i < 15 else 'RSJ')
+    assert statements == []
+    assert _session_rows(manager) == {}
+
+    assert manager.flush_heartbeats() == 5
+    # 1回のトランザクションで5セッション分をまとめて書き込む
+    assert len([sql for sql in statements if sql.startswith('BEGIN')]) == 1
+    assert _session_rows(manager) == {'s0': 'RSJ', 's1': 'RSJ', 's2': 'RSJ', 's3': 'RSJ', 's4': 'RSJ'}
+    assert manager.flush_heartbeats() == 0
+
+
+def test_heartbeat_writes_after_interval(manager, monkeypatch):
+    monkeypatch.setattr('multi_device_support.SESSION_HEARTBEAT_INTERVAL_SECONDS', 0)
+    manager.heartbeat('s1', 'RAY')
+    assert _session_rows(manager) == {'s1': 'RAY'}
+
+
+def test_janitor_removes_expired_sessions_and_locks(manager):
+    active = manager.register_session('RAY', 'active')
+    inactive = manager.register_session('RAY', 'inactive')
+    resumed = manager.register_session('RAY', 'resumed')
+    for session_id in (inactive, resumed):
+        _backdate_session(manager, session_id, 3600)
+    manager.acquire_lock(active, *TOPICS)
+    manager.acquire_lock(inactive, *IMPACT_DAY, ttl_seconds=0)
+    # 削除前に未反映のアクティビティを書き込むため、操作を再開したセッションは残る
+    manager.flush_heartbeats()
+    manager.heartbeat(resumed, 'RSJ')
+
+    janitor = SessionJanitor(manager, interval_seconds=60)
+    removed = janitor.run_once()
+    assert (removed['active_sessions'], removed['edit_locks']) == (1, 1)
+    assert _session_rows(manager) == {active: 'RAY', resumed: 'RSJ'}
+    assert set(manager.get_locks(*WEEK)) == {('topics', 'topics')}
+    assert _lock_row(manager, IMPACT_DAY) is None
+
+    assert janitor.run_once() == {'active_sessions': 0, 'edit_locks': 0, 'sync_bus': 0}
+    stats = janitor.get_stats()
+    assert stats['runs'] == 2
+    assert (stats['total_removed']['active_sessions'], stats['total_removed']['edit_locks']) == (1, 1)
+
+
+def test_janitor_thread_runs_until_stopped(manager):
+    janitor = SessionJanitor(manager, interval_seconds=0.01)
+    janitor.start()
+    try:
+        for _ in range(100):
+            if janitor.runs >= 2:
+                break
+            time.sleep(0.01)
+    finally:
+        janitor.stop()
+        janitor.join(timeout=1)
+    assert janitor.runs >= 2
+    assert not janitor.is_alive()
+    assert janitor.get_stats()['last_error'] is None
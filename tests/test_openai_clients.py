@@ -0,0 +1,71 @@
+"""openai_clients.py（OpenAIクライアントの使い回しとキーの検証結果）のテスト"""
+import time
+
+import openai
+import pytest
+
+from llm_backends import OpenAIBackend, StubBackend, start_stub_server
+from openai_clients import OpenAIClientPool
+
+
+@pytest.fixture
+def base_url():
+    """モデル「stub」のみを提供するスタブサーバーの接続先"""
+    server, url = start_stub_server(StubBackend(model='stub', latency_seconds=0, first_token_seconds=0))
+    yield url
+    server.shutdown()
+    server.server_close()
+
+
+def test_clients_are_reused_per_key_and_base_url():
+    pool = OpenAIClientPool()
+    client = pool.get_client('sk-a')
+    assert pool.get_client('sk-a') is client
+    assert pool.get_client('sk-b') is not client
+    assert pool.get_client('sk-a', 'http://127.0.0.1:8765/v1') is not client
+    stats = pool.get_stats()
+    assert (stats['clients_created'], stats['clients']) == (3, 3)
+
+
+def test_validation_is_cached_until_ttl(base_url):
+    pool = OpenAIClientPool(validation_ttl_seconds=0.2)
+    assert not pool.is_validated('sk-stub', base_url)
+    client = pool.validate('sk-stub', base_url, 'stub')
+    assert pool.validate('sk-stub', base_url, 'stub') is client
+    assert pool.is_validated('sk-stub', base_url)
+    stats = pool.get_stats()
+    assert (stats['validations'], stats['validation_cache_hits']) == (1, 1)
+
+    # 有効期限が切れた後は検証し直す（クライアントは使い回す）
+    time.sleep(0.25)
+    assert not pool.is_validated('sk-stub', base_url)
+    assert pool.validate('sk-stub', base_url, 'stub') is client
+    stats = pool.get_stats()
+    assert (stats['validations'], stats['validation_cache_hits'], stats['clients_created']) == (2, 1, 1)
+
+
+def test_invalidate_forces_revalidation_but_keeps_client(base_url):
+    pool = OpenAIClientPool()
+    client = pool.validate('sk-stub', base_url, 'stub')
+    pool.invalidate('sk-stub', base_url)
+    assert not pool.is_validated('sk-stub', base_url)
+    assert pool.get_client('sk-stub', base_url) is client
+    pool.validate('sk-stub', base_url, 'stub')
+    stats = pool.get_stats()
+    assert (stats['validations'], stats['invalidations'], stats['clients_created']) == (2, 1, 1)
+
+
+def test_validation_uses_the_given_model(base_url):
+    pool = OpenAIClientPool()
+    # 接続先が提供していないモデルでは検証に失敗し、検証結果は記録しない
+    with pytest.raises(openai.NotFoundError):
+        pool.validate('sk-stub', base_url, 'gpt-4o-mini')
+    assert not pool.is_validated('sk-stub', base_url)
+    pool.validate('sk-stub', base_url, 'stub')
+    assert pool.is_validated('sk-stub', base_url)
+
+
+def test_backend_validates_its_own_model(base_url):
+    OpenAIBackend('sk-model-check', model='stub', base_url=base_url).validate()
+    with pytest.raises(openai.NotFoundError):
+        OpenAIBackend('sk-model-check-2', model='gpt-4o-mini', base_url=base_url).validate()
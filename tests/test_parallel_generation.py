@@ -0,0 +1,100 @@
+"""parallel_generation.py（複数店舗の並列生成と流量制限）のテスト"""
+import threading
+import time
+
+import pytest
+
+from parallel_generation import TokenBucket, generate_concurrently, get_openai_rate_limiter
+
+
+def test_token_bucket_allows_burst_then_limits_rate():
+    bucket = TokenBucket(rate_per_second=20, capacity=3)
+    started = time.monotonic()
+    assert [bucket.acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    # 4回目以降は毎秒20回（0.05秒に1回）の割合でしか許可されない
+    for _ in range(3):
+        bucket.acquire()
+    elapsed = time.monotonic() - started
+    assert 0.12 <= elapsed < 1.0
+    stats = bucket.get_stats()
+    assert stats['acquired'] == 6
+    assert stats['requests_per_minute'] == pytest.approx(1200)
+    assert stats['waited_seconds'] > 0
+
+
+def test_token_bucket_without_rate_is_unlimited():
+    # 1分あたりの上限が0以下（OPENAI_REQUESTS_PER_MINUTE=0）の場合は待たずに許可する
+    for rate in (0, -1):
+        bucket = TokenBucket(rate_per_second=rate, capacity=1)
+        started = time.monotonic()
+        assert [bucket.acquire() for _ in range(10)] == [0.0] * 10
+        assert time.monotonic() - started < 0.1
+        stats = bucket.get_stats()
+        assert (stats['acquired'], stats['waited_seconds']) == (10, 0.0)
+
+
+def test_token_bucket_is_shared_across_threads():
+    bucket = TokenBucket(rate_per_second=50, capacity=2)
+    started = time.monotonic()
+    threads = [threading.Thread(target=bucket.acquire) for _ in range(7)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # 2回は即時、残り5回は0.02秒ずつ
+    assert time.monotonic() - started >= 0.09
+    assert bucket.get_stats()['acquired'] == 7
+
+
+def test_get_openai_rate_limiter_is_shared():
+    assert get_openai_rate_limiter() is get_openai_rate_limiter()
+
+
+def test_generate_concurrently_runs_stores_in_parallel():
+    inputs = {store: {'store': store} for store in ('RAY', 'RSJ', 'ROS', 'RNG')}
+
+    def generate(data):
+        time.sleep(0.2)
+        return {'trend': data['store']}
+
+    started = time.monotonic()
+    results = {store: (result, elapsed) for store, result, elapsed in generate_concurrently(generate, inputs, max_workers=4)}
+    assert time.monotonic() - started < 0.6
+    assert {store: result['trend'] for store, (result, _) in results.items()} == {store: store for store in inputs}
+    assert all(elapsed >= 0.2 for _, elapsed in results.values())
+
+
+def test_generate_concurrently_returns_none_for_failed_store():
+    def generate(data):
+        if data['store'] == 'RSJ':
+            raise RuntimeError('boom')
+        return {'trend': 'ok'}
+
+    results = {store: result for store, result, _ in generate_concurrently(generate, {'RAY': {'store': 'RAY'}, 'RSJ': {'store': 'RSJ'}})}
+    assert results == {'RAY': {'trend': 'ok'}, 'RSJ': None}
+
+
+def test_generate_concurrently_reports_progress_on_caller_thread():
+    caller = threading.get_ident()
+    progress = []
+
+    def generate(data, on_progress):
+        for i in range(1, 4):
+            on_progress({'trend': 'x' * i})
+            time.sleep(0.01)
+        return {'trend': 'xxx'}
+
+    def record(store, partial):
+        assert threading.get_ident() == caller
+        progress.append((store, partial['trend']))
+
+    results = list(generate_concurrently(generate, {'RAY': {}, 'RSJ': {}}, on_progress=record))
+    assert sorted(store for store, _, _ in results) == ['RAY', 'RSJ']
+    for store in ('RAY', 'RSJ'):
+        lengths = [len(trend) for name, trend in progress if name == store]
+        # 途中経過は店舗ごとに順番どおり（溜まった分は最新のもののみ）に渡される
+        assert lengths and lengths == sorted(lengths) and lengths[-1] == 3
+
+
+def test_generate_concurrently_with_no_inputs():
+    assert list(generate_concurrently(lambda data: {}, {})) == []
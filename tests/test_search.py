@@ -0,0 +1,88 @@
+"""db_manager.py の全文検索（search_reports・一覧のキーワード絞り込み）のテスト"""
+import pytest
+
+from db_manager import DBManager
+
+
+@pytest.fixture
+def manager(db_path):
+    manager = DBManager(db_path)
+    ray = manager.get_store_id_by_name('RAY')
+    rsj = manager.get_store_id_by_name('RSJ')
+    manager.upsert_weekly_report(ray, '2025-01-06', {'topics': '羽織の欠品が続き客単価が低下'})
+    manager.upsert_daily_entry(ray, '2025-01-07', trend='雨天で客数減', factors=['雨'])
+    manager.upsert_weekly_report(rsj, '2025-01-06', {'topics': '羽織の入荷で売上好調'})
+    manager.upsert_weekly_report(ray, '2025-01-13', {'topics': '初売りセール', 'impact_day': '1/13 セール最終日'})
+    manager.upsert_daily_entry(ray, '2025-01-14', trend='セール後の反動で客数が伸び悩み、ニットの動きも鈍い一日だった')
+    manager.upsert_weekly_report(rsj, '2025-01-20', {'topics': 'AND/OR NOT "限定" *印の商品は5%オフ'})
+    return manager
+
+
+def _weeks(results):
+    return [(result['store_name'], result['monday_date']) for result in results]
+
+
+def test_search_requires_all_terms(manager):
+    assert _weeks(manager.search_reports('羽織 欠品')) == [('RAY', '2025-01-06')]
+    assert sorted(_weeks(manager.search_reports('羽織'))) == [('RAY', '2025-01-06'), ('RSJ', '2025-01-06')]
+    assert manager.search_reports('羽織 セール') == []
+    assert manager.search_reports('   ') == []
+
+
+def test_single_character_terms(manager):
+    # 1文字の語は、その文字で始まる2文字の区切りとの前方一致で検索する
+    assert sorted(_weeks(manager.search_reports('羽'))) == [('RAY', '2025-01-06'), ('RSJ', '2025-01-06')]
+    # 日次の動向も検索対象
+    assert _weeks(manager.search_reports('雨')) == [('RAY', '2025-01-06')]
+    assert _weeks(manager.search_reports('羽 雨')) == [('RAY', '2025-01-06')]
+
+
+def test_symbols_are_matched_literally(manager):
+    # 引用符・*はFTS5の構文として解釈せず、文字として検索する
+    assert _weeks(manager.search_reports('"')) == [('RSJ', '2025-01-20')]
+    assert _weeks(manager.search_reports('*')) == [('RSJ', '2025-01-20')]
+    assert _weeks(manager.search_reports('"限定"')) == [('RSJ', '2025-01-20')]
+    assert _weeks(manager.search_reports('5%')) == [('RSJ', '2025-01-20')]
+    assert manager.search_reports('1%') == []
+
+
+def test_operators_are_searched_as_words(manager):
+    # AND・OR・NOTはFTS5の演算子ではなく語として検索する
+    assert _weeks(manager.search_reports('AND')) == [('RSJ', '2025-01-20')]
+    assert _weeks(manager.search_reports('OR NOT')) == [('RSJ', '2025-01-20')]
+    assert manager.search_reports('羽織 OR セール') == []
+    assert manager.search_reports('NOT 羽織') == []
+
+
+def test_store_filter(manager):
+    rsj = manager.get_store_id_by_name('RSJ')
+    assert _weeks(manager.search_reports('羽織', store_id=rsj)) == [('RSJ', '2025-01-06')]
+    assert _weeks(manager.search_reports('羽', store_id=rsj)) == [('RSJ', '2025-01-06')]
+
+
+def test_results_are_ranked_by_relevance(manager):
+    ray = manager.get_store_id_by_name('RAY')
+    # TOPICS・インパクト大に含まれる週を、日次の長い文中に1回含まれるだけの週より上位にする
+    manager.upsert_daily_entry(ray, '2025-01-28', trend='店頭ではセールの告知のみ行い、売場は通常通りで客数も平年並みの一日だった')
+    manager.upsert_weekly_report(ray, '2025-01-27', {'topics': '新作の入荷'})
+    results = manager.search_reports('セール')
+    assert _weeks(results)[0] == ('RAY', '2025-01-13')
+    assert ('RAY', '2025-01-27') in _weeks(results)
+    scores = [result['score'] for result in results]
+    assert scores == sorted(scores, reverse=True)
+    assert '**セール**' in results[0]['snippet']
+
+
+def test_like_fallback_without_fts(manager):
+    # 全文検索の索引がない場合もLIKEで同じ週を返す
+    manager._has_report_search = False
+    assert _weeks(manager.search_reports('羽織 欠品')) == [('RAY', '2025-01-06')]
+    assert _weeks(manager.search_reports('"')) == [('RSJ', '2025-01-20')]
+
+
+def test_list_weekly_reports_text_filter(manager):
+    reports, next_cursor = manager.list_weekly_reports(text='羽織')
+    assert sorted((report['store_name'], report['monday_date']) for report in reports) == [('RAY', '2025-01-06'), ('RSJ', '2025-01-06')]
+    assert next_cursor is None
+    reports, _ = manager.list_weekly_reports(text='羽 雨')
+    assert [(report['store_name'], report['monday_date']) for report in reports] == [('RAY', '2025-01-06')]
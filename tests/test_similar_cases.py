@@ -0,0 +1,92 @@
+"""similar_cases.py（類似ケース検索）のテスト"""
+from similar_cases import MAX_DELTA_DOCS, SimilarCaseIndex, build_case_terms, char_ngrams, kpi_tokens
+
+
+def _meta(name, store_name='RAY', month=1):
+    return {'name': name, 'store_name': store_name, 'month': month}
+
+
+def _documents():
+    return [
+        ('knit', char_ngrams('寒波でニットとコートが好調。羽織も売れた'), _meta('knit')),
+        ('sale', char_ngrams('セール初日で客数が多く、客単価は低下'), _meta('sale')),
+        ('rain', char_ngrams('雨天で入店客数が減少。傘の持ち込みが多い'), _meta('rain')),
+    ]
+
+
+def test_char_ngrams_normalizes_width_case_and_spaces():
+    assert char_ngrams('ＡＢ c') == ['ab', 'bc', 'abc']
+    assert char_ngrams('') == []
+
+
+def test_kpi_tokens_are_banded():
+    assert kpi_tokens('売上: 97%') == ['#kpi:売上:-5'] * 3
+    assert kpi_tokens('客数：１１２％\n不明な行') == ['#kpi:客数:10'] * 3
+    # 帯は±30ポイントで打ち切る
+    assert kpi_tokens('売上: 200%') == ['#kpi:売上:30'] * 3
+
+
+def test_build_case_terms_includes_every_field():
+    tokens = build_case_terms({'2025-01-06': {'trend': '好調', 'factors': ['寒波']}}, topics='初売り', quantitative_data='売上: 105%')
+    assert '好調' in tokens and '寒波' in tokens and '初売' in tokens
+    assert '#kpi:売上:5' in tokens
+
+
+def test_search_ranks_most_similar_first():
+    index = SimilarCaseIndex()
+    index.rebuild(_documents())
+    results = index.search(char_ngrams('ニットとコートが好調で客数が多い'), top_k=2)
+    assert results[0][1]['name'] == 'knit'
+    assert len(results) == 2
+    assert results[0][0] >= results[1][0]
+    assert index.search(char_ngrams('猛暑日'), top_k=3) == []
+
+
+def test_search_excludes_key_and_applies_boosts():
+    index = SimilarCaseIndex()
+    index.rebuild([
+        ('a', char_ngrams('セールで客数が多い'), _meta('a', store_name='RAY', month=1)),
+        ('b', char_ngrams('セールで客数が多い'), _meta('b', store_name='RSJ', month=7)),
+    ])
+    query = char_ngrams('セールで客数が多い')
+    # 同一店舗・同月のケースが上位になる
+    assert [meta['name'] for _, meta in index.search(query, store_name='RAY', month=1)] == ['a', 'b']
+    assert [meta['name'] for _, meta in index.search(query, store_name='RSJ', month=7)] == ['b', 'a']
+    assert [meta['name'] for _, meta in index.search(query, exclude_key='a')] == ['b']
+
+
+def test_upsert_and_remove():
+    index = SimilarCaseIndex()
+    index.rebuild(_documents())
+    index.upsert('rain', char_ngrams('猛暑で半袖が好調'), _meta('rain-updated'))
+    assert len(index) == 3
+    names = [meta['name'] for _, meta in index.search(char_ngrams('猛暑で半袖'))]
+    assert names[0] == 'rain-updated'
+    assert 'rain' not in names
+    index.remove('rain')
+    assert len(index) == 2
+    assert all(meta['name'] != 'rain-updated' for _, meta in index.search(char_ngrams('猛暑で半袖')))
+
+
+def test_delta_documents_rank_like_rebuilt_index():
+    # 差分として追加したドキュメントも、再構築した索引と同じく最も類似したケースとして検索される
+    # （差分には圧縮時点のIDFを使うため、スコアそのものは再構築後と一致しない）
+    extra = ('heat', char_ngrams('猛暑で半袖とサンダルが好調'), _meta('heat'))
+    delta_index = SimilarCaseIndex()
+    delta_index.rebuild(_documents())
+    delta_index.upsert(*extra)
+    rebuilt = SimilarCaseIndex()
+    rebuilt.rebuild(_documents() + [extra])
+    query = char_ngrams('猛暑で半袖とサンダル')
+    assert delta_index.search(query, top_k=1)[0][1]['name'] == 'heat'
+    assert rebuilt.search(query, top_k=1)[0][1]['name'] == 'heat'
+
+
+def test_many_upserts_trigger_compaction():
+    index = SimilarCaseIndex()
+    index.rebuild(_documents())
+    for i in range(MAX_DELTA_DOCS + 1):
+        index.upsert(('week', i), char_ngrams(f'週{i}の動向は好調'), _meta(f'week{i}'))
+    # 差分が上限を超えたため本体に取り込まれている
+    assert index._main_size == len(index)
+    assert index.search(char_ngrams('週3の動向'), top_k=1)[0][1]['name'] == 'week3'
@@ -0,0 +1,76 @@
+"""streaming_report.py（応答のJSONの逐次解析）のテスト"""
+import json
+import random
+
+from streaming_report import PartialReportParser, StreamProgress
+
+REPORT = {
+    'trend': '今週は寒波で「ニット」が好調。\n客数は前年比105%😀、\\記号/も含む',
+    'factors': ['寒波', ' 初売りセール ', '"引用"を含む要因'],
+    'questions': ['来週の入荷予定は？'],
+    'note': {'trend': '入れ子の値は対象外', 'factors': ['対象外']},
+}
+
+
+def _parse(chunks):
+    parser = PartialReportParser()
+    for chunk in chunks:
+        parser.feed(chunk)
+    return parser.partial
+
+
+def test_full_response_matches_json():
+    for ensure_ascii in (False, True):
+        text = json.dumps(REPORT, ensure_ascii=ensure_ascii)
+        partial = _parse([text])
+        assert partial['trend'] == REPORT['trend']
+        assert partial['factors'] == [factor.strip() for factor in REPORT['factors']]
+        assert partial['questions'] == REPORT['questions']
+
+
+def test_result_does_not_depend_on_chunking():
+    text = '```json\n' + json.dumps(REPORT, ensure_ascii=True, indent=2) + '\n```'
+    expected = _parse([text])
+    rng = random.Random(3)
+    for _ in range(20):
+        chunks = []
+        pos = 0
+        while pos < len(text):
+            size = rng.randint(1, 7)
+            chunks.append(text[pos:pos + size])
+            pos += size
+        assert _parse(chunks) == expected
+
+
+def test_partial_trend_and_completed_items_only():
+    parser = PartialReportParser()
+    assert parser.feed('{"trend": "今週は好') is False
+    assert parser.partial['trend'] == '今週は好'
+    assert parser.feed('調", "factors": ["寒波", "セー') is True
+    assert parser.partial == {'trend': '今週は好調', 'factors': ['寒波'], 'questions': []}
+    assert parser.feed('ル"]') is True
+    assert parser.partial['factors'] == ['寒波', 'セール']
+
+
+def test_stream_progress_throttles_updates():
+    updates = []
+    progress = StreamProgress(updates.append, interval_seconds=60)
+    text = json.dumps(REPORT, ensure_ascii=False)
+    for char in text:
+        progress.feed(char)
+    assert progress.finish() == text
+    assert progress.first_chunk_seconds is not None
+    # 初回と、要因・質問が書き終わるたび、最後の残りのみ反映する
+    assert len(updates) == 1 + len(REPORT['factors']) + len(REPORT['questions']) + 1
+    assert updates[-1]['trend'] == REPORT['trend']
+    # 渡した途中経過は後続の解析で書き換わらない
+    assert updates[1]['factors'] == ['寒波']
+
+
+def test_stream_progress_ignores_callback_errors():
+    def fail(partial):
+        raise RuntimeError('表示エラー')
+
+    progress = StreamProgress(fail, interval_seconds=0)
+    progress.feed('{"trend": "a"}')
+    assert progress.finish() == '{"trend": "a"}'
@@ -0,0 +1,86 @@
+"""sync_bus.py（同一プロセス内の同期バス）のテスト"""
+import threading
+
+from sync_bus import SyncBus, get_sync_bus
+
+STORE = 'RAY'
+MONDAY = '2025-01-06'
+
+
+def _change(seq, value, session='s1', field_type='topics', field_key='topics'):
+    return {'field_type': field_type, 'field_key': field_key, 'value': value,
+            'updated': '2025-01-06 10:00:00', 'session': session, 'seq': seq, 'base_seq': seq - 1}
+
+
+def test_publish_delivers_to_other_subscribers_only():
+    bus = SyncBus()
+    bus.subscribe('s1', STORE, MONDAY)
+    bus.subscribe('s2', STORE, MONDAY)
+    bus.publish(STORE, MONDAY, _change(1, 'A'))
+    assert bus.drain('s1', STORE, MONDAY) == {}
+    assert bus.drain('s2', STORE, MONDAY) == {
+        'topics': {'topics': {'value': 'A', 'updated': '2025-01-06 10:00:00', 'session': 's1', 'seq': 1, 'base_seq': 0}}
+    }
+    # 取り出した変更は再配信されない
+    assert not bus.has_pending('s2', STORE, MONDAY)
+    assert bus.drain('s2', STORE, MONDAY) == {}
+
+
+def test_queue_keeps_latest_change_per_field():
+    bus = SyncBus()
+    bus.subscribe('s2', STORE, MONDAY)
+    bus.publish(STORE, MONDAY, _change(2, 'B'))
+    # 遅れて届いた古い変更で上書きしない
+    bus.publish(STORE, MONDAY, _change(1, 'A'))
+    bus.publish(STORE, MONDAY, _change(3, '月曜', field_type='daily_trend', field_key='2025-01-06'))
+    drained = bus.drain('s2', STORE, MONDAY)
+    assert drained['topics']['topics']['value'] == 'B'
+    assert drained['daily_trend']['2025-01-06']['seq'] == 3
+    assert bus.get_stats() == {'subscriptions': 1, 'published': 3, 'delivered': 2}
+
+
+def test_changes_are_scoped_to_store_and_week():
+    bus = SyncBus()
+    bus.subscribe('s2', STORE, MONDAY)
+    bus.publish('RSJ', MONDAY, _change(1, 'A'))
+    bus.publish(STORE, '2025-01-13', _change(2, 'B'))
+    # 購読前の変更は配信されない
+    bus.publish(STORE, MONDAY, _change(3, 'C'))
+    bus.subscribe('s3', STORE, MONDAY)
+    assert not bus.has_pending('s3', STORE, MONDAY)
+    assert bus.drain('s2', STORE, MONDAY)['topics']['topics']['value'] == 'C'
+
+
+def test_unsubscribe_and_prune():
+    bus = SyncBus()
+    bus.subscribe('s1', STORE, MONDAY)
+    bus.subscribe('s1', STORE, '2025-01-13')
+    bus.subscribe('s2', STORE, MONDAY)
+    bus.unsubscribe('s1')
+    assert bus.get_stats()['subscriptions'] == 1
+    bus.publish(STORE, MONDAY, _change(1, 'A', session='s3'))
+    assert bus.drain('s1', STORE, MONDAY) == {}
+    # 受け取られていない購読は削除される
+    assert bus.prune(-1) == 1
+    assert bus.get_stats()['subscriptions'] == 0
+    assert bus.drain('s2', STORE, MONDAY) == {}
+
+
+def test_concurrent_publish_keeps_highest_seq():
+    bus = SyncBus()
+    bus.subscribe('s2', STORE, MONDAY)
+
+    def publish(start):
+        for seq in range(start, 400, 4):
+            bus.publish(STORE, MONDAY, _change(seq, str(seq)))
+
+    threads = [threading.Thread(target=publish, args=(start,)) for start in range(1, 5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert bus.drain('s2', STORE, MONDAY)['topics']['topics']['seq'] == 399
+
+
+def test_get_sync_bus_is_shared():
+    assert get_sync_bus() is get_sync_bus()
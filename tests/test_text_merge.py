@@ -0,0 +1,73 @@
+"""text_merge.py（テキストの3方向マージ）のテスト"""
+import random
+import time
+
+from text_merge import MAX_EDIT_DISTANCE, _apply_hunks, diff_hunks, three_way_merge
+
+
+def test_diff_hunks_roundtrip():
+    rng = random.Random(1)
+    alphabet = 'abcあいう'
+    for _ in range(2000):
+        base = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 30)))
+        other = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 30)))
+        assert _apply_hunks(base, 0, len(base), diff_hunks(base, other)) == other
+
+
+def test_diff_hunks_over_limit_is_single_replacement():
+    base = 'あ' * 10 + 'x' * 100 + 'い' * 10
+    other = 'あ' * 10 + 'y' * 100 + 'い' * 10
+    assert diff_hunks(base, other) == [(10, 110, 'y' * 100)]
+
+
+def test_merge_disjoint_edits():
+    base = '気温が高く、半袖が売れた。羽織は欠品。'
+    local = '気温がとても高く、半袖が売れた。羽織は欠品。'
+    remote = '気温が高く、半袖が売れた。羽織は欠品が続いた。'
+    assert three_way_merge(base, local, remote) == '気温がとても高く、半袖が売れた。羽織は欠品が続いた。'
+
+
+def test_merge_one_side_unchanged():
+    assert three_way_merge('abc', 'abc', 'abd') == 'abd'
+    assert three_way_merge('abc', 'abd', 'abc') == 'abd'
+    assert three_way_merge('abc', 'abd', 'abd') == 'abd'
+
+
+def test_merge_same_position_inserts_are_deterministic():
+    base = '売上好調。'
+    local = '売上好調。セール初日。'
+    remote = '売上好調。雨天。'
+    merged = three_way_merge(base, local, remote)
+    # どちらの端末で統合しても同じ結果になる
+    assert merged == three_way_merge(base, remote, local)
+    assert merged == '売上好調。セール初日。雨天。'
+
+
+def test_merge_conflicting_edits_returns_none():
+    assert three_way_merge('客数は多い', '客数は少ない', '客数は普通') is None
+
+
+def test_merge_400_chars_under_one_millisecond():
+    # 双方が元テキストから大きく離れた最悪の場合（差分の編集距離が上限に達する）でも1ミリ秒を十分下回ること
+    rng = random.Random(2)
+    alphabet = 'あいうえおかきくけこさしすせそ売上客数セール'
+    base = ''.join(rng.choice(alphabet) for _ in range(400))
+
+    def mutate(text, count, seed):
+        chars = list(text)
+        mutate_rng = random.Random(seed)
+        for _ in range(count):
+            chars[mutate_rng.randrange(len(chars))] = mutate_rng.choice(alphabet)
+        return ''.join(chars)
+
+    cases = [(mutate(base, count, seed), mutate(base, count, seed + 1)) for count in (5, MAX_EDIT_DISTANCE, 200) for seed in (1, 3)]
+    for local, remote in cases:
+        three_way_merge(base, local, remote)
+    repeat = 50
+    worst = 0.0
+    for local, remote in cases:
+        started = time.perf_counter()
+        for _ in range(repeat):
+            three_way_merge(base, local, remote)
+        worst = max(worst, (time.perf_counter() - started) / repeat)
+    assert worst < 0.001
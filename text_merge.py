@@ -0,0 +1,167 @@
+"""
+テキストの3方向マージ
+複数のデバイスで同時に編集された動向・TOPICS・インパクト大のテキストを、共通の元テキストとの差分から文字単位で統合する機能群
+"""
+from typing import List, Optional, Tuple
+
+# 差分の編集距離の上限。これを超える場合は、前後の共通部分を除いた範囲全体を1つの置換として扱う
+# （400文字程度のフィールドで1回のマージを1ミリ秒を十分下回る時間に抑えるため。同期の間隔内の入力は通常これより少ない）
+MAX_EDIT_DISTANCE = 24
+
+# (元テキストの開始位置, 元テキストの終了位置, 置き換え後のテキスト)。開始位置と終了位置が同じ場合は挿入
+Hunk = Tuple[int, int, str]
+
+
+def _myers_matches(a: str, b: str, max_d: int) -> Optional[List[Tuple[int, int, int]]]:
+    """Myersの差分アルゴリズムで一致する範囲 (aの開始位置, bの開始位置, 長さ) を先頭から順に返す
+
+    編集距離がmax_dを超える場合はNone。
+    各対角線kの到達位置は offset + k の位置に持つリストで管理し、探索履歴には各段階で使う範囲（-d〜d）のみを残す。
+    """
+    n, m = len(a), len(b)
+    if abs(n - m) > max_d:
+        # 編集距離は長さの差以上のため、探索せずに上限超過とする
+        return None
+    max_d = min(max_d, n + m)
+    offset = max_d + 1
+    v = [0] * (2 * max_d + 3)
+    trace = []
+    for d in range(max_d + 1):
+        trace.append(v[offset - d:offset + d + 1])
+        # i = offset + k（対角線kの到達位置の添字）
+        for i in range(offset - d, offset + d + 1, 2):
+            if i == offset - d or (i != offset + d and v[i - 1] < v[i + 1]):
+                x = v[i + 1]
+            else:
+                x = v[i - 1] + 1
+            y = x - i + offset
+            while x < n and y < m and a[x] == b[y]:
+                x += 1
+                y += 1
+            v[i] = x
+            if x >= n and y >= m:
+                return _backtrack(trace, n, m)
+    return None
+
+
+def _backtrack(trace: List[List[int]], x: int, y: int) -> List[Tuple[int, int, int]]:
+    """_myers_matchesの探索履歴から一致範囲をたどる（trace[d][d + k] が段階dの開始時点の対角線kの到達位置）"""
+    runs = []
+    for d in range(len(trace) - 1, 0, -1):
+        v = trace[d]
+        k = x - y
+        if k == -d or (k != d and v[d + k - 1] < v[d + k + 1]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = v[d + prev_k]
+        prev_y = prev_x - prev_k
+        # 1文字の挿入・削除の後に続く一致範囲
+        length = min(x - prev_x, y - prev_y)
+        if length > 0:
+            runs.append((x - length, y - length, length))
+        x, y = prev_x, prev_y
+    if x > 0:
+        runs.append((0, 0, x))
+    runs.reverse()
+    return runs
+
+
+def diff_hunks(base: str, other: str, max_edit_distance: int = MAX_EDIT_DISTANCE) -> List[Hunk]:
+    """baseをotherに変換する変更箇所の一覧を元テキストの位置順に返す"""
+    # 前後の共通部分は差分計算の対象から外す（通常の編集では差分計算の範囲が数文字になる）
+    prefix = 0
+    limit = min(len(base), len(other))
+    while prefix < limit and base[prefix] == other[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix and base[-1 - suffix] == other[-1 - suffix]:
+        suffix += 1
+    a = base[prefix:len(base) - suffix]
+    b = other[prefix:len(other) - suffix]
+    if not a and not b:
+        return []
+    if not a or not b:
+        return [(prefix, prefix + len(a), b)]
+
+    matches = _myers_matches(a, b, max_edit_distance)
+    if matches is None:
+        return [(prefix, prefix + len(a), b)]
+
+    hunks = []
+    ai = bi = 0
+    for mx, my, length in matches + [(len(a), len(b), 0)]:
+        if mx > ai or my > bi:
+            hunks.append((prefix + ai, prefix + mx, b[bi:my]))
+        ai, bi = mx + length, my + length
+    return hunks
+
+
+def _apply_hunks(base: str, start: int, end: int, hunks: List[Hunk]) -> str:
+    """base[start:end] の範囲に変更箇所を適用したテキストを返す"""
+    parts = []
+    pos = start
+    for hunk_start, hunk_end, text in hunks:
+        parts.append(base[pos:hunk_start])
+        parts.append(text)
+        pos = hunk_end
+    parts.append(base[pos:end])
+    return "".join(parts)
+
+
+def three_way_merge(base: str, local: str, remote: str) -> Optional[str]:
+    """共通の元テキストbaseに対するlocal・remoteの変更を統合したテキストを返す
+
+    同じ範囲を双方が異なる内容に変更していて自動で統合できない場合はNone。
+    同じ位置への挿入は、一方がもう一方を含む場合は長い方を、それ以外は両方を（どちらの端末でも
+    同じ結果になるよう文字列順に）並べて残す。
+    """
+    if local == remote or remote == base:
+        return local
+    if local == base:
+        return remote
+
+    tagged = sorted(
+        [(start, end, 0, text) for start, end, text in diff_hunks(base, local)] +
+        [(start, end, 1, text) for start, end, text in diff_hunks(base, remote)]
+    )
+
+    # 範囲が重なる（または同じ位置に挿入する）変更をまとめる
+    groups = []
+    for hunk in tagged:
+        start, end = hunk[0], hunk[1]
+        if groups:
+            group = groups[-1]
+            group_start, group_end = group[0], group[1]
+            if start < group_end or (start == group_end and start == end and group_start == group_end):
+                group[1] = max(group_end, end)
+                group[2].append(hunk)
+                continue
+        groups.append([start, end, [hunk]])
+
+    parts = []
+    pos = 0
+    for group_start, group_end, hunks in groups:
+        local_hunks = [(start, end, text) for start, end, side, text in hunks if side == 0]
+        remote_hunks = [(start, end, text) for start, end, side, text in hunks if side == 1]
+        if not remote_hunks or local_hunks == remote_hunks:
+            replacement = _apply_hunks(base, group_start, group_end, local_hunks)
+        elif not local_hunks:
+            replacement = _apply_hunks(base, group_start, group_end, remote_hunks)
+        elif group_start == group_end:
+            # 双方が同じ位置に挿入
+            local_text = "".join(text for _, _, text in local_hunks)
+            remote_text = "".join(text for _, _, text in remote_hunks)
+            if remote_text in local_text:
+                replacement = local_text
+            elif local_text in remote_text:
+                replacement = remote_text
+            else:
+                replacement = min(local_text, remote_text) + max(local_text, remote_text)
+        else:
+            return None
+        parts.append(base[pos:group_start])
+        parts.append(replacement)
+        pos = group_end
+    parts.append(base[pos:])
+    return "".join(parts)